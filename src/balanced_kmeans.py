@@ -0,0 +1,209 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from districting_engine import group_members
+from elecetions_constatns import ElectionsConstants
+
+# Number of closest centers every ballot can be assigned to, keeps the assignment O(n) in memory for many seats
+CANDIDATES = 16
+# Ballots per chunk of the distances computation
+CHUNK_SIZE = 8192
+# Above this number of ballots the initial centers are computed with MiniBatchKMeans
+MINIBATCH_THRESHOLD = 50_000
+
+
+def candidate_centers(points: np.ndarray, centers: np.ndarray, candidates: int = CANDIDATES,
+                      max_workers: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the closest centers of every point.
+    The points are split into chunks computed in parallel threads, NumPy releases the GIL in the matrix product.
+    :param points: (n, 2) coordinates
+    :param centers: (k, 2) coordinates
+    :param candidates: number of closest centers to keep per point
+    :param max_workers: number of threads, default is the number of cores
+    :return: (n, candidates) centers indices ordered by distance, and their squared distances
+    """
+    candidates = min(candidates, len(centers))
+    centers_norm = (centers ** 2).sum(axis=1)
+
+    def chunk_candidates(start: int) -> tuple[np.ndarray, np.ndarray]:
+        chunk = points[start:start + CHUNK_SIZE]
+        distances = (chunk ** 2).sum(axis=1)[:, None] - 2 * chunk @ centers.T + centers_norm[None, :]
+        if candidates < len(centers):
+            closest = np.argpartition(distances, candidates - 1, axis=1)[:, :candidates]
+        else:
+            closest = np.broadcast_to(np.arange(len(centers)), distances.shape)
+        closest_distances = np.maximum(np.take_along_axis(distances, closest, axis=1), 0)
+        order = np.argsort(closest_distances, axis=1, kind='stable')
+        return np.take_along_axis(closest, order, axis=1), np.take_along_axis(closest_distances, order, axis=1)
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        chunks = list(executor.map(chunk_candidates, range(0, len(points), CHUNK_SIZE)))
+    return np.concatenate([chunk[0] for chunk in chunks]), np.concatenate([chunk[1] for chunk in chunks])
+
+
+def initial_centers(points: np.ndarray, weights: np.ndarray, k: int, seed: int) -> np.ndarray:
+    """
+    Weighted k-means centers, the starting point of the balanced assignment.
+    """
+    # scikit-learn is only needed by this districting mode
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
+    if len(points) > MINIBATCH_THRESHOLD:
+        kmeans = MiniBatchKMeans(n_clusters=k, random_state=seed, batch_size=4096, n_init=3)
+    else:
+        kmeans = KMeans(n_clusters=k, random_state=seed, n_init=1)
+    return kmeans.fit(points, sample_weight=weights).cluster_centers_
+
+
+def price_assignment(candidates: np.ndarray, distances: np.ndarray, weights: np.ndarray, k: int, lower: float,
+                     upper: float, prices: np.ndarray, max_iterations: int = 500) -> np.ndarray:
+    """
+    Assign every point to the candidate center with the lowest distance plus price, adjusting the prices of the
+    centers until their loads are within the bounds: overloaded centers get more expensive and underloaded ones
+    cheaper. Every center has its own price step, growing while its load stays on the same side of the quota and
+    shrinking when it crosses it. Every iteration is a vectorized pass over the points.
+    :param candidates: (n, m) candidate centers of every point
+    :param distances: (n, m) squared distances to the candidates
+    :param weights: the weight of every point
+    :param k: number of centers
+    :param lower: minimal load of a center
+    :param upper: maximal load of a center
+    :param prices: the price of every center, updated in place
+    :param max_iterations: maximal number of price updates, 0 to assign every point to its closest candidate
+    :return: the candidate column every point is assigned to
+    """
+    choice = np.zeros(len(candidates), dtype=np.int64)
+    quota = weights.sum() / k
+    rows = np.arange(len(candidates))
+    # The price steps are in the units of the distances: the typical gap between the two closest centers
+    gaps = distances[:, 1] - distances[:, 0] if distances.shape[1] > 1 else np.zeros(1)
+    steps = np.full(k, np.median(gaps) + 1e-12)
+    previous = np.zeros(k)
+    for _ in range(max_iterations):
+        choice = np.argmin(distances + prices[candidates], axis=1)
+        loads = np.bincount(candidates[rows, choice], weights=weights, minlength=k)
+        if ((loads >= lower) & (loads <= upper)).all():
+            break
+        # Centers within the bounds keep their price, the others move towards the quota
+        direction = np.where((loads >= lower) & (loads <= upper), 0, np.sign(loads - quota))
+        steps = np.where(direction * previous > 0, steps * 1.2, np.where(direction * previous < 0, steps * 0.5,
+                                                                         steps))
+        prices += direction * steps
+        previous = np.where(direction != 0, direction, previous)
+    return choice
+
+
+def repair_assignment(candidates: np.ndarray, distances: np.ndarray, weights: np.ndarray, choice: np.ndarray, k: int,
+                      lower: float, upper: float, max_moves: int = None) -> np.ndarray:
+    """
+    Move single points between candidate centers until every center load is within the bounds.
+    Every move takes the point with the smallest distance increase that does not push a center out of the bounds,
+    neither the center it leaves nor the center it joins. Centers without such a move are skipped until a move changes
+    the loads around them.
+    :return: the center of every point
+    """
+    rows = np.arange(len(candidates))
+    labels = candidates[rows, choice]
+    current = distances[rows, choice]
+    loads = np.bincount(labels, weights=weights, minlength=k)
+    # The points (and candidate columns) every center is a candidate of
+    members, offsets = group_members(candidates.ravel())
+    blocked = np.zeros(k, dtype=bool)
+    for _ in range(max_moves or len(labels)):
+        violations = np.where(blocked, 0, np.maximum(loads - upper, 0) + np.maximum(lower - loads, 0))
+        center = int(np.argmax(violations))
+        if violations[center] == 0:
+            break
+        near = members[offsets[center]:offsets[center + 1]]
+        points, columns = np.divmod(near, candidates.shape[1])
+        if loads[center] > upper:
+            # Move a point of the overloaded center to a candidate center with room for it
+            points = points[labels[points] == center]
+            targets = candidates[points]
+            cost = np.where((loads[targets] + weights[points, None] <= upper) & (targets != center),
+                            distances[points] - current[points, None], np.inf)
+        else:
+            # Take a point of a candidate center that stays above the lower bound without it, and that the
+            # underloaded center has room for
+            own = labels[points] != center
+            points, columns = points[own], columns[own]
+            targets = np.full((len(points), 1), center)
+            room = (loads[labels[points]] - weights[points] >= lower) & (loads[center] + weights[points] <= upper)
+            cost = np.where(room, distances[points, columns] - current[points], np.inf)[:, None]
+        if not len(points) or not np.isfinite(cost).any():
+            blocked[center] = True
+            continue
+        point, column = np.unravel_index(np.argmin(cost), cost.shape)
+        ballot, target = points[point], targets[point, column]
+        loads[labels[ballot]] -= weights[ballot]
+        loads[target] += weights[ballot]
+        labels[ballot] = target
+        current[ballot] = distances[ballot, np.flatnonzero(candidates[ballot] == target)[0]]
+        blocked[candidates[ballot]] = False
+    return labels
+
+
+def balanced_kmeans(lat: np.ndarray, lng: np.ndarray, voters: np.ndarray,
+                    number_of_seats: int = ElectionsConstants.NUMBER_OF_SEATS,
+                    variance: float = ElectionsConstants.DISTRICT_VOTE_VARIANCE,
+                    max_iterations: int = 20, seed: int = 0, max_workers: int = None,
+                    allow_out_of_bounds: bool = False) -> np.ndarray:
+    """
+    Split the ballots into number_of_seats clusters weighted by the registered voters, with the voters of every
+    cluster within variance of the single seat quota.
+    The clusters start from a weighted (minibatch) k-means. Every iteration then assigns the ballots to their closest
+    centers under the voters bounds, with prices on the centers (price_assignment) and single ballot moves for
+    the remaining violations (repair_assignment), and moves the centers to the weighted means of their clusters.
+    The result is the assignment of the last iteration with the fewest voters out of the bounds, as moving the
+    centers can break the bounds an earlier iteration met.
+    The distances are computed in parallel chunks, for the closest CANDIDATES centers of every ballot only.
+    :param lat: latitude per ballot
+    :param lng: longitude per ballot
+    :param voters: registered voters per ballot
+    :param number_of_seats: number of clusters
+    :param variance: allowed relative deviation from the single seat quota, in both directions
+    :param max_iterations: maximal number of center updates, at least 1
+    :param seed: the random seed of the initial centers
+    :param max_workers: number of threads of the distances computation, default is the number of cores
+    :param allow_out_of_bounds: whether to return clusters out of the bounds, with a warning, instead of raising
+    :return: the cluster of every ballot
+    """
+    points = np.column_stack([lat, lng]).astype(np.float64)
+    weights = np.asarray(voters, dtype=np.float64)
+    if max_iterations < 1:
+        raise Exception(f'The balanced k-means needs at least 1 iteration, got {max_iterations}')
+    if len(points) < number_of_seats:
+        raise Exception(f'Cannot split {len(points)} ballots into {number_of_seats} districts')
+    quota = weights.sum() / number_of_seats
+    lower, upper = quota * (1 - variance), quota * (1 + variance)
+
+    centers = initial_centers(points, weights, number_of_seats, seed)
+    prices = np.zeros(number_of_seats)
+    labels = None
+    best_labels, best_violation = None, np.inf
+    for iteration in range(max_iterations):
+        candidates, distances = candidate_centers(points, centers, max_workers=max_workers)
+        choice = price_assignment(candidates, distances, weights, number_of_seats, lower, upper, prices)
+        new_labels = repair_assignment(candidates, distances, weights, choice, number_of_seats, lower, upper)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        loads = np.bincount(labels, weights=weights, minlength=number_of_seats)
+        violation = (np.maximum(loads - upper, 0) + np.maximum(lower - loads, 0)).sum()
+        if violation <= best_violation:
+            best_labels, best_violation = labels, violation
+        for axis in range(2):
+            sums = np.bincount(labels, weights=weights * points[:, axis], minlength=number_of_seats)
+            centers[:, axis] = np.where(loads > 0, sums / np.maximum(loads, 1), centers[:, axis])
+
+    loads = np.bincount(best_labels, weights=weights, minlength=number_of_seats)
+    out_of_bounds = ((loads < lower) | (loads > upper)).sum()
+    if out_of_bounds:
+        message = f'{out_of_bounds} districts are not within {variance} of the single seat quota'
+        if not allow_out_of_bounds:
+            raise Exception(message)
+        print(message)
+    return best_labels
@@ -0,0 +1,138 @@
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from districing import get_cities_districts_fast, pre_process_data
+from elecetions_constatns import ElectionsConstants
+
+BENCHMARK_SIZES = [1_000, 10_000, 100_000]
+# Sizes that take minutes and gigabytes per case, only run when asked for, see run_benchmarks
+LARGE_BENCHMARK_SIZES = [1_000_000]
+BENCHMARK_SEATS = [10, 120, 1000]
+# Bounding box of the synthetic ballots coordinates, roughly the one of Israel
+LAT_RANGE = (29.5, 33.3)
+LNG_RANGE = (34.3, 35.9)
+
+
+def synthetic_ballots(stations: int, towns: int = None, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a synthetic ballots table with the columns of the ElectionsConstants.BALLOTS_WITH_COORDINATES_FILLED_PATH
+    table the districting uses.
+    The towns sizes follow a power law, like the real towns (a few big cities and many small towns), and the ballots
+    of every town are clustered around the town center, with a spread growing with the town size.
+    :param stations: number of ballot stations
+    :param towns: number of towns, default is a town per 10 stations
+    :param seed: the random seed
+    :return: the ballots DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    towns = towns or max(stations // 10, 1)
+    town_weights = 1 / np.arange(1, towns + 1)
+    town_codes = np.sort(rng.choice(towns, size=stations, p=town_weights / town_weights.sum()))
+    town_sizes = np.bincount(town_codes, minlength=towns)
+    centers_lat = rng.uniform(*LAT_RANGE, size=towns)
+    centers_lng = rng.uniform(*LNG_RANGE, size=towns)
+    spread = 0.002 * np.sqrt(np.maximum(town_sizes, 1))
+    # The cluster number of a ballot within its town, a cluster per ballot, the ballot ids are unique
+    clusters = np.arange(stations) - np.repeat(np.cumsum(town_sizes) - town_sizes, town_sizes)
+    return pd.DataFrame({
+        ElectionsConstants.TOWN_NAME: pd.Categorical.from_codes(town_codes, [f'town {town}' for town in range(towns)]),
+        ElectionsConstants.BALLOTS_CLUSTER: clusters + 1,
+        ElectionsConstants.BALLOT_ID: np.arange(stations) + 1,
+        ElectionsConstants.REGISTRED_VOTERS: rng.integers(50, 1000, size=stations),
+        ElectionsConstants.LAT: centers_lat[town_codes] + rng.normal(0, spread[town_codes]),
+        ElectionsConstants.LNG: centers_lng[town_codes] + rng.normal(0, spread[town_codes]),
+    })
+
+
+def peak_memory_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if platform.system() == 'Darwin' else peak / (1 << 10)
+
+
+def benchmark_case(stations: int, seats: int, seed: int = 0) -> dict:
+    """
+    Run the districting entry point on a synthetic ballots table, meant to run in a fresh process so the peak memory
+    is the peak of a single case.
+    :param stations: number of ballot stations
+    :param seats: number of seats
+    :param seed: the random seed of the synthetic ballots
+    :return: a result row
+    """
+    ballots = pre_process_data(synthetic_ballots(stations, seed=seed))
+    memory_before = peak_memory_mb()
+    start = time.perf_counter()
+    ballots = get_cities_districts_fast(ballots, number_of_seats=seats, output_path=None)
+    seconds = time.perf_counter() - start
+    assigned = int(ballots[ElectionsConstants.DISTRICT].notnull().sum())
+    return {'stations': stations,
+            'seats': seats,
+            'seed': seed,
+            'seconds': seconds,
+            'assigned_ballots': assigned,
+            'districts': int(ballots[ElectionsConstants.DISTRICT].nunique()),
+            'microseconds_per_ballot': seconds / max(assigned, 1) * 1e6,
+            'peak_memory_mb': peak_memory_mb(),
+            'input_peak_memory_mb': memory_before}
+
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes: list[int] = None, seats: list[int] = None, seed: int = 0, output_path: str = None,
+                   large: bool = False) -> dict:
+    """
+    Benchmark the districting on synthetic ballots for every combination of size and seats.
+    Every case runs in a fresh process, so the peak memory of a case is not hidden by the peak of a previous case.
+    The results are saved as JSON, with the commit and the environment, to compare the scaling across changes.
+    :param sizes: numbers of ballot stations, default is BENCHMARK_SIZES
+    :param seats: numbers of seats, default is BENCHMARK_SEATS
+    :param seed: the random seed of the synthetic ballots
+    :param output_path: the JSON file, default is a timestamped file in the ElectionsConstants.BENCHMARKS_PATH directory
+    :param large: whether to add the LARGE_BENCHMARK_SIZES to the default sizes, from the command line with --large
+    :return: the benchmark report
+    """
+    sizes = sizes or BENCHMARK_SIZES + (LARGE_BENCHMARK_SIZES if large else [])
+    report = {'benchmark': 'districting',
+              'entry_point': 'districing.get_cities_districts_fast',
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'commit': get_git_commit(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'pandas': pd.__version__,
+              'machine': platform.machine(),
+              'cpus': os.cpu_count(),
+              'results': []}
+    for stations in sizes:
+        for number_of_seats in seats or BENCHMARK_SEATS:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                result = executor.submit(benchmark_case, stations, number_of_seats, seed).result()
+            print(f"{stations} stations, {number_of_seats} seats: {result['seconds']:.2f} seconds, "
+                  f"{result['microseconds_per_ballot']:.1f} us per ballot, {result['peak_memory_mb']:.0f} MB")
+            report['results'].append(result)
+
+    if output_path is None:
+        os.makedirs(ElectionsConstants.BENCHMARKS_PATH, exist_ok=True)
+        output_path = f"{ElectionsConstants.BENCHMARKS_PATH}/districting_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    return report
+
+
+if __name__ == '__main__':
+    run_benchmarks(large='--large' in sys.argv[1:])
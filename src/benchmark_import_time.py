@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+
+# Modules to benchmark, with the heavy dependencies they must not import
+BENCHMARK_MODULES = {
+    'download_locations': ['selenium', 'googlemaps', 'sklearn'],
+    'districing': ['selenium', 'googlemaps', 'sklearn'],
+    'geocoding': ['googlemaps'],
+    'table_store': ['selenium', 'googlemaps', 'sklearn'],
+    'pipeline': ['selenium', 'googlemaps', 'sklearn'],
+    'scenarios': ['selenium', 'googlemaps', 'sklearn'],
+    'districting_engine': ['selenium', 'googlemaps', 'sklearn'],
+}
+# pandas and numpy are needed by every data module, so they are imported before the measurement
+BASELINE_IMPORTS = 'import numpy, pandas'
+MAX_IMPORT_MILLISECONDS = 100
+REPEATS = 5
+
+MEASURE_SCRIPT = '''
+import json, sys, time
+{baseline}
+start = time.perf_counter()
+import {module}
+milliseconds = (time.perf_counter() - start) * 1000
+print(json.dumps({{'milliseconds': milliseconds, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def measure_import(module: str) -> dict:
+    """
+    Import a module in a fresh interpreter, after the baseline imports.
+    :param module: the module name
+    :return: the import time in milliseconds and the names of the loaded modules
+    """
+    source_path = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, '-c', MEASURE_SCRIPT.format(baseline=BASELINE_IMPORTS, module=module)],
+                            capture_output=True, text=True, cwd=source_path, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark_imports(modules: dict[str, list[str]] = None, repeats: int = REPEATS,
+                      max_milliseconds: float = MAX_IMPORT_MILLISECONDS) -> list[dict]:
+    """
+    Measure the import time of the modules and check they do not import heavy dependencies.
+    :param modules: the modules to benchmark and their forbidden dependencies, default is BENCHMARK_MODULES
+    :param repeats: number of fresh interpreters per module, the fastest import is reported
+    :param max_milliseconds: maximal import time of a module, on top of the baseline imports
+    :return: a result row per module
+    """
+    results = []
+    for module, forbidden in (modules or BENCHMARK_MODULES).items():
+        measurements = [measure_import(module) for _ in range(repeats)]
+        loaded = {name.split('.')[0] for name in measurements[0]['modules']}
+        milliseconds = min(measurement['milliseconds'] for measurement in measurements)
+        heavy = [dependency for dependency in forbidden if dependency in loaded]
+        results.append({'module': module, 'milliseconds': round(milliseconds, 2), 'heavy_imports': heavy,
+                        'passed': milliseconds <= max_milliseconds and not heavy})
+    return results
+
+
+if __name__ == '__main__':
+    results = benchmark_imports()
+    for result in results:
+        print(f"{result['module']}: {result['milliseconds']} ms, heavy imports: {result['heavy_imports'] or None}, "
+              f"{'passed' if result['passed'] else 'FAILED'}")
+    sys.exit(0 if all(result['passed'] for result in results) else 1)
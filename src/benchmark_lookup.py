@@ -0,0 +1,208 @@
+import http.client
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+
+from benchmark_districting import get_git_commit, synthetic_ballots
+from district_lookup import DistrictLookup, DistrictLookupService, make_server
+from elecetions_constatns import ElectionsConstants
+from table_store import write_table
+
+BENCHMARK_STATIONS = 100_000
+BENCHMARK_CLIENTS = 8
+BENCHMARK_REQUESTS = 5_000
+BENCHMARK_BATCH_SIZE = 1_000
+
+
+def synthetic_districting(stations: int, seats: int = ElectionsConstants.NUMBER_OF_SEATS,
+                          seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic ballots (see benchmark_districting.synthetic_ballots) with a district column. The lookup does not
+    depend on how the districts were built, so the districts are contiguous ranges of towns.
+    """
+    ballots = synthetic_ballots(stations, seed=seed)
+    ballots[ElectionsConstants.DISTRICT] = ballots[ElectionsConstants.TOWN_NAME].cat.codes.to_numpy() * seats // \
+        len(ballots[ElectionsConstants.TOWN_NAME].cat.categories)
+    return ballots
+
+
+def latency_summary(seconds: list[float]) -> dict:
+    """
+    :param seconds: the latency of every request
+    :return: the latency percentiles in milliseconds
+    """
+    milliseconds = np.array(seconds) * 1000
+    return {'requests': len(milliseconds),
+            'mean_ms': float(milliseconds.mean()),
+            'p50_ms': float(np.percentile(milliseconds, 50)),
+            'p95_ms': float(np.percentile(milliseconds, 95)),
+            'p99_ms': float(np.percentile(milliseconds, 99)),
+            'max_ms': float(milliseconds.max())}
+
+
+def benchmark_api(lookup: DistrictLookup, ballots: pd.DataFrame, queries: int, batch_size: int, seed: int) -> dict:
+    """
+    Measure the Python API: single and batched queries of random ballot stations and random points.
+    """
+    rng = np.random.default_rng(seed)
+    sample = ballots.iloc[rng.integers(len(ballots), size=queries)]
+    towns = sample[ElectionsConstants.TOWN_NAME].astype(object).tolist()
+    ballot_ids = sample[ElectionsConstants.BALLOT_ID].tolist()
+    lat = sample[ElectionsConstants.LAT].to_numpy() + rng.normal(0, 0.01, size=queries)
+    lng = sample[ElectionsConstants.LNG].to_numpy() + rng.normal(0, 0.01, size=queries)
+
+    start = time.perf_counter()
+    for town, ballot_id in zip(towns, ballot_ids):
+        lookup.district_of_ballot(town, ballot_id)
+    ballot_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for point_lat, point_lng in zip(lat.tolist(), lng.tolist()):
+        lookup.district_of_point(point_lat, point_lng)
+    point_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for batch in range(0, queries, batch_size):
+        lookup.districts_of_ballots(towns[batch:batch + batch_size], ballot_ids[batch:batch + batch_size])
+    ballots_batch_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for batch in range(0, queries, batch_size):
+        lookup.districts_of_points(lat[batch:batch + batch_size], lng[batch:batch + batch_size])
+    points_batch_seconds = time.perf_counter() - start
+    return {'queries': queries,
+            'batch_size': batch_size,
+            'ballot_microseconds': ballot_seconds / queries * 1e6,
+            'point_microseconds': point_seconds / queries * 1e6,
+            'batched_ballot_microseconds': ballots_batch_seconds / queries * 1e6,
+            'batched_point_microseconds': points_batch_seconds / queries * 1e6}
+
+
+def load_test(port: int, requests: list[tuple[str, str, bytes | None]], clients: int) -> dict:
+    """
+    Send the requests to the server from concurrent clients, every client on its own keep-alive connection.
+    :param port: the server port on the local host
+    :param requests: the (method, url, body) of every request
+    :param clients: number of concurrent clients
+    :return: the throughput and the latency percentiles
+    """
+    def client(client_requests: list) -> list[float]:
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        latencies = []
+        for method, url, body in client_requests:
+            start = time.perf_counter()
+            connection.request(method, url, body=body, headers={'Content-Type': 'application/json'} if body else {})
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.status != 200:
+                raise Exception(f'{method} {url} failed with status {response.status}')
+        connection.close()
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = [latency for result in executor.map(client, [requests[i::clients] for i in range(clients)])
+                     for latency in result]
+    seconds = time.perf_counter() - start
+    return {'clients': clients, 'requests_per_second': len(requests) / seconds, **latency_summary(latencies)}
+
+
+def benchmark_reload(service: DistrictLookupService, ballots: pd.DataFrame, path: str, timeout: float = 60) -> float:
+    """
+    Write a new districting table and measure the seconds until the service answers with the new districts.
+    """
+    ballots = ballots.assign(**{ElectionsConstants.DISTRICT: ballots[ElectionsConstants.DISTRICT] + 1})
+    town = ballots[ElectionsConstants.TOWN_NAME].astype(object).iloc[0]
+    ballot_id = ballots[ElectionsConstants.BALLOT_ID].iloc[0]
+    expected = int(ballots[ElectionsConstants.DISTRICT].iloc[0])
+    start = time.perf_counter()
+    write_table(ballots, path)
+    while service.lookup.district_of_ballot(town, ballot_id) != expected:
+        if time.perf_counter() - start > timeout:
+            raise Exception(f'The lookup was not reloaded after {timeout} seconds')
+        time.sleep(0.01)
+    return time.perf_counter() - start
+
+
+def run_benchmark(stations: int = BENCHMARK_STATIONS, clients: int = BENCHMARK_CLIENTS,
+                  requests: int = BENCHMARK_REQUESTS, batch_size: int = BENCHMARK_BATCH_SIZE, seed: int = 0,
+                  output_path: str = None) -> dict:
+    """
+    Benchmark the districts lookup on a synthetic districting: the index build, the Python API, the HTTP server
+    under concurrent single and batched requests, and the hot reload of a new districting file.
+    :param stations: number of ballot stations
+    :param clients: number of concurrent HTTP clients
+    :param requests: number of HTTP requests of every kind
+    :param batch_size: number of queries per batched request
+    :param seed: the random seed
+    :param output_path: the JSON file, default is a timestamped file in the ElectionsConstants.BENCHMARKS_PATH directory
+    :return: the benchmark report
+    """
+    ballots = synthetic_districting(stations, seed=seed)
+    report = {'benchmark': 'district_lookup',
+              'entry_point': 'district_lookup.DistrictLookupService',
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'commit': get_git_commit(),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'pandas': pd.__version__,
+              'machine': platform.machine(),
+              'cpus': os.cpu_count(),
+              'stations': stations}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = f'{directory}/ballots_with_districts.csv'
+        write_table(ballots, path)
+        start = time.perf_counter()
+        service = DistrictLookupService(path, reload_seconds=0.1)
+        report['load_seconds'] = time.perf_counter() - start
+        report['api'] = benchmark_api(service.lookup, ballots, requests, batch_size, seed)
+        print(f"Loaded {stations} stations in {report['load_seconds']:.2f} seconds, "
+              f"{report['api']['ballot_microseconds']:.1f} us per ballot query, "
+              f"{report['api']['point_microseconds']:.1f} us per point query")
+
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        service.start_watching()
+        try:
+            rng = np.random.default_rng(seed)
+            sample = ballots.iloc[rng.integers(len(ballots), size=requests)]
+            towns = sample[ElectionsConstants.TOWN_NAME].astype(object).tolist()
+            ballot_ids = sample[ElectionsConstants.BALLOT_ID].tolist()
+            lat = sample[ElectionsConstants.LAT].tolist()
+            lng = sample[ElectionsConstants.LNG].tolist()
+            batch = json.dumps({'ballots': {'town': towns[:batch_size], 'ballot_id': ballot_ids[:batch_size]},
+                                'points': {'lat': lat[:batch_size], 'lng': lng[:batch_size]}}).encode('utf-8')
+            cases = {'ballot': [('GET', f"/ballot?{urlencode({'town': town, 'ballot_id': ballot_id})}", None)
+                                for town, ballot_id in zip(towns, ballot_ids)],
+                     'point': [('GET', f'/point?lat={point_lat}&lng={point_lng}', None)
+                               for point_lat, point_lng in zip(lat, lng)],
+                     'batch': [('POST', '/batch', batch)] * max(requests // batch_size, 1)}
+            report['http'] = {}
+            for name, case_requests in cases.items():
+                report['http'][name] = load_test(server.server_port, case_requests, clients)
+                print(f"HTTP {name}: {report['http'][name]['requests_per_second']:.0f} requests per second, "
+                      f"p50 {report['http'][name]['p50_ms']:.2f} ms, p99 {report['http'][name]['p99_ms']:.2f} ms")
+            report['reload_seconds'] = benchmark_reload(service, ballots, path)
+            print(f"Reloaded a new districting in {report['reload_seconds']:.2f} seconds")
+        finally:
+            service.stop_watching()
+            server.shutdown()
+            server.server_close()
+
+    if output_path is None:
+        os.makedirs(ElectionsConstants.BENCHMARKS_PATH, exist_ok=True)
+        output_path = f"{ElectionsConstants.BENCHMARKS_PATH}/lookup_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    return report
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -1,12 +1,19 @@
+import numpy as np
 import pandas as pd
 
-from sklearn.cluster import KMeans
-
+from balanced_kmeans import balanced_kmeans
+from districting_engine import DistrictingEngine, UNASSIGNED
+from districting_telemetry import NO_TELEMETRY, DistrictingTelemetry, NoTelemetry, print_progress
 from elecetions_constatns import ElectionsConstants
+from table_store import read_table, write_table
+
+# The columns the districting needs, when the other ballots columns are not needed in the output
+DISTRICTING_COLUMNS = [ElectionsConstants.TOWN_NAME, ElectionsConstants.BALLOT_ID,
+                       ElectionsConstants.REGISTRED_VOTERS, ElectionsConstants.LAT, ElectionsConstants.LNG]
 
 
-def load_data() -> pd.DataFrame:
-    return pd.read_csv(ElectionsConstants.BALLOTS_WITH_COORDINATES_FILLED_PATH)
+def load_data(columns: list[str] = None) -> pd.DataFrame:
+    return read_table(ElectionsConstants.BALLOTS_WITH_COORDINATES_FILLED_PATH, columns=columns)
 
 
 def pre_process_data(ballots: pd.DataFrame) -> pd.DataFrame:
@@ -15,36 +22,50 @@ def pre_process_data(ballots: pd.DataFrame) -> pd.DataFrame:
 
 
 def get_cities(ballots: pd.DataFrame) -> pd.DataFrame:
-    return ballots.groupby([ElectionsConstants.TOWN_NAME]).sum().reset_index()\
+    return ballots.groupby([ElectionsConstants.TOWN_NAME], observed=True).sum(numeric_only=True).reset_index()\
         .sort_values(by=ElectionsConstants.REGISTRED_VOTERS, ascending=False)
 
 
-def get_cities_districts(ballots: pd.DataFrame) -> pd.DataFrame:
+def get_cities_districts(ballots: pd.DataFrame, telemetry: NoTelemetry = NO_TELEMETRY) -> pd.DataFrame:
+    """
+    Split the ballots into seats, city by city, starting from the city with the most voters.
+    :param ballots: a DataFrame containing the ballots with their coordinates
+    :param telemetry: records the seats and cities timings, growth iterations and the time of the filtering,
+    sorting, distance, write and aggregate phases, see DistrictingTelemetry
+    :return: the ballots DataFrame with the district column
+    """
     cities = get_cities(ballots)
-    cities_names = cities[ElectionsConstants.TOWN_NAME].values
+    # Towns are compared by their integer codes instead of their names
+    town_codes, towns = pd.factorize(ballots[ElectionsConstants.TOWN_NAME])
+    cities_codes = towns.get_indexer(cities[ElectionsConstants.TOWN_NAME])
     overall_voters = cities[ElectionsConstants.REGISTRED_VOTERS].sum()
     single_seat = overall_voters/ElectionsConstants.NUMBER_OF_SEATS
+    telemetry.start_run(city_names=towns, ballots=len(ballots), cities=len(cities_codes),
+                        number_of_seats=ElectionsConstants.NUMBER_OF_SEATS)
     seats_dict = {}
     seat_number = 0
     seats_dict[seat_number] = {ElectionsConstants.REGISTRED_VOTERS: 0, ElectionsConstants.LAT: -1,
                                ElectionsConstants.LNG: -1}
     ballots[ElectionsConstants.DISTRICT] = None
-    for city in cities_names:
+    for city in cities_codes:
         directions_counter = 0
-        city_ballots = ballots[ballots[ElectionsConstants.TOWN_NAME] == city]
+        with telemetry.phase('filter'):
+            city_ballots = ballots[town_codes == city]
+        telemetry.start_city(city, ballots=len(city_ballots))
         while sum(city_ballots[ElectionsConstants.DISTRICT].isnull()) > 0:
             if seats_dict[seat_number][ElectionsConstants.REGISTRED_VOTERS] == 0:
-                if directions_counter % 4 == 0:
-                    city_ballots = city_ballots.sort_values(by=ElectionsConstants.LNG, ascending=False)
-                    starting_ballot = city_ballots[city_ballots[ElectionsConstants.DISTRICT].isnull()].iloc[0]
-                elif directions_counter % 4 == 1:
-                    city_ballots = city_ballots.sort_values(by=ElectionsConstants.LNG, ascending=True)
-                    starting_ballot = city_ballots[city_ballots[ElectionsConstants.DISTRICT].isnull()].iloc[0]
-                elif directions_counter % 4 == 2:
-                    city_ballots = city_ballots.sort_values(by=ElectionsConstants.LAT, ascending=False)
-                    starting_ballot = city_ballots[city_ballots[ElectionsConstants.DISTRICT].isnull()].iloc[0]
-                else:
-                    city_ballots = city_ballots.sort_values(by=ElectionsConstants.LAT, ascending=True)
+                telemetry.start_seat(seat_number)
+                iterations = overflow_iterations = 0
+                with telemetry.phase('sort'):
+                    if directions_counter % 4 == 0:
+                        city_ballots = city_ballots.sort_values(by=ElectionsConstants.LNG, ascending=False)
+                    elif directions_counter % 4 == 1:
+                        city_ballots = city_ballots.sort_values(by=ElectionsConstants.LNG, ascending=True)
+                    elif directions_counter % 4 == 2:
+                        city_ballots = city_ballots.sort_values(by=ElectionsConstants.LAT, ascending=False)
+                    else:
+                        city_ballots = city_ballots.sort_values(by=ElectionsConstants.LAT, ascending=True)
+                with telemetry.phase('filter'):
                     starting_ballot = city_ballots[city_ballots[ElectionsConstants.DISTRICT].isnull()].iloc[0]
 
                 seats_dict[seat_number][ElectionsConstants.REGISTRED_VOTERS] = \
@@ -52,74 +73,216 @@ def get_cities_districts(ballots: pd.DataFrame) -> pd.DataFrame:
                 seats_dict[seat_number][ElectionsConstants.LAT] = starting_ballot[ElectionsConstants.LAT]
                 seats_dict[seat_number][ElectionsConstants.LNG] = starting_ballot[ElectionsConstants.LNG]
                 starting_ballot_id = starting_ballot[ElectionsConstants.BALLOT_ID]
-                ballots.loc[ballots[ElectionsConstants.BALLOT_ID] == starting_ballot_id, ElectionsConstants.DISTRICT] = \
-                    seat_number
-                city_ballots = ballots[ballots[ElectionsConstants.TOWN_NAME] == city] \
-                    .sort_values(by=ElectionsConstants.REGISTRED_VOTERS, ascending=False)
+                with telemetry.phase('write'):
+                    ballots.loc[ballots[ElectionsConstants.BALLOT_ID] == starting_ballot_id,
+                                ElectionsConstants.DISTRICT] = seat_number
+                with telemetry.phase('sort'):
+                    city_ballots = ballots[town_codes == city] \
+                        .sort_values(by=ElectionsConstants.REGISTRED_VOTERS, ascending=False)
 
             while seats_dict[seat_number][ElectionsConstants.REGISTRED_VOTERS] < single_seat \
                     * (1 - ElectionsConstants.DISTRICT_VOTE_VARIANCE):
                 if sum(city_ballots[ElectionsConstants.DISTRICT].isnull()) > 0:
-                    city_ballots_with_no_district = city_ballots[city_ballots[ElectionsConstants.DISTRICT].isnull()]
-                    city_ballots_with_no_district[f'current_distance'] = \
-                        ((city_ballots_with_no_district[ElectionsConstants.LAT] -
-                          seats_dict[seat_number][ElectionsConstants.LAT])**2 +
-                         (city_ballots_with_no_district[ElectionsConstants.LNG] -
-                          seats_dict[seat_number][ElectionsConstants.LNG])**2)
-                    city_ballots_with_no_district = city_ballots_with_no_district.sort_values(by='current_distance')
-                    closest_ballot = \
-                        city_ballots_with_no_district[
-                            city_ballots_with_no_district[ElectionsConstants.DISTRICT].isnull()].iloc[0]
+                    iterations += 1
+                    with telemetry.phase('filter'):
+                        city_ballots_with_no_district = \
+                            city_ballots[city_ballots[ElectionsConstants.DISTRICT].isnull()]
+                    with telemetry.phase('distance'):
+                        city_ballots_with_no_district[f'current_distance'] = \
+                            ((city_ballots_with_no_district[ElectionsConstants.LAT] -
+                              seats_dict[seat_number][ElectionsConstants.LAT])**2 +
+                             (city_ballots_with_no_district[ElectionsConstants.LNG] -
+                              seats_dict[seat_number][ElectionsConstants.LNG])**2)
+                        city_ballots_with_no_district = \
+                            city_ballots_with_no_district.sort_values(by='current_distance')
+                        closest_ballot = \
+                            city_ballots_with_no_district[
+                                city_ballots_with_no_district[ElectionsConstants.DISTRICT].isnull()].iloc[0]
                     closest_ballot_id = closest_ballot[ElectionsConstants.BALLOT_ID]
-                    ballots.loc[(ballots[ElectionsConstants.BALLOT_ID] == closest_ballot_id)
-                                & (ballots[ElectionsConstants.TOWN_NAME] == city), ElectionsConstants.DISTRICT] = \
-                        seat_number
-                    seats_dict[seat_number][ElectionsConstants.REGISTRED_VOTERS] = \
-                        ballots[ballots[ElectionsConstants.DISTRICT] ==
-                                seat_number][ElectionsConstants.REGISTRED_VOTERS].sum()
-                    seats_dict[seat_number][ElectionsConstants.LAT] = \
-                        ballots[ballots[ElectionsConstants.DISTRICT] == seat_number][ElectionsConstants.LAT].mean()
-                    seats_dict[seat_number][ElectionsConstants.LNG] = \
-                        ballots[ballots[ElectionsConstants.DISTRICT] == seat_number][ElectionsConstants.LNG].mean()
-                    city_ballots = ballots[ballots[ElectionsConstants.TOWN_NAME] == city] \
-                        .sort_values(by=ElectionsConstants.REGISTRED_VOTERS, ascending=False)
+                    with telemetry.phase('write'):
+                        ballots.loc[(ballots[ElectionsConstants.BALLOT_ID] == closest_ballot_id)
+                                    & (town_codes == city), ElectionsConstants.DISTRICT] = \
+                            seat_number
+                    with telemetry.phase('aggregate'):
+                        seats_dict[seat_number][ElectionsConstants.REGISTRED_VOTERS] = \
+                            ballots[ballots[ElectionsConstants.DISTRICT] ==
+                                    seat_number][ElectionsConstants.REGISTRED_VOTERS].sum()
+                        seats_dict[seat_number][ElectionsConstants.LAT] = \
+                            ballots[ballots[ElectionsConstants.DISTRICT] == seat_number][ElectionsConstants.LAT].mean()
+                        seats_dict[seat_number][ElectionsConstants.LNG] = \
+                            ballots[ballots[ElectionsConstants.DISTRICT] == seat_number][ElectionsConstants.LNG].mean()
+                    with telemetry.phase('sort'):
+                        city_ballots = ballots[town_codes == city] \
+                            .sort_values(by=ElectionsConstants.REGISTRED_VOTERS, ascending=False)
                 else:
-                    ballots_with_no_district = ballots[ballots[ElectionsConstants.DISTRICT].isnull()]
+                    with telemetry.phase('filter'):
+                        unassigned = ballots[ElectionsConstants.DISTRICT].isnull().to_numpy()
+                        ballots_with_no_district = ballots[unassigned]
                     if len(ballots_with_no_district) == 0:
                         break
-                    ballots_with_no_district[f'current_distance'] = \
-                        ((ballots_with_no_district[ElectionsConstants.LAT] -
-                          seats_dict[seat_number][ElectionsConstants.LAT])**2 +
-                         (ballots_with_no_district[ElectionsConstants.LNG] -
-                          seats_dict[seat_number][ElectionsConstants.LNG])**2)
-                    ballots_with_no_district = ballots_with_no_district.sort_values(by='current_distance')
-                    closest_ballot = \
-                        ballots_with_no_district[
-                            ballots_with_no_district[ElectionsConstants.DISTRICT].isnull()].iloc[0]
+                    overflow_iterations += 1
+                    # The position of every ballot in the table, to find its town code whatever the index labels
+                    ballots_with_no_district['position'] = np.flatnonzero(unassigned)
+                    with telemetry.phase('distance'):
+                        ballots_with_no_district[f'current_distance'] = \
+                            ((ballots_with_no_district[ElectionsConstants.LAT] -
+                              seats_dict[seat_number][ElectionsConstants.LAT])**2 +
+                             (ballots_with_no_district[ElectionsConstants.LNG] -
+                              seats_dict[seat_number][ElectionsConstants.LNG])**2)
+                        ballots_with_no_district = ballots_with_no_district.sort_values(by='current_distance')
+                        closest_ballot = \
+                            ballots_with_no_district[
+                                ballots_with_no_district[ElectionsConstants.DISTRICT].isnull()].iloc[0]
                     closest_ballot_id = closest_ballot[ElectionsConstants.BALLOT_ID]
-                    closest_ballot_town = closest_ballot[ElectionsConstants.TOWN_NAME]
-                    ballots.loc[(ballots[ElectionsConstants.BALLOT_ID] == closest_ballot_id) &
-                                (ballots[ElectionsConstants.TOWN_NAME] == closest_ballot_town),
-                    ElectionsConstants.DISTRICT] \
-                        = seat_number
-                    seats_dict[seat_number][ElectionsConstants.REGISTRED_VOTERS] = \
-                        ballots[ballots[ElectionsConstants.DISTRICT] ==
-                                seat_number][ElectionsConstants.REGISTRED_VOTERS].sum()
-                    seats_dict[seat_number][ElectionsConstants.LAT] = \
-                        ballots[ballots[ElectionsConstants.DISTRICT] == seat_number][ElectionsConstants.LAT].mean()
-                    seats_dict[seat_number][ElectionsConstants.LNG] = \
-                        ballots[ballots[ElectionsConstants.DISTRICT] == seat_number][ElectionsConstants.LNG].mean()
+                    closest_ballot_town = town_codes[int(closest_ballot['position'])]
+                    with telemetry.phase('write'):
+                        ballots.loc[(ballots[ElectionsConstants.BALLOT_ID] == closest_ballot_id) &
+                                    (town_codes == closest_ballot_town),
+                        ElectionsConstants.DISTRICT] \
+                            = seat_number
+                    with telemetry.phase('aggregate'):
+                        seats_dict[seat_number][ElectionsConstants.REGISTRED_VOTERS] = \
+                            ballots[ballots[ElectionsConstants.DISTRICT] ==
+                                    seat_number][ElectionsConstants.REGISTRED_VOTERS].sum()
+                        seats_dict[seat_number][ElectionsConstants.LAT] = \
+                            ballots[ballots[ElectionsConstants.DISTRICT] == seat_number][ElectionsConstants.LAT].mean()
+                        seats_dict[seat_number][ElectionsConstants.LNG] = \
+                            ballots[ballots[ElectionsConstants.DISTRICT] == seat_number][ElectionsConstants.LNG].mean()
+            telemetry.end_seat(voters=seats_dict[seat_number][ElectionsConstants.REGISTRED_VOTERS],
+                               iterations=iterations, overflow_iterations=overflow_iterations)
             seat_number += 1
             directions_counter += 1
             seats_dict[seat_number] = {ElectionsConstants.REGISTRED_VOTERS: 0, ElectionsConstants.LAT: -1,
                                        ElectionsConstants.LNG: -1}
+        telemetry.end_city()
+
+    with telemetry.phase('save'):
+        write_table(ballots, ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH)
+    telemetry.end_run()
+
+    return ballots
 
-    ballots.to_csv(ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH, index=False)
+
+def get_districting_arrays(ballots: pd.DataFrame) -> dict[str, np.ndarray]:
+    """
+    Convert the ballots DataFrame to the arrays the DistrictingEngine works on.
+    :param ballots: a DataFrame containing the ballots with their coordinates
+    :return: a dict of the engine arrays: town codes, coordinates, voters, ballot ids codes and cities order
+    """
+    cities = get_cities(ballots[[ElectionsConstants.TOWN_NAME, ElectionsConstants.REGISTRED_VOTERS]])
+    town_codes, towns = pd.factorize(ballots[ElectionsConstants.TOWN_NAME])
+    return {'town_codes': town_codes.astype(np.int64),
+            'lat': ballots[ElectionsConstants.LAT].values.astype(np.float64),
+            'lng': ballots[ElectionsConstants.LNG].values.astype(np.float64),
+            'voters': ballots[ElectionsConstants.REGISTRED_VOTERS].values.astype(np.int64),
+            'ballot_ids': pd.factorize(ballots[ElectionsConstants.BALLOT_ID])[0].astype(np.int64),
+            'city_order': towns.get_indexer(cities[ElectionsConstants.TOWN_NAME]).astype(np.int64)}
+
+
+def get_cities_districts_fast(ballots: pd.DataFrame, number_of_seats: int = None, variance: float = None,
+                              output_path: str | None = ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH,
+                              telemetry: NoTelemetry = NO_TELEMETRY,
+                              checkpoint_path: str | None = None,
+                              checkpoint_seconds: float = ElectionsConstants.DISTRICTING_CHECKPOINT_SECONDS,
+                              resume: bool = True) -> pd.DataFrame:
+    """
+    Same districting as get_cities_districts, computed with the array-backed DistrictingEngine.
+    The district labels are the same as the ones of get_cities_districts, so the output file can be compared, except
+    for ballots with equal coordinates or distances, whose ties the two break differently, see DistrictingEngine.
+    :param ballots: a DataFrame containing the ballots with their coordinates
+    :param number_of_seats: number of seats, default is ElectionsConstants.NUMBER_OF_SEATS
+    :param variance: allowed relative deviation below the single seat quota,
+    default is ElectionsConstants.DISTRICT_VOTE_VARIANCE
+    :param output_path: the table to save the ballots with the district column in, None to not save them
+    :param telemetry: records the seats and cities timings and growth iterations, see DistrictingTelemetry
+    :param checkpoint_path: the file the engine saves its state in, like
+    ElectionsConstants.DISTRICTING_CHECKPOINT_PATH, default is None to not save checkpoints, see DistrictingEngine.run
+    :param checkpoint_seconds: minimal number of seconds between two checkpoints
+    :param resume: whether to continue an interrupted run on the same ballots from the checkpoint of checkpoint_path
+    :return: the ballots DataFrame with the district column
+    """
+    number_of_seats = number_of_seats or ElectionsConstants.NUMBER_OF_SEATS
+    telemetry.start_run(city_names=pd.factorize(ballots[ElectionsConstants.TOWN_NAME])[1] if telemetry.enabled
+                        else None, ballots=len(ballots), number_of_seats=number_of_seats)
+    try:
+        with telemetry.phase('prepare'):
+            engine = DistrictingEngine(**get_districting_arrays(ballots), number_of_seats=number_of_seats,
+                                       variance=ElectionsConstants.DISTRICT_VOTE_VARIANCE if variance is None
+                                       else variance)
+        district = engine.run(telemetry, checkpoint_path=checkpoint_path, checkpoint_seconds=checkpoint_seconds,
+                              resume=resume)
+        ballots[ElectionsConstants.DISTRICT] = np.where(district == UNASSIGNED, None, district.astype(object))
+        if output_path is not None:
+            with telemetry.phase('save'):
+                write_table(ballots, output_path)
+    finally:
+        telemetry.end_run()
 
     return ballots
 
 
+def get_cities_districts_kmeans(ballots: pd.DataFrame, number_of_seats: int = None, variance: float = None,
+                                output_path: str | None = ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH,
+                                telemetry: NoTelemetry = NO_TELEMETRY,
+                                allow_out_of_bounds: bool = False) -> pd.DataFrame:
+    """
+    Districting by capacity-constrained k-means: the ballots are split into number_of_seats clusters of close
+    ballots, with the voters of every cluster within variance of the single seat quota, see
+    balanced_kmeans.balanced_kmeans. Unlike get_cities_districts, the districts do not follow the towns order.
+    Raises when some districts are not within the bounds, unless allow_out_of_bounds.
+    :param ballots: a DataFrame containing the ballots with their coordinates
+    :param number_of_seats: number of seats, default is ElectionsConstants.NUMBER_OF_SEATS
+    :param variance: allowed relative deviation from the single seat quota,
+    default is ElectionsConstants.DISTRICT_VOTE_VARIANCE
+    :param output_path: the table to save the ballots with the district column in, None to not save them
+    :param telemetry: records the time of the clustering, the districts are not built city by city so there are no
+    cities and seats events, see DistrictingTelemetry
+    :param allow_out_of_bounds: whether to keep districts out of the bounds, with a warning, instead of raising
+    :return: the ballots DataFrame with the district column
+    """
+    number_of_seats = number_of_seats or ElectionsConstants.NUMBER_OF_SEATS
+    telemetry.start_run(ballots=len(ballots), number_of_seats=number_of_seats)
+    try:
+        with telemetry.phase('balanced_kmeans'):
+            district = balanced_kmeans(ballots[ElectionsConstants.LAT].values, ballots[ElectionsConstants.LNG].values,
+                                       ballots[ElectionsConstants.REGISTRED_VOTERS].values,
+                                       number_of_seats=number_of_seats,
+                                       variance=ElectionsConstants.DISTRICT_VOTE_VARIANCE if variance is None
+                                       else variance,
+                                       allow_out_of_bounds=allow_out_of_bounds)
+        ballots[ElectionsConstants.DISTRICT] = district.astype(object)
+        if output_path is not None:
+            with telemetry.phase('save'):
+                write_table(ballots, output_path)
+    finally:
+        telemetry.end_run()
+
+    return ballots
+
+
+DISTRICTING_MODES = {'greedy': get_cities_districts_fast, 'kmeans': get_cities_districts_kmeans}
+
+
+def get_districts(ballots: pd.DataFrame, mode: str = None, **kwargs) -> pd.DataFrame:
+    """
+    Run the districting of the given mode: 'greedy' for the city-by-city districting (get_cities_districts_fast)
+    or 'kmeans' for the balanced k-means districting (get_cities_districts_kmeans).
+    :param ballots: a DataFrame containing the ballots with their coordinates
+    :param mode: the districting mode, default is ElectionsConstants.DISTRICTING_MODE
+    :param kwargs: arguments of the districting function
+    :return: the ballots DataFrame with the district column
+    """
+    mode = mode or ElectionsConstants.DISTRICTING_MODE
+    if mode not in DISTRICTING_MODES:
+        raise Exception(f'Unknown districting mode {mode}, expected one of {list(DISTRICTING_MODES)}')
+    return DISTRICTING_MODES[mode](ballots, **kwargs)
+
+
 if __name__ == "__main__":
     ballots = load_data()
     ballots = pre_process_data(ballots)
-    ballots_with_district = get_cities_districts(ballots)
+    telemetry = DistrictingTelemetry(callback=print_progress, log_path=ElectionsConstants.DISTRICTING_TELEMETRY_PATH)
+    checkpoint = {'checkpoint_path': ElectionsConstants.DISTRICTING_CHECKPOINT_PATH} \
+        if ElectionsConstants.DISTRICTING_MODE == 'greedy' else {}
+    ballots_with_district = get_districts(ballots, telemetry=telemetry, **checkpoint)
+    telemetry.report()
@@ -0,0 +1,311 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from districting_engine import UNASSIGNED
+from districting_metrics import local_frame
+from elecetions_constatns import ElectionsConstants
+from election_results import get_district_codes
+from table_store import existing_table_path, read_table
+from town_index import JOIN_VALUE_LIMIT, join_keys, normalize_distinct_names, normalize_town_name
+
+# The columns of the districting table the lookup needs
+LOOKUP_COLUMNS = [ElectionsConstants.TOWN_NAME, ElectionsConstants.BALLOT_ID, ElectionsConstants.LAT,
+                  ElectionsConstants.LNG, ElectionsConstants.DISTRICT]
+
+
+def ballot_ids_in_range(ballot_ids) -> tuple[np.ndarray, np.ndarray]:
+    """
+    A ballot id out of the range of the join keys would be read as the key of a ballot of another town, see join_keys.
+    :param ballot_ids: the ballot id of every ballot station
+    :return: the int64 ballot ids, 0 for the ids out of range, and whether every id is in range
+    """
+    try:
+        ids = np.asarray(ballot_ids, dtype=np.int64)
+    except OverflowError:
+        ids = np.array([ballot_id if 0 <= ballot_id < JOIN_VALUE_LIMIT else -1 for ballot_id in map(int, ballot_ids)],
+                       dtype=np.int64)
+    in_range = (ids >= 0) & (ids < JOIN_VALUE_LIMIT)
+    return np.where(in_range, ids, 0), in_range
+
+
+class DistrictLookup:
+    """
+    In-memory index of a districting, to find the district of a ballot station or of a point.
+    A ballot station is found by its (town, ballot id) pair, with the town name normalized like in town_index, through
+    a dict for single queries and a hash index of integer keys for batches. A point is in the district of its nearest
+    station, which is its Voronoi cell, found with a KD-tree over the stations with coordinates and a district. The
+    stations and the points are projected to the local frame of the stations (see districting_metrics.local_frame),
+    so the nearest station is the nearest on the ground and not in degrees.
+    """
+
+    def __init__(self, ballots: pd.DataFrame):
+        """
+        :param ballots: a DataFrame containing the ballots with their coordinates and district column, like the
+        ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH table
+        """
+        districts = get_district_codes(ballots)
+        codes, normalized = normalize_distinct_names(ballots[ElectionsConstants.TOWN_NAME])
+        # Different names can have the same normalized name, they are the same town
+        name_codes, names = pd.factorize(normalized)
+        self.towns = {name: code for code, name in enumerate(names)}
+        town_codes = np.append(name_codes, -1)[codes]
+        ballot_ids = ballots[ElectionsConstants.BALLOT_ID].to_numpy(dtype=np.int64)
+        keys = pd.Index(join_keys(town_codes, ballot_ids))
+        known = (town_codes >= 0) & ~keys.duplicated()
+        self.ballot_keys = keys[known]
+        self.ballot_districts = districts[known]
+        self.ballots = dict(zip(self.ballot_keys.tolist(), self.ballot_districts.tolist()))
+
+        lat = ballots[ElectionsConstants.LAT].to_numpy(dtype=np.float64)
+        lng = ballots[ElectionsConstants.LNG].to_numpy(dtype=np.float64)
+        stations = np.flatnonzero(~np.isnan(lat) & ~np.isnan(lng) & (districts != UNASSIGNED))
+        # The center of the frame the stations and the query points are projected to
+        self.origin = (lat[stations].mean(), lng[stations].mean()) if len(stations) else (0.0, 0.0)
+        self.tree = cKDTree(np.column_stack(local_frame(lat[stations], lng[stations], self.origin)))
+        self.station_districts = districts[stations]
+        self.station_towns = np.asarray(ballots[ElectionsConstants.TOWN_NAME].astype(object))[stations]
+        self.station_ballot_ids = ballot_ids[stations]
+
+    def __len__(self) -> int:
+        return len(self.ballots)
+
+    def district_of_ballot(self, town: str, ballot_id: int) -> int | None:
+        """
+        :param town: the town name
+        :param ballot_id: the ballot id (ElectionsConstants.BALLOT_ID)
+        :return: the district of the ballot station, None if the station is unknown, has no district or the ballot id is
+        out of range
+        """
+        ballot_id = int(ballot_id)
+        town_code = self.towns.get(normalize_town_name(town))
+        if town_code is None or not 0 <= ballot_id < JOIN_VALUE_LIMIT:
+            return None
+        district = self.ballots.get(int(join_keys(town_code, ballot_id)))
+        return None if district is None or district == UNASSIGNED else district
+
+    def districts_of_ballots(self, towns, ballot_ids) -> np.ndarray:
+        """
+        :param towns: the town name of every ballot station
+        :param ballot_ids: the ballot id of every ballot station
+        :return: the district of every ballot station, UNASSIGNED for unknown stations, stations without a district and
+        ballot ids out of range
+        """
+        ballot_ids, in_range = ballot_ids_in_range(ballot_ids)
+        codes, normalized = normalize_distinct_names(pd.Series(towns, dtype=object))
+        town_codes = np.array([self.towns.get(name, -1) for name in normalized] + [-1], dtype=np.int64)[codes]
+        positions = self.ballot_keys.get_indexer(join_keys(town_codes, ballot_ids))
+        positions[(town_codes < 0) | ~in_range] = -1
+        return np.where(positions >= 0, self.ballot_districts[positions], UNASSIGNED)
+
+    def nearest_stations(self, lat, lng) -> np.ndarray:
+        """
+        :param lat: latitude per point
+        :param lng: longitude per point
+        :return: the station closest to every point, as a position in the station arrays
+        """
+        return self.tree.query(np.column_stack(local_frame(lat, lng, self.origin)))[1]
+
+    def district_of_point(self, lat: float, lng: float) -> int | None:
+        """
+        :return: the district of the station closest to the point, None if there are no stations
+        """
+        if not len(self.station_districts):
+            return None
+        return int(self.station_districts[self.tree.query(local_frame(lat, lng, self.origin))[1]])
+
+    def districts_of_points(self, lat, lng) -> np.ndarray:
+        """
+        :param lat: latitude per point
+        :param lng: longitude per point
+        :return: the district of the station closest to every point
+        """
+        if not len(self.station_districts):
+            return np.full(len(lat), UNASSIGNED)
+        return self.station_districts[self.nearest_stations(lat, lng)]
+
+
+class DistrictLookupService:
+    """
+    Serves the DistrictLookup of a districting table and reloads it when the table file changes.
+    The new lookup is built aside and replaces the current one in a single assignment, so the queries never wait for
+    a reload and never see a partially built lookup. A table that fails to load (for example while it is written)
+    keeps the current lookup until the next check.
+    """
+
+    def __init__(self, path: str = ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH,
+                 reload_seconds: float = ElectionsConstants.LOOKUP_RELOAD_SECONDS):
+        """
+        :param path: the districting table path, as defined in ElectionsConstants
+        :param reload_seconds: number of seconds between two checks of the table file
+        """
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.lookup = None
+        self.signature = None
+        self.loaded_at = None
+        self.reload_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.reload()
+
+    def file_signature(self) -> tuple:
+        path = existing_table_path(self.path)
+        stat = os.stat(path)
+        return path, stat.st_size, stat.st_mtime_ns
+
+    def reload(self) -> bool:
+        """
+        Reload the lookup if the table file changed since the last load.
+        :return: whether the lookup was reloaded
+        """
+        with self.reload_lock:
+            signature = self.file_signature()
+            if signature == self.signature:
+                return False
+            self.lookup = DistrictLookup(read_table(self.path, columns=LOOKUP_COLUMNS))
+            self.signature = signature
+            self.loaded_at = time.time()
+            print(f'Loaded the districts of {len(self.lookup)} ballots from {signature[0]}')
+            return True
+
+    def watch(self):
+        while not self.stopped.wait(self.reload_seconds):
+            try:
+                self.reload()
+            except Exception as e:
+                print(f'Keeping the current districts, {self.path} could not be loaded: {e}')
+
+    def start_watching(self) -> threading.Thread:
+        """
+        Check the table file every reload_seconds in a background thread, until stop_watching.
+        """
+        self.stopped.clear()
+        watcher = threading.Thread(target=self.watch, daemon=True)
+        watcher.start()
+        return watcher
+
+    def stop_watching(self):
+        self.stopped.set()
+
+    def status(self) -> dict:
+        return {'path': self.signature[0], 'ballots': len(self.lookup), 'stations': len(self.lookup.station_districts),
+                'loaded_at': self.loaded_at}
+
+
+def district_or_none(district) -> int | None:
+    return None if district is None or district == UNASSIGNED else int(district)
+
+
+class DistrictLookupHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP API of a DistrictLookupService, every response is JSON:
+    - GET /ballot?town=...&ballot_id=...: the district of a ballot station, a ballot id out of range is a bad query,
+    - GET /point?lat=...&lng=...: the district of a point, and its nearest station,
+    - POST /batch with {"ballots": {"town": [...], "ballot_id": [...]}, "points": {"lat": [...], "lng": [...]}}: the
+      districts of many stations and points, both parts are optional,
+    - GET /status: the loaded table.
+    Unknown stations, and in a batch the ballot ids out of range, have a null district.
+    """
+    # Keep-alive connections, the clients of the batch tools send many requests, and the headers and the body are
+    # sent without waiting for the acknowledgment of the previous packet
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body: dict, status: int = 200):
+        content = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        lookup = self.server.service.lookup
+        try:
+            if url.path == '/ballot':
+                ballot_id = int(query['ballot_id'])
+                if not 0 <= ballot_id < JOIN_VALUE_LIMIT:
+                    raise ValueError(f'ballot_id {ballot_id} is out of range')
+                self.send_json({'district': lookup.district_of_ballot(query['town'], ballot_id)})
+            elif url.path == '/point':
+                lat, lng = float(query['lat']), float(query['lng'])
+                if not len(lookup.station_districts):
+                    self.send_json({'district': None})
+                    return
+                station = lookup.nearest_stations([lat], [lng])[0]
+                self.send_json({'district': int(lookup.station_districts[station]),
+                                'town': lookup.station_towns[station],
+                                'ballot_id': int(lookup.station_ballot_ids[station])})
+            elif url.path == '/status':
+                self.send_json(self.server.service.status())
+            else:
+                self.send_json({'error': f'Unknown path {url.path}'}, 404)
+        except (KeyError, ValueError, OverflowError) as e:
+            self.send_json({'error': f'Bad query: {e}'}, 400)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/batch':
+            self.send_json({'error': f'Unknown path {self.path}'}, 404)
+            return
+        lookup = self.server.service.lookup
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            response = {}
+            if 'ballots' in request:
+                districts = lookup.districts_of_ballots(request['ballots']['town'], request['ballots']['ballot_id'])
+                response['ballots'] = [district_or_none(district) for district in districts.tolist()]
+            if 'points' in request:
+                districts = lookup.districts_of_points(request['points']['lat'], request['points']['lng'])
+                response['points'] = [district_or_none(district) for district in districts.tolist()]
+            self.send_json(response)
+        except (KeyError, ValueError, TypeError, OverflowError) as e:
+            self.send_json({'error': f'Bad request: {e}'}, 400)
+
+
+def make_server(service: DistrictLookupService, host: str = ElectionsConstants.LOOKUP_HOST,
+                port: int = ElectionsConstants.LOOKUP_PORT) -> ThreadingHTTPServer:
+    """
+    :param service: the lookup service the server answers from
+    :param host: the host to listen on
+    :param port: the port to listen on, 0 for any free port
+    :return: the HTTP server, not started
+    """
+    server = ThreadingHTTPServer((host, port), DistrictLookupHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def serve(path: str = ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH, host: str = ElectionsConstants.LOOKUP_HOST,
+          port: int = ElectionsConstants.LOOKUP_PORT):
+    """
+    Serve the districts lookup of a districting table over HTTP, reloading it when the table file changes.
+    :param path: the districting table path, as defined in ElectionsConstants
+    :param host: the host to listen on
+    :param port: the port to listen on
+    """
+    service = DistrictLookupService(path)
+    service.start_watching()
+    server = make_server(service, host, port)
+    print(f'Serving the districts lookup on http://{host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    finally:
+        service.stop_watching()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,297 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from districting_engine import UNASSIGNED, group_members
+from districting_metrics import local_frame, station_neighbors
+from elecetions_constatns import ElectionsConstants
+from table_store import read_table, write_table
+
+
+class DistrictOptimizer:
+    """
+    Local search over a districting: boundary ballots are moved to a neighboring district, or swapped with a ballot of
+    the neighboring district, when it improves the balance and the compactness of the districts.
+    A move is accepted when it lowers the total voters outside the [lower, upper] bounds of the districts, while the
+    total moment of inertia (the voters weighted squared distance of the ballots from their district centroid) stays
+    below its initial value, or when it keeps the violation and lowers the cost without raising the inertia. The cost
+    is the total moment of inertia relative to its initial mean per seat, plus the balance_weight times the squared
+    deviations of the districts voters from the quota, relative to the allowed deviation, so among the moves that
+    keep the compactness the ones towards the quota win.
+    A move is rejected when it pushes a district within the bounds out of them, when it adds a district to a town,
+    or when the neighbors a ballot leaves behind in its district are not connected without it, so the districts do
+    not get more parts in the neighbor graph.
+    Every district keeps the sums of its ballots moments (voters, voters weighted coordinates and voters weighted
+    squared norm), so the voters, centroid and inertia of a district after a move are computed in O(1).
+    The distances are measured in the local frame of the ballots (see districting_metrics.local_frame), where a degree
+    of longitude is as long as on the ground.
+    The neighbors of a ballot are its closest ballots and the ballots it is one of the closest of, the neighbor graph
+    of districting_metrics.station_neighbors, so only ballots on the boundary of a district can move.
+    """
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray, voters: np.ndarray, district: np.ndarray,
+                 town_codes: np.ndarray = None, number_of_seats: int = ElectionsConstants.NUMBER_OF_SEATS,
+                 variance: float = ElectionsConstants.DISTRICT_VOTE_VARIANCE,
+                 neighbors: int = 8, balance_weight: float = 1.0, seed: int = 0):
+        """
+        :param lat: latitude per ballot
+        :param lng: longitude per ballot
+        :param voters: registered voters per ballot
+        :param district: district per ballot, UNASSIGNED ballots are not moved
+        :param town_codes: integer town code per ballot, None to let the moves split towns
+        :param number_of_seats: number of seats the voters are split into
+        :param variance: allowed relative deviation from the single seat quota, in both directions
+        :param neighbors: number of closest ballots that are the neighbors of a ballot
+        :param balance_weight: the weight of the balance term of the cost, relative to the compactness term
+        :param seed: the random seed of the ballots visiting order
+        """
+        # Centered coordinates keep the squared norms small, so the inertia is not lost in the rounding errors
+        lat, lng = local_frame(lat, lng)
+        voters = np.asarray(voters, dtype=np.float64)
+        self.district = np.asarray(district, dtype=np.int64).tolist()
+        self.rng = np.random.default_rng(seed)
+        quota = voters.sum() / number_of_seats
+        self.quota = quota
+        self.allowed_deviation = max(quota * variance, 1.0)
+        self.balance_weight = balance_weight
+        self.lower = quota * (1 - variance)
+        self.upper = quota * (1 + variance)
+        first, second = station_neighbors(lat, lng, neighbors)
+        members, offsets = group_members(np.concatenate([first, second]))
+        adjacent = np.concatenate([second, first])[members]
+        self.neighbors = [sorted(set(adjacent[offsets[ballot]:offsets[ballot + 1]].tolist()))
+                          for ballot in range(len(self.district))]
+
+        # The number of ballots of every town in every seat, to keep the number of seats of every town
+        self.town_codes = None if town_codes is None else np.asarray(town_codes, dtype=np.int64).tolist()
+        self.town_seat_ballots = {}
+        if self.town_codes is not None:
+            for town, seat in zip(self.town_codes, self.district):
+                self.town_seat_ballots[town, seat] = self.town_seat_ballots.get((town, seat), 0) + 1
+
+        # The moments of every ballot: voters, voters weighted coordinates and voters weighted squared norm
+        self.moments = list(zip(voters.tolist(), (voters * lat).tolist(), (voters * lng).tolist(),
+                                (voters * (lat ** 2 + lng ** 2)).tolist()))
+        seats = max(self.district) + 1
+        self.seat_moments = [[0.0, 0.0, 0.0, 0.0] for _ in range(seats)]
+        self.seat_ballots = [0] * seats
+        for ballot, seat in enumerate(self.district):
+            if seat != UNASSIGNED:
+                self.seat_ballots[seat] += 1
+                for moment in range(4):
+                    self.seat_moments[seat][moment] += self.moments[ballot][moment]
+        self.seat_inertia = [self.inertia(*moments) for moments in self.seat_moments]
+        self.inertia_scale = max(sum(self.seat_inertia) / number_of_seats, 1e-12)
+        self.total_inertia = sum(self.seat_inertia)
+        # The moves never raise the total inertia above its initial value
+        self.inertia_limit = self.total_inertia
+
+    @staticmethod
+    def inertia(voters: float, lat: float, lng: float, squares: float) -> float:
+        """
+        The moment of inertia of a district around its centroid, from the sums of its ballots moments.
+        """
+        return squares - (lat * lat + lng * lng) / voters if voters > 0 else 0.0
+
+    def violation(self, voters: float) -> float:
+        return max(voters - self.upper, 0.0) + max(self.lower - voters, 0.0)
+
+    def imbalance(self, voters: float) -> float:
+        return self.balance_weight * ((voters - self.quota) / self.allowed_deviation) ** 2
+
+    def shifted(self, seat: int, delta: tuple, sign: int) -> tuple[float, float]:
+        """
+        The voters and inertia of a seat after adding (sign 1) or removing (sign -1) the moments delta.
+        """
+        voters, lat, lng, squares = self.seat_moments[seat]
+        voters += sign * delta[0]
+        return voters, self.inertia(voters, lat + sign * delta[1], lng + sign * delta[2], squares + sign * delta[3])
+
+    def gain(self, source: int, target: int, delta: tuple) -> tuple[float, float, float, float, float]:
+        """
+        The change of the total bounds violation and cost when the moments delta move from a seat to another.
+        A move that pushes a seat within the bounds out of them has an infinite violation change, so it is never made.
+        :param source: the seat the moments leave
+        :param target: the seat the moments join
+        :param delta: the moved moments, a ballot moments for a move, the difference of two ballots moments for a swap
+        :return: the change of the violation, the change of the cost, the change of the inertia, and the new inertia
+        of the two seats
+        """
+        source_voters, source_inertia = self.shifted(source, delta, -1)
+        target_voters, target_inertia = self.shifted(target, delta, 1)
+        voters = self.seat_moments[source][0], self.seat_moments[target][0]
+        old_violations = self.violation(voters[0]), self.violation(voters[1])
+        new_violations = self.violation(source_voters), self.violation(target_voters)
+        if (old_violations[0] == 0 and new_violations[0] > 0) or (old_violations[1] == 0 and new_violations[1] > 0):
+            violation = np.inf
+        else:
+            violation = sum(new_violations) - sum(old_violations)
+        inertia = source_inertia + target_inertia - self.seat_inertia[source] - self.seat_inertia[target]
+        cost = inertia / self.inertia_scale + self.imbalance(source_voters) + self.imbalance(target_voters) - \
+            self.imbalance(voters[0]) - self.imbalance(voters[1])
+        return violation, cost, inertia, source_inertia, target_inertia
+
+    def apply(self, source: int, target: int, delta: tuple, source_inertia: float, target_inertia: float):
+        for moment in range(4):
+            self.seat_moments[source][moment] -= delta[moment]
+            self.seat_moments[target][moment] += delta[moment]
+        self.total_inertia += source_inertia + target_inertia - self.seat_inertia[source] - self.seat_inertia[target]
+        self.seat_inertia[source] = source_inertia
+        self.seat_inertia[target] = target_inertia
+
+    def adds_town_seats(self, changes: dict[int, int]) -> bool:
+        """
+        :param changes: the new seat of the moved ballots
+        :return: whether the moves add a seat to one of the towns of the moved ballots
+        """
+        if self.town_codes is None:
+            return False
+        counts = {}
+        for ballot, seat in changes.items():
+            town = self.town_codes[ballot]
+            for key, change in (((town, self.district[ballot]), -1), ((town, seat), 1)):
+                counts[key] = counts.get(key, self.town_seat_ballots.get(key, 0)) + change
+        added = {}
+        for (town, seat), count in counts.items():
+            before = self.town_seat_ballots.get((town, seat), 0)
+            added[town] = added.get(town, 0) + (count > 0) - (before > 0)
+        return any(seats > 0 for seats in added.values())
+
+    def connected(self, ballots: list[int], seat: int) -> bool:
+        """
+        Whether ballots of a seat are connected through the ballots of the seat among them and their neighbors.
+        The search is local, so it misses the longer paths and can report connected ballots as disconnected.
+        """
+        if len(ballots) <= 1:
+            return True
+        area = set(ballots).union(*(self.neighbors[ballot] for ballot in ballots))
+        reached = {ballots[0]}
+        frontier = [ballots[0]]
+        while frontier:
+            ballot = frontier.pop()
+            for neighbor in self.neighbors[ballot]:
+                if neighbor in area and neighbor not in reached and self.district[neighbor] == seat:
+                    reached.add(neighbor)
+                    frontier.append(neighbor)
+        return reached.issuperset(ballots)
+
+    def splits_seats(self, changes: dict[int, int]) -> bool:
+        """
+        :param changes: the new seat of the moved ballots
+        :return: whether the moves can add a part to a seat: a moved ballot without neighbors in its new seat, or
+        with neighbors in its old seat that are not connected without it
+        """
+        previous = {ballot: self.district[ballot] for ballot in changes}
+        for ballot, seat in changes.items():
+            self.district[ballot] = seat
+        try:
+            for ballot, seat in previous.items():
+                neighbors = self.neighbors[ballot]
+                if not any(self.district[neighbor] == changes[ballot] for neighbor in neighbors):
+                    return True
+                if not self.connected([neighbor for neighbor in neighbors if self.district[neighbor] == seat], seat):
+                    return True
+            return False
+        finally:
+            for ballot, seat in previous.items():
+                self.district[ballot] = seat
+
+    def improve_ballot(self, ballot: int) -> bool:
+        """
+        Apply the best improving move or swap of a ballot with the districts of its neighbors that keeps the towns and
+        the parts of the districts, see adds_town_seats and splits_seats.
+        :return: whether the ballot moved
+        """
+        source = self.district[ballot]
+        if source == UNASSIGNED or self.seat_ballots[source] == 1:
+            return False
+        candidates = []
+        for neighbor in self.neighbors[ballot]:
+            target = self.district[neighbor]
+            if target == source or target == UNASSIGNED:
+                continue
+            # Move the ballot to the neighbor district, or swap the ballot with the neighbor
+            swap = tuple(a - b for a, b in zip(self.moments[ballot], self.moments[neighbor]))
+            for swapped, delta in ((None, self.moments[ballot]), (neighbor, swap)):
+                violation, cost, inertia, source_inertia, target_inertia = self.gain(source, target, delta)
+                # Moves that do not change the violation must improve the cost by more than the rounding errors,
+                # without raising the inertia, and the moves that lower it must keep the total inertia
+                if (violation < 0 and self.total_inertia + inertia <= self.inertia_limit) or \
+                        (violation == 0 and cost < -1e-9 and inertia <= 0):
+                    candidates.append((violation, cost, target, swapped, delta, source_inertia, target_inertia))
+        for _, _, target, neighbor, delta, source_inertia, target_inertia in sorted(candidates, key=lambda c: c[:2]):
+            changes = {ballot: target} if neighbor is None else {ballot: target, neighbor: source}
+            if self.adds_town_seats(changes) or self.splits_seats(changes):
+                continue
+            for moved, seat in changes.items():
+                if self.town_codes is not None:
+                    self.town_seat_ballots[self.town_codes[moved], self.district[moved]] -= 1
+                    key = self.town_codes[moved], seat
+                    self.town_seat_ballots[key] = self.town_seat_ballots.get(key, 0) + 1
+                self.district[moved] = seat
+            self.apply(source, target, delta, source_inertia, target_inertia)
+            if neighbor is None:
+                self.seat_ballots[source] -= 1
+                self.seat_ballots[target] += 1
+            return True
+        return False
+
+    def total_violation(self) -> float:
+        return sum(self.violation(moments[0]) for moments in self.seat_moments)
+
+    def run(self, time_budget: float = ElectionsConstants.OPTIMIZER_TIME_BUDGET_SECONDS) -> np.ndarray:
+        """
+        Visit the ballots in random order, pass after pass, until a pass without a move or the end of the time budget.
+        :param time_budget: maximal number of seconds to run
+        :return: the district of every ballot
+        """
+        start = time.perf_counter()
+        print(f'Optimizing districts: violation {self.total_violation():.0f} voters, '
+              f'inertia {sum(self.seat_inertia):.6g}')
+        passes = 0
+        while time.perf_counter() - start < time_budget:
+            moves = 0
+            for index, ballot in enumerate(self.rng.permutation(len(self.district)).tolist()):
+                moves += self.improve_ballot(ballot)
+                if index % 1000 == 0 and time.perf_counter() - start >= time_budget:
+                    break
+            passes += 1
+            if moves == 0:
+                break
+        print(f'Optimized districts in {passes} passes and {time.perf_counter() - start:.1f} seconds: '
+              f'violation {self.total_violation():.0f} voters, inertia {sum(self.seat_inertia):.6g}')
+        return np.array(self.district, dtype=np.int64)
+
+
+def optimize_districts(ballots: pd.DataFrame, time_budget: float = ElectionsConstants.OPTIMIZER_TIME_BUDGET_SECONDS,
+                       number_of_seats: int = None, variance: float = None,
+                       output_path: str | None = ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH) -> pd.DataFrame:
+    """
+    Improve the balance and the compactness of a districting, see DistrictOptimizer.
+    :param ballots: a DataFrame containing the ballots with their coordinates and district column
+    :param time_budget: maximal number of seconds to run
+    :param number_of_seats: number of seats, default is ElectionsConstants.NUMBER_OF_SEATS
+    :param variance: allowed relative deviation from the single seat quota,
+    default is ElectionsConstants.DISTRICT_VOTE_VARIANCE
+    :param output_path: the table to save the ballots with the improved district column in, None to not save them
+    :return: the ballots DataFrame with the improved district column
+    """
+    district = pd.to_numeric(ballots[ElectionsConstants.DISTRICT].astype(object), errors='coerce')
+    optimizer = DistrictOptimizer(ballots[ElectionsConstants.LAT].values, ballots[ElectionsConstants.LNG].values,
+                                  ballots[ElectionsConstants.REGISTRED_VOTERS].values,
+                                  district.fillna(UNASSIGNED).to_numpy(dtype=np.int64),
+                                  town_codes=pd.factorize(ballots[ElectionsConstants.TOWN_NAME])[0],
+                                  number_of_seats=number_of_seats or ElectionsConstants.NUMBER_OF_SEATS,
+                                  variance=ElectionsConstants.DISTRICT_VOTE_VARIANCE if variance is None else variance)
+    district = optimizer.run(time_budget)
+    ballots[ElectionsConstants.DISTRICT] = np.where(district == UNASSIGNED, None, district.astype(object))
+    if output_path is not None:
+        write_table(ballots, output_path)
+
+    return ballots
+
+
+if __name__ == '__main__':
+    ballots = read_table(ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH)
+    optimize_districts(ballots)
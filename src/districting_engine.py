@@ -0,0 +1,271 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from districting_telemetry import NO_TELEMETRY, NoTelemetry
+from elecetions_constatns import ElectionsConstants
+from spatial_index import BallotsSpatialIndex, NOT_FOUND
+
+UNASSIGNED = -1
+
+
+def group_members(groups: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Build a CSR-like lookup from a group label to the rows that share it.
+    :param groups: integer group label per row
+    :return: (members, offsets) so that the rows of group g are members[offsets[g]:offsets[g + 1]]
+    """
+    members = np.argsort(groups, kind='stable')
+    offsets = np.zeros(groups.max() + 2 if len(groups) else 1, dtype=np.int64)
+    np.add.at(offsets, groups + 1, 1)
+    return members, np.cumsum(offsets)
+
+
+class DistrictingEngine:
+    """
+    Array-backed implementation of the greedy city-by-city districting of get_cities_districts.
+    Ballots are kept as NumPy arrays with an assignment vector, and every seat keeps a running voters sum and
+    coordinates sum, so assigning one ballot costs O(1) instead of recomputing the seat from the whole table.
+    The closest unassigned ballot is found with a BallotsSpatialIndex, in logarithmic time instead of a full scan.
+    The selection rules (starting directions, closest ballot in the city, overflow to the closest ballot in the
+    country, ballots sharing a ballot id) follow get_cities_districts, so the labels are the same as long as the
+    selections have no ties. On ties the two can differ: get_cities_districts sorts with the default, unstable, sort
+    of pandas, and the engine breaks the ties by the table order (the voters order of the city for the starting
+    ballots of the later seats of a city, see starting_ballot). The centroid is a running mean, so it can also differ
+    from the pandas mean in the last bits, which only matters for ballots at exactly the same distance from it.
+    """
+
+    def __init__(self, town_codes: np.ndarray, lat: np.ndarray, lng: np.ndarray, voters: np.ndarray,
+                 ballot_ids: np.ndarray, city_order: np.ndarray,
+                 number_of_seats: int = ElectionsConstants.NUMBER_OF_SEATS,
+                 variance: float = ElectionsConstants.DISTRICT_VOTE_VARIANCE,
+                 directions: tuple = ElectionsConstants.STARTING_DIRECTIONS):
+        """
+        :param town_codes: integer town code per ballot
+        :param lat: latitude per ballot
+        :param lng: longitude per ballot
+        :param voters: registered voters per ballot
+        :param ballot_ids: ballot id per ballot (ElectionsConstants.BALLOT_ID)
+        :param city_order: town codes in the order the cities are districted
+        :param number_of_seats: number of seats to split the voters into
+        :param variance: allowed relative deviation below the single seat quota
+        :param directions: the order of the directions ('east', 'west', 'north', 'south') new seats start from
+        """
+        self.town_codes = np.asarray(town_codes, dtype=np.int64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.voters = np.asarray(voters, dtype=np.int64)
+        self.city_order = np.asarray(city_order, dtype=np.int64)
+        self.directions = directions
+        n = len(self.lat)
+        self.positions = np.arange(n)
+
+        single_seat = self.voters.sum() / number_of_seats
+        self.threshold = single_seat * (1 - variance)
+
+        # In the city the candidates are ordered by voters (descending), ties keep the table order
+        self.city_rank = np.empty(n, dtype=np.int64)
+        self.city_rank[np.lexsort((self.positions, -self.voters, self.town_codes))] = self.positions
+        city_members, self.city_offsets = group_members(self.town_codes)
+        self.city_members = city_members[np.lexsort((self.city_rank[city_members],
+                                                     self.town_codes[city_members]))]
+
+        # A starting ballot takes every ballot with its id, the closest ballot every ballot with its id in its town
+        id_groups = pd.factorize(ballot_ids)[0]
+        self.id_groups = id_groups
+        self.id_members, self.id_offsets = group_members(id_groups)
+        self.id_town_groups = pd.factorize(pd.MultiIndex.from_arrays([id_groups, self.town_codes]))[0]
+        self.id_town_members, self.id_town_offsets = group_members(self.id_town_groups)
+
+        self.spatial_index = BallotsSpatialIndex(self.lat, self.lng, self.town_codes, town_rank=self.city_rank)
+        self.district = np.full(n, UNASSIGNED, dtype=np.int64)
+        self.unassigned_in_town = np.bincount(self.town_codes, minlength=len(self.city_offsets) - 1)
+        self.seat_number = 0
+        self.seats_voters = [0]
+        self.seats_lat = [-1.0]
+        self.seats_lng = [-1.0]
+        self.members_voters = [0]
+        self.members_lat = [0.0]
+        self.members_lng = [0.0]
+        self.members_count = [0]
+
+    def city_ballots(self, city: int) -> np.ndarray:
+        return self.city_members[self.city_offsets[city]:self.city_offsets[city + 1]]
+
+    def starting_ballot(self, city: int, directions_counter: int) -> int:
+        """
+        Pick the ballot that opens a new seat: the unassigned city ballot furthest east, west, north or south.
+        The first seat of a city breaks ties by the table order, later seats by the voters order of the city.
+        """
+        candidates = self.city_ballots(city)
+        candidates = candidates[self.district[candidates] == UNASSIGNED]
+        direction = self.directions[directions_counter % len(self.directions)]
+        coordinate = self.lng[candidates] if direction in ('east', 'west') else self.lat[candidates]
+        extreme = coordinate.max() if direction in ('east', 'north') else coordinate.min()
+        candidates = candidates[coordinate == extreme]
+        if directions_counter == 0:
+            return candidates.min()
+        return candidates[0]
+
+    def closest_ballot(self, city: int | None) -> int:
+        """
+        Find the unassigned ballot closest to the current seat centroid.
+        :param city: restrict the search to this town code, None to search the whole country
+        :return: the ballot position, NOT_FOUND if there are no unassigned ballots left
+        """
+        return self.spatial_index.nearest(self.seats_lat[self.seat_number], self.seats_lng[self.seat_number], city)
+
+    def assign(self, ballots: np.ndarray):
+        """
+        Assign ballots to the current seat and update the running sums of the seats they belong to.
+        """
+        seat = self.seat_number
+        for ballot in ballots:
+            previous = self.district[ballot]
+            if previous == seat:
+                continue
+            if previous == UNASSIGNED:
+                self.unassigned_in_town[self.town_codes[ballot]] -= 1
+                self.spatial_index.remove(ballot)
+            else:
+                self.members_voters[previous] -= self.voters[ballot]
+                self.members_lat[previous] -= self.lat[ballot]
+                self.members_lng[previous] -= self.lng[ballot]
+                self.members_count[previous] -= 1
+            self.district[ballot] = seat
+            self.members_voters[seat] += self.voters[ballot]
+            self.members_lat[seat] += self.lat[ballot]
+            self.members_lng[seat] += self.lng[ballot]
+            self.members_count[seat] += 1
+
+    def start_seat(self, ballot: int):
+        group = self.id_groups[ballot]
+        self.assign(self.id_members[self.id_offsets[group]:self.id_offsets[group + 1]])
+        self.seats_voters[self.seat_number] = self.voters[ballot]
+        self.seats_lat[self.seat_number] = self.lat[ballot]
+        self.seats_lng[self.seat_number] = self.lng[ballot]
+
+    def grow_seat(self, ballot: int):
+        group = self.id_town_groups[ballot]
+        self.assign(self.id_town_members[self.id_town_offsets[group]:self.id_town_offsets[group + 1]])
+        seat = self.seat_number
+        self.seats_voters[seat] = self.members_voters[seat]
+        self.seats_lat[seat] = self.members_lat[seat] / self.members_count[seat]
+        self.seats_lng[seat] = self.members_lng[seat] / self.members_count[seat]
+
+    def next_seat(self):
+        self.seat_number += 1
+        self.seats_voters.append(0)
+        self.seats_lat.append(-1.0)
+        self.seats_lng.append(-1.0)
+        self.members_voters.append(0)
+        self.members_lat.append(0.0)
+        self.members_lng.append(0.0)
+        self.members_count.append(0)
+
+    def fingerprint(self) -> str:
+        """
+        :return: the sha256 of the engine inputs, a checkpoint is only resumed by an engine with the same inputs
+        """
+        sha256 = hashlib.sha256()
+        for array in (self.town_codes, self.lat, self.lng, self.voters, self.id_groups, self.city_order):
+            sha256.update(np.ascontiguousarray(array).tobytes())
+        sha256.update(f'{self.threshold!r} {self.directions}'.encode())
+        return sha256.hexdigest()
+
+    def save_checkpoint(self, path: str, city_index: int, directions_counter: int):
+        """
+        Save the state of the run between two seats, so the run can be resumed from it. The file is written next to
+        the checkpoint and renamed over it, so an interrupted save keeps the previous checkpoint.
+        :param path: the checkpoint file
+        :param city_index: the position in the city order of the city being districted
+        :param directions_counter: the directions counter of the next seat of the city
+        """
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'wb') as f:
+            np.savez_compressed(f, district=self.district, seat_number=self.seat_number,
+                                seats_voters=self.seats_voters, seats_lat=self.seats_lat, seats_lng=self.seats_lng,
+                                members_voters=self.members_voters, members_lat=self.members_lat,
+                                members_lng=self.members_lng, members_count=self.members_count,
+                                city_index=city_index, directions_counter=directions_counter,
+                                fingerprint=self.fingerprint())
+        os.replace(temporary_path, path)
+
+    def load_checkpoint(self, path: str) -> tuple[int, int] | None:
+        """
+        Restore the state of the run from a checkpoint of save_checkpoint.
+        :param path: the checkpoint file
+        :return: the position in the city order of the city to continue and the directions counter of its next seat,
+        None if the checkpoint was saved by a run on other inputs
+        """
+        with np.load(path) as checkpoint:
+            if str(checkpoint['fingerprint']) != self.fingerprint():
+                return None
+            self.district = checkpoint['district'].astype(np.int64)
+            self.seat_number = int(checkpoint['seat_number'])
+            for name in ('seats_voters', 'seats_lat', 'seats_lng', 'members_voters', 'members_lat', 'members_lng',
+                         'members_count'):
+                setattr(self, name, checkpoint[name].tolist())
+            city_index, directions_counter = int(checkpoint['city_index']), int(checkpoint['directions_counter'])
+        assigned = np.flatnonzero(self.district != UNASSIGNED)
+        self.unassigned_in_town -= np.bincount(self.town_codes[assigned], minlength=len(self.unassigned_in_town))
+        for ballot in assigned:
+            self.spatial_index.remove(ballot)
+        return city_index, directions_counter
+
+    def run(self, telemetry: NoTelemetry = NO_TELEMETRY, checkpoint_path: str = None,
+            checkpoint_seconds: float = ElectionsConstants.DISTRICTING_CHECKPOINT_SECONDS,
+            resume: bool = False) -> np.ndarray:
+        """
+        Split the ballots into seats, city by city, starting from the city with the most voters.
+        With a checkpoint path, the state of the run is saved between two seats every checkpoint_seconds, and a
+        resumed run continues from the saved state to the same result as a run that was not interrupted.
+        The checkpoint is deleted when the run ends.
+        :param telemetry: records the seats and cities timings and growth iterations, see DistrictingTelemetry
+        :param checkpoint_path: the checkpoint file, None to not save checkpoints
+        :param checkpoint_seconds: minimal number of seconds between two checkpoints
+        :param resume: whether to continue from the checkpoint, if it exists
+        :return: the seat number of every ballot, UNASSIGNED for ballots that were not assigned
+        """
+        first_city, directions_counter = 0, 0
+        if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+            position = self.load_checkpoint(checkpoint_path)
+            if position is None:
+                print(f'Ignoring the checkpoint {checkpoint_path}, it was saved by a run on other ballots or seats')
+            else:
+                first_city, directions_counter = position
+                print(f'Resuming the districting from seat {self.seat_number}, '
+                      f'city {first_city} of {len(self.city_order)}')
+        last_checkpoint = time.perf_counter()
+        for city_index in range(first_city, len(self.city_order)):
+            city = self.city_order[city_index]
+            telemetry.start_city(city, ballots=len(self.city_ballots(city)))
+            while self.unassigned_in_town[city] > 0:
+                telemetry.start_seat(self.seat_number)
+                iterations = overflow_iterations = 0
+                self.start_seat(self.starting_ballot(city, directions_counter))
+                while self.seats_voters[self.seat_number] < self.threshold:
+                    if self.unassigned_in_town[city] > 0:
+                        self.grow_seat(self.closest_ballot(city))
+                        iterations += 1
+                    else:
+                        closest_ballot = self.closest_ballot(None)
+                        if closest_ballot == NOT_FOUND:
+                            break
+                        self.grow_seat(closest_ballot)
+                        overflow_iterations += 1
+                telemetry.end_seat(voters=self.seats_voters[self.seat_number], iterations=iterations,
+                                   overflow_iterations=overflow_iterations)
+                self.next_seat()
+                directions_counter += 1
+                if checkpoint_path is not None and time.perf_counter() - last_checkpoint >= checkpoint_seconds:
+                    self.save_checkpoint(checkpoint_path, city_index, directions_counter)
+                    last_checkpoint = time.perf_counter()
+            telemetry.end_city()
+            directions_counter = 0
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return self.district
@@ -0,0 +1,246 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from districting_engine import UNASSIGNED
+from elecetions_constatns import ElectionsConstants
+from table_store import read_table, write_table
+
+# Number of directions of the polygon that approximates the convex hull of a district, with 256 directions its
+# compactness is within about 1% of the compactness of the hull
+HULL_DIRECTIONS = 256
+# Stations per chunk of the hull projections
+CHUNK_SIZE = 1 << 14
+
+
+def local_frame(lat: np.ndarray, lng: np.ndarray, origin: tuple[float, float] = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Project the coordinates to a local equirectangular frame centered on their mean. A degree of longitude is
+    cos(latitude) times shorter than a degree of latitude, so the longitudes are scaled by the cosine of the mean
+    latitude, and the distances are in degrees of latitude (about 111 km) in every direction.
+    :param lat: latitude per station
+    :param lng: longitude per station
+    :param origin: the (lat, lng) center of the frame, to project other points to the frame of given stations,
+    default is the mean of the coordinates
+    :return: the projected (y, x) coordinates of every station
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    origin_lat, origin_lng = (lat.mean(), lng.mean()) if origin is None else origin
+    return lat - origin_lat, (lng - origin_lng) * np.cos(np.radians(origin_lat))
+
+
+def station_neighbors(lat: np.ndarray, lng: np.ndarray, neighbors: int = 8) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Build the neighbor graph of the stations: every station is connected to its closest stations.
+    :param lat: latitude per station
+    :param lng: longitude per station
+    :param neighbors: number of closest stations of every station
+    :return: the two stations of every edge
+    """
+    points = np.column_stack([lat, lng])
+    closest = cKDTree(points).query(points, k=min(neighbors + 1, len(points)))[1][:, 1:]
+    return np.repeat(np.arange(len(points)), closest.shape[1]), closest.ravel()
+
+
+def hull_support(lat: np.ndarray, lng: np.ndarray, groups: np.ndarray, number_of_groups: int) -> np.ndarray:
+    """
+    The support function of the convex hull of every group of stations: the largest projection of its stations on
+    HULL_DIRECTIONS equally spaced directions.
+    :param lat: latitude per station
+    :param lng: longitude per station
+    :param groups: group per station, negative for stations without a group
+    :param number_of_groups: number of groups
+    :return: the (groups, HULL_DIRECTIONS) support matrix, -inf for empty groups
+    """
+    angles = np.arange(HULL_DIRECTIONS) * 2 * np.pi / HULL_DIRECTIONS
+    directions = np.stack([np.cos(angles), np.sin(angles)])
+    support = np.full((number_of_groups, HULL_DIRECTIONS), -np.inf)
+    for start in range(0, len(groups), CHUNK_SIZE):
+        chunk_groups = groups[start:start + CHUNK_SIZE]
+        valid = np.flatnonzero(chunk_groups >= 0)
+        order = valid[np.argsort(chunk_groups[valid], kind='stable')]
+        sorted_groups = chunk_groups[order]
+        if not len(order):
+            continue
+        starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+        projections = np.column_stack([lat[start:start + CHUNK_SIZE][order],
+                                       lng[start:start + CHUNK_SIZE][order]]) @ directions
+        chunk_support = np.maximum.reduceat(projections, starts, axis=0)
+        support[sorted_groups[starts]] = np.maximum(support[sorted_groups[starts]], chunk_support)
+    return support
+
+
+def hull_compactness(support: np.ndarray) -> np.ndarray:
+    """
+    The Polsby-Popper compactness (4 pi area / perimeter^2, 1 for a disc) of the polygon circumscribing every convex
+    hull, whose edges are on the support lines of the hull.
+    :param support: the (groups, directions) support matrix of hull_support
+    :return: the compactness of every group, NaN for groups of a single point
+    """
+    step = 2 * np.pi / support.shape[1]
+    cos, sin = np.cos(step), np.sin(step)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # The length of the edge of the polygon on every support line, from its two neighboring support lines
+        edges = (np.roll(support, 1, axis=1) + np.roll(support, -1, axis=1) - 2 * cos * support) / sin
+        area = 0.5 * (support * edges).sum(axis=1)
+        perimeter = edges.sum(axis=1)
+        compactness = 4 * np.pi * area / perimeter ** 2
+    return np.where(perimeter > 1e-12, compactness, np.nan)
+
+
+def district_components(edges: tuple[np.ndarray, np.ndarray], districts: np.ndarray,
+                        voters: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Split every district into the connected components of the station neighbor graph restricted to the district.
+    :param edges: the station neighbor graph, see station_neighbors
+    :param districts: the district of every station
+    :param voters: registered voters per station
+    :return: the districts of the components, and for every component the number of stations and the voters
+    """
+    first, second = edges
+    inner = (districts[first] == districts[second]) & (districts[first] != UNASSIGNED)
+    graph = sparse.coo_matrix((np.ones(inner.sum(), dtype=np.int8), (first[inner], second[inner])),
+                              shape=(len(districts), len(districts)))
+    _, components = connected_components(graph, directed=False)
+    assigned = districts != UNASSIGNED
+    component_districts = np.full(components.max() + 1, UNASSIGNED)
+    component_districts[components[assigned]] = districts[assigned]
+    sizes = np.bincount(components[assigned], minlength=len(component_districts))
+    component_voters = np.bincount(components[assigned], weights=voters[assigned], minlength=len(component_districts))
+    used = sizes > 0
+    return component_districts[used], sizes[used], component_voters[used]
+
+
+def districts_metrics(lat: np.ndarray, lng: np.ndarray, voters: np.ndarray, town_codes: np.ndarray,
+                      districts: np.ndarray, number_of_seats: int = ElectionsConstants.NUMBER_OF_SEATS,
+                      neighbors: int = 8) -> pd.DataFrame:
+    """
+    Compute the quality metrics of every district of one or more districting plans:
+    - voters and deviation from the single seat quota,
+    - spread: the voters weighted root mean squared distance of the stations from the district centroid, in degrees
+      of latitude,
+    - compactness: the Polsby-Popper compactness of the convex hull of the district stations,
+    - towns: number of towns in the district, and split_towns: the ones that have stations in other districts too,
+    - components: number of connected parts of the district in the station neighbor graph (1 for a contiguous
+      district), and main_component_share: the share of the district voters in its largest part.
+    The distances, the hulls and the neighbor graph are computed in the local_frame of the stations.
+    All the districts of all the plans are reduced together, with grouped sums over plan * districts + district.
+    :param lat: latitude per station
+    :param lng: longitude per station
+    :param voters: registered voters per station
+    :param town_codes: integer town code per station
+    :param districts: the district of every station, for a single plan (n,) or for several plans (plans, n),
+    UNASSIGNED for stations without a district
+    :param number_of_seats: number of seats, the quota is the voters of all the stations divided by it
+    :param neighbors: number of closest stations of every station in the neighbor graph
+    :return: a DataFrame with a row per plan and district
+    """
+    districts = np.atleast_2d(np.asarray(districts, dtype=np.int64))
+    plans, stations = districts.shape
+    number_of_districts = int(districts.max()) + 1
+    groups_count = plans * number_of_districts
+    voters = np.asarray(voters, dtype=np.float64)
+    quota = voters.sum() / number_of_seats
+    # Centered coordinates also keep the squared sums small, so the spread is not lost in the rounding errors
+    lat, lng = local_frame(lat, lng)
+    town_codes = np.asarray(town_codes, dtype=np.int64)
+    towns_count = int(town_codes.max()) + 1
+
+    assigned = districts != UNASSIGNED
+    groups = np.where(assigned, np.arange(plans)[:, None] * number_of_districts + districts, -1)
+    flat_groups = groups[assigned]
+    station = np.broadcast_to(np.arange(stations), districts.shape)[assigned]
+
+    def group_sum(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(flat_groups, weights=weights[station], minlength=groups_count)
+
+    group_stations = np.bincount(flat_groups, minlength=groups_count)
+    group_voters = group_sum(voters)
+    safe_voters = np.maximum(group_voters, 1e-12)
+    center_lat = group_sum(voters * lat) / safe_voters
+    center_lng = group_sum(voters * lng) / safe_voters
+    squares = group_sum(voters * (lat ** 2 + lng ** 2)) / safe_voters
+    spread = np.sqrt(np.maximum(squares - center_lat ** 2 - center_lng ** 2, 0))
+
+    # Towns split between districts, from the distinct (plan, town, district) triplets
+    plan_of_station = np.broadcast_to(np.arange(plans)[:, None], districts.shape)[assigned]
+    triplets = np.unique((plan_of_station * towns_count + town_codes[station]) * number_of_districts +
+                         districts[assigned])
+    triplet_towns, triplet_districts = np.divmod(triplets, number_of_districts)
+    town_districts = np.bincount(triplet_towns, minlength=plans * towns_count)
+    triplet_groups = triplet_towns // towns_count * number_of_districts + triplet_districts
+    group_towns = np.bincount(triplet_groups, minlength=groups_count)
+    group_split_towns = np.bincount(triplet_groups, weights=town_districts[triplet_towns] > 1,
+                                    minlength=groups_count)
+
+    # Contiguity, plan by plan on the same neighbor graph
+    edges = station_neighbors(lat, lng, neighbors)
+    group_components = np.zeros(groups_count, dtype=np.int64)
+    group_main_voters = np.zeros(groups_count)
+    for plan in range(plans):
+        component_districts, _, component_voters = district_components(edges, districts[plan], voters)
+        component_groups = plan * number_of_districts + component_districts
+        group_components += np.bincount(component_groups, minlength=groups_count)
+        np.maximum.at(group_main_voters, component_groups, component_voters)
+
+    compactness = hull_compactness(hull_support(np.tile(lat, plans), np.tile(lng, plans), groups.ravel(),
+                                                groups_count))
+    metrics = pd.DataFrame({'plan': np.repeat(np.arange(plans), number_of_districts),
+                            ElectionsConstants.DISTRICT: np.tile(np.arange(number_of_districts), plans),
+                            'stations': group_stations,
+                            'voters': group_voters,
+                            'quota_deviation': group_voters / quota - 1,
+                            'spread': spread,
+                            'compactness': compactness,
+                            'towns': group_towns,
+                            'split_towns': group_split_towns.astype(np.int64),
+                            'components': group_components,
+                            'main_component_share': group_main_voters / safe_voters})
+    return metrics[metrics['stations'] > 0].reset_index(drop=True)
+
+
+def summarize_plans(metrics: pd.DataFrame, variance: float = ElectionsConstants.DISTRICT_VOTE_VARIANCE) \
+        -> pd.DataFrame:
+    """
+    Summarize the districts metrics of every plan.
+    :param metrics: the districts metrics, see districts_metrics
+    :param variance: allowed relative deviation from the single seat quota
+    :return: a DataFrame with a row per plan
+    """
+    metrics = metrics.assign(abs_deviation=metrics['quota_deviation'].abs(),
+                             out_of_bounds=metrics['quota_deviation'].abs() > variance,
+                             not_contiguous=metrics['components'] > 1)
+    return metrics.groupby('plan').agg(districts=(ElectionsConstants.DISTRICT, 'size'),
+                                       max_quota_deviation=('abs_deviation', 'max'),
+                                       out_of_bounds_districts=('out_of_bounds', 'sum'),
+                                       mean_spread=('spread', 'mean'),
+                                       mean_compactness=('compactness', 'mean'),
+                                       split_towns=('split_towns', 'sum'),
+                                       not_contiguous_districts=('not_contiguous', 'sum')).reset_index()
+
+
+def get_districting_metrics(ballots: pd.DataFrame,
+                            number_of_seats: int = ElectionsConstants.NUMBER_OF_SEATS) -> pd.DataFrame:
+    """
+    Compute the districts metrics of a districting table, like the ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH
+    table.
+    :param ballots: a DataFrame containing the ballots with their coordinates and district column
+    :param number_of_seats: number of seats
+    :return: the districts metrics, see districts_metrics
+    """
+    ballots = ballots.dropna(subset=[ElectionsConstants.LAT, ElectionsConstants.LNG])
+    district = pd.to_numeric(ballots[ElectionsConstants.DISTRICT].astype(object), errors='coerce')
+    return districts_metrics(ballots[ElectionsConstants.LAT].values, ballots[ElectionsConstants.LNG].values,
+                             ballots[ElectionsConstants.REGISTRED_VOTERS].values,
+                             pd.factorize(ballots[ElectionsConstants.TOWN_NAME])[0],
+                             district.fillna(UNASSIGNED).to_numpy(dtype=np.int64), number_of_seats)
+
+
+if __name__ == '__main__':
+    ballots = read_table(ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH)
+    metrics = get_districting_metrics(ballots)
+    write_table(metrics, ElectionsConstants.DISTRICT_METRICS_PATH)
+    print(summarize_plans(metrics))
@@ -0,0 +1,232 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Callable
+
+import pandas as pd
+
+# Context of the phases of a disabled telemetry, reused so a disabled phase costs a single call
+_NO_PHASE = nullcontext()
+
+
+def rounded(fields: dict) -> dict:
+    return {key: round(value, 6) if isinstance(value, float) else value for key, value in fields.items()}
+
+
+class NoTelemetry:
+    """
+    Disabled telemetry: every hook does nothing, so the districting loops call the hooks without checking whether
+    the telemetry is enabled.
+    """
+    enabled = False
+
+    def start_run(self, **fields):
+        pass
+
+    def end_run(self, **fields):
+        pass
+
+    def start_city(self, city: int, **fields):
+        pass
+
+    def end_city(self, **fields):
+        pass
+
+    def start_seat(self, seat: int):
+        pass
+
+    def end_seat(self, **fields):
+        pass
+
+    def phase(self, name: str):
+        return _NO_PHASE
+
+
+NO_TELEMETRY = NoTelemetry()
+
+
+class DistrictingTelemetry(NoTelemetry):
+    """
+    Timings and counters of a districting run, per city and per seat, with progress events.
+    Every hook emits an event, a dict with the event name and the seconds since the start of the run, that is passed
+    to the callback and written as a line of the JSON-lines log:
+    - run_start and run_end, with the number of ballots, cities and seats, and the start time of the run,
+    - city_start and city_end, with the city name, its ballots, seats and seconds,
+    - seat_end, with the seat, its city, voters, growth iterations and seconds.
+    The phases (filtering, sorting, writes, aggregates...) are timed with the phase context, and summed per city.
+    """
+    enabled = True
+
+    def __init__(self, callback: Callable[[dict], None] = None, log_path: str = None):
+        """
+        :param callback: a function called with every event, for example print_progress
+        :param log_path: a JSON-lines file the events are appended to, so a resumed run keeps the events of the
+        interrupted one, None to not write them
+        """
+        self.callback = callback
+        self.log_path = log_path
+        self.log = None
+        self.city_names = None
+        self.run_start = None
+        self.run_started = None
+        self.run_fields = {}
+        self.run_seconds = 0.0
+        self.cities = []
+        self.seats = []
+        self.phases = {}
+        self.city = None
+        self.seat = None
+
+    def emit(self, event: str, **fields):
+        record = {'event': event, 'elapsed': round(time.perf_counter() - self.run_start, 6), **fields}
+        if self.callback is not None:
+            self.callback(record)
+        if self.log is not None:
+            self.log.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.log.flush()
+
+    def start_run(self, city_names=None, **fields):
+        """
+        :param city_names: the names of the town codes, to report the cities by name
+        :param fields: the run parameters to report, like the number of ballots and seats
+        """
+        self.city_names = city_names
+        self.run_start = time.perf_counter()
+        self.run_started = datetime.now().isoformat(timespec='seconds')
+        self.run_fields = fields
+        if self.log_path is not None:
+            self.log = open(self.log_path, 'a', encoding='utf-8')
+        self.emit('run_start', started=self.run_started, **fields)
+
+    def end_run(self, **fields):
+        """
+        Emit the run_end event and close the log, called once the run is done or interrupted.
+        """
+        self.run_seconds = time.perf_counter() - self.run_start
+        try:
+            self.emit('run_end', started=self.run_started, seconds=round(self.run_seconds, 6),
+                      cities=len(self.cities), seats=len(self.seats), **fields)
+        finally:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+    def city_name(self, city: int) -> str:
+        return str(self.city_names[city]) if self.city_names is not None else str(city)
+
+    def start_city(self, city: int, **fields):
+        """
+        :param city: the town code of the city
+        :param fields: the city counters to report, like its number of ballots
+        """
+        self.city = {'city': self.city_name(city), **fields, 'seats': 0, 'iterations': 0,
+                     'start': time.perf_counter()}
+        self.cities.append(self.city)
+        self.emit('city_start', city=self.city['city'], **fields)
+
+    def end_city(self, **fields):
+        self.city['seconds'] = time.perf_counter() - self.city.pop('start')
+        self.city.update(fields)
+        self.emit('city_end', **rounded(self.city))
+        self.city = None
+
+    def start_seat(self, seat: int):
+        self.seat = {'seat': int(seat), 'city': self.city['city'], 'start': time.perf_counter()}
+
+    def end_seat(self, voters: float = 0, iterations: int = 0, overflow_iterations: int = 0):
+        """
+        :param voters: the voters of the seat
+        :param iterations: number of ballots added to the seat after its starting ballot, in its city
+        :param overflow_iterations: number of ballots added to the seat from other cities, when its city was full
+        """
+        seat = self.seat
+        seat['seconds'] = time.perf_counter() - seat.pop('start')
+        seat.update(voters=float(voters), iterations=int(iterations), overflow_iterations=int(overflow_iterations))
+        self.seats.append(seat)
+        self.city['seats'] += 1
+        self.city['iterations'] += seat['iterations'] + seat['overflow_iterations']
+        self.emit('seat_end', **rounded(seat))
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Time a phase of the districting, like 'sort' or 'aggregate', and add it to the current city.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            calls, total = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (calls + 1, total + seconds)
+            if self.city is not None:
+                self.city[name] = self.city.get(name, 0.0) + seconds
+
+    def cities_table(self) -> pd.DataFrame:
+        """
+        :return: a row per city: its ballots, seats, growth iterations, seconds and the seconds of every phase,
+        the slowest cities first
+        """
+        if not self.cities:
+            return pd.DataFrame(columns=['city', 'ballots', 'seats', 'iterations', 'seconds'])
+        return pd.DataFrame(self.cities).fillna(0.0)\
+            .sort_values(by='seconds', ascending=False, kind='stable').reset_index(drop=True)
+
+    def seats_table(self) -> pd.DataFrame:
+        """
+        :return: a row per seat: its city, voters, growth iterations and seconds
+        """
+        return pd.DataFrame(self.seats)
+
+    def phases_table(self) -> pd.DataFrame:
+        """
+        :return: a row per phase: number of calls, seconds and share of the run time, the slowest phases first
+        """
+        phases = pd.DataFrame([{'phase': name, 'calls': calls, 'seconds': seconds}
+                               for name, (calls, seconds) in self.phases.items()],
+                              columns=['phase', 'calls', 'seconds'])
+        phases['share'] = phases['seconds'] / max(self.run_seconds, 1e-12)
+        return phases.sort_values(by='seconds', ascending=False, kind='stable').reset_index(drop=True)
+
+    def summary(self, top: int = 10) -> dict:
+        """
+        :param top: number of slowest cities to report
+        :return: the run totals, the phases and the slowest cities
+        """
+        seats = self.seats_table()
+        iterations = seats['iterations'] + seats['overflow_iterations'] if len(seats) else pd.Series(dtype=int)
+        return {**self.run_fields,
+                'seconds': self.run_seconds,
+                'cities': len(self.cities),
+                'seats': len(self.seats),
+                'iterations': int(iterations.sum()),
+                'mean_seat_iterations': float(iterations.mean()) if len(seats) else 0.0,
+                'max_seat_iterations': int(iterations.max()) if len(seats) else 0,
+                'mean_seat_seconds': float(seats['seconds'].mean()) if len(seats) else 0.0,
+                'phases': self.phases_table().to_dict('records'),
+                'slowest_cities': self.cities_table().head(top).to_dict('records')}
+
+    def report(self, top: int = 10):
+        """
+        Print the summary of the run: the totals, the time of every phase and the slowest cities.
+        :param top: number of slowest cities to print
+        """
+        summary = self.summary(top)
+        print(f"Districted {summary['cities']} cities into {summary['seats']} seats in {summary['seconds']:.2f} "
+              f"seconds, {summary['iterations']} growth iterations (mean {summary['mean_seat_iterations']:.1f}, "
+              f"max {summary['max_seat_iterations']} per seat)")
+        if self.phases:
+            print(self.phases_table().to_string(index=False))
+        if self.cities:
+            print(f'Slowest {top} cities:')
+            print(self.cities_table().head(top).to_string(index=False))
+
+
+def print_progress(event: dict):
+    """
+    A telemetry callback that prints a line when a city is done.
+    """
+    if event['event'] == 'city_end':
+        print(f"{event['elapsed']:.1f}s: {event['city']} - {event['seats']} seats, {event['iterations']} "
+              f"iterations, {event['seconds']:.2f} seconds")
@@ -1,160 +1,53 @@
-import googlemaps
 import json
 import os
 
 import numpy as np
 import pandas as pd
-import time
-import selenium
-from selenium import webdriver
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
 
 from elecetions_constatns import ElectionsConstants
+from geocoding import geocode_many
+from table_store import compact_table, get_vote_columns, read_csv_compact, read_table, write_table
+from town_index import get_table_towns, get_town_codes, join_keys, known_keys, normalize_town_names
 
-chrome_options = Options()
-chrome_options.add_argument('--headless')
-chrome_options.add_argument('--no-sandbox')
-chrome_options.add_argument('--disable-dev-shm-usage')
-chrome_options.add_argument('--enable-logging')
-chrome_options.add_argument('--v=1')
-
-# Set up ChromeDriver service
-chrome_service = Service('/usr/local/bin/chromedriver')
-
-# Initialize the WebDriver with the specified options and service
-driver = webdriver.Chrome(service=chrome_service, options=chrome_options)
-driver.get('https://votes25.bechirot.gov.il/ballotresults')
+# Columns of the geocoded addresses table, see geocode_table
+GEOCODED_ADDRESS = 'geocoded_address'
+IS_LOCALITY = 'is_locality'
 
 
 def load_ballots() -> pd.DataFrame:
-    return pd.read_csv(ElectionsConstants.RAW_BALLOTS_PATH)
+    """
+    Load the ballots of the ElectionsConstants.RAW_BALLOTS_PATH file with compact column types,
+    see table_store.compact_table.
+    :return: a DataFrame containing the ballots
+    """
+    return read_csv_compact(ElectionsConstants.RAW_BALLOTS_PATH)
 
 
 def preprocess_ballots(ballots: pd.DataFrame) -> pd.DataFrame:
-    ballots[ElectionsConstants.TOWN_NAME] = ballots[ElectionsConstants.TOWN_NAME].str.replace('  ', ' ')
+    ballots[ElectionsConstants.TOWN_NAME] = normalize_town_names(ballots[ElectionsConstants.TOWN_NAME])
     return ballots
 
 
-def extract_options(element_id: str) -> list[str]:
-    """
-    Extract the options from a dropdown list element.
-    :param element_id: the ID of the dropdown list element
-    :return: a list of options extracted from the dropdown list
-    """
-    # Click the input to show the dropdown list
-    WebDriverWait(driver, 10).until(EC.element_to_be_clickable((By.ID, element_id)))
-    input_element = driver.find_element(By.ID, element_id)
-    input_element.click()
-    time.sleep(2)  # Allow time for the dropdown to populate
-
-    # Extract all list items
-    options = driver.find_elements(By.XPATH, f"//ul[contains(@id, 'awesomplete_list_') and @aria-label='undefined']/li")
-    return [option.text for option in options if option.get_attribute('role') == 'option']
-
-
-def safely_interact_with_element(callback, *args, max_attempts=3):
-    """
-    Safely interact with an element by handling StaleElementReferenceException.
-    :param callback: selenium function to interact with the element
-    :param args: arguments to pass to the callback function
-    :param max_attempts: maximum number of attempts to interact with the element
-    :return: callback result
-    """
-    attempts = 0
-    while attempts < max_attempts:
-        try:
-            return callback(*args)
-        except selenium.common.exceptions.StaleElementReferenceException:
-            print(f"Encountered StaleElementReferenceException, retrying... Attempt {attempts+1}/{max_attempts}")
-            time.sleep(1)  # Wait a bit before retrying
-        attempts += 1
-    raise Exception("Failed to interact with the element after several attempts.")
-
-
-def select_town(town):
-    town_input = WebDriverWait(driver, 10).until(
-        EC.element_to_be_clickable((By.ID, ElectionsConstants.TOWN_HTML_ELEMENT)))
-    town_input.clear()
-    town_input.send_keys(town)
-    time.sleep(1)  # Allow time for the autocomplete to populate
-
-    # Wait for the autocomplete suggestions to be visible
-    suggestions_xpath = "//ul[contains(@id, 'awesomplete_list_') and @aria-label='undefined']/li"
-    WebDriverWait(driver, 10).until(
-        EC.visibility_of_element_located((By.XPATH, suggestions_xpath)))
-
-    # Get all suggestions that match the text exactly
-    suggestions = driver.find_elements(By.XPATH, suggestions_xpath)
-    for suggestion in suggestions:
-        if suggestion.text == town:
-            suggestion.click()  # Click the exact match
-            break
-    else:
-        raise Exception(f"No exact match found for {town}")
-
-
-def extract_towns_ballots():
+def extract_towns_ballots(workers: int = ElectionsConstants.SCRAPER_WORKERS):
     """
     Extract the towns and the ballots for each town from the website.
     List of towns is extracted from the 'Town' dropdown list.
     List of ballots is extracted from the 'PollingStation' dropdown list.
+    The towns are split between a pool of scrapers, see scraper_pool.scrape_towns_ballots.
     The extracted data is saved in the ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH directory.
+    :param workers: number of concurrent scrapers
     :return:
     """
-    os.mkdir(ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH) if \
-        not os.path.exists(ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH) else None
-    ballots_location_names = os.listdir(ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH)
-
-    # Extract towns
-    towns = extract_options(ElectionsConstants.TOWN_HTML_ELEMENT)
-
-    # For each town, extract ballots
-    for town in towns:
-        if town == '- בחר ישוב -' or f'{town}.json' in ballots_location_names:
-            print(f'{town} already extracted, skipping...')
-            continue
-        print(f'Extracting ballots for {town}')
-        town_ballots = {ElectionsConstants.TOWN: town}
-        try:
-            def attempt_select_town():
-                select_town(town)  # Updated to use the new function
-
-            flag = False
-            while not flag:
-                # Use the safely_interact_with_element function to handle stale elements
-                safely_interact_with_element(attempt_select_town)
-                time.sleep(1)  # Allow time for the page to update
-
-            # Extract ballots for the selected town
-                ballots = extract_options(ElectionsConstants.POLLING_STATION_HTML_ELEMENT)
-                if not ballots:
-                    print(f'No ballots found for {town}, retrying...')
-                    continue
-                else:
-                    flag = True
-
-            print(f'Extracted {len(ballots)} ballots')
-            town_ballots[ElectionsConstants.BALLOTS] = ballots
-            with open(f'{ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH}/{town}.json', 'w', encoding='utf-8') as f:
-                json.dump(town_ballots, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(f'Failed to extract ballots for {town}: {e}'
-                  f'\nSkipping to the next town...')
-            continue
-
-        # Optional: Clear the selection or refresh the page to reset the state
-        driver.refresh()
+    # Selenium is imported only when scraping, so the data functions of this module import without it
+    from scraper_pool import scrape_towns_ballots
 
-    driver.quit()
+    scrape_towns_ballots(workers=workers)
 
 
 def load_ballots_location_names() -> pd.DataFrame:
     """
-    Load the extracted towns and ballots from the ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH directory.
+    Load the extracted towns and ballots from the ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH directory,
+    with compact column types, see table_store.compact_table.
     :return: a DataFrame containing the extracted towns and ballots
     """
     ballots_location_names = os.listdir(ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH)
@@ -168,29 +61,63 @@ def load_ballots_location_names() -> pd.DataFrame:
             towns_ballots.append({ElectionsConstants.TOWN_NAME: town_ballots[ElectionsConstants.TOWN],
                                   ElectionsConstants.LOCATION: ballot.split(' קלפי ')[0],
                                   ElectionsConstants.BALLOT_ID: int(ballot.split(' ')[-1])})
-    ballots_location_df = pd.DataFrame(towns_ballots)
+    ballots_location_df = compact_table(pd.DataFrame(towns_ballots))
     return ballots_location_df
 
 
 def merge_ballots_location():
     """
     Merge the ballots and the ballots meta DataFrames.
-    The merged DataFrame is saved in the ElectionsConstants.MERGED_BALLOTS_PATH file.
+    The towns of the extracted ballots are matched to the town codes (ElectionsConstants.TOWN_CODE) of the ballots by
+    their normalized names, and the ballots are joined on integer (town code, ballot id) keys. The extracted towns
+    that are not in the ballots and the ballots without a location are reported. The vote counts of the ballots of a
+    cluster are summed, see table_store.get_vote_columns.
+    The merged DataFrame is saved in the ElectionsConstants.MERGED_BALLOTS_PATH table.
     :return:
     """
     ballots = load_ballots()
     ballots = preprocess_ballots(ballots)
     ballots_location_df = load_ballots_location_names()
-    ballots_merged = pd.merge(ballots, ballots_location_df, on=[ElectionsConstants.TOWN_NAME,
-                                                                ElectionsConstants.BALLOT_ID])
-    ballots_merged = ballots_merged.groupby([ElectionsConstants.TOWN_NAME, ElectionsConstants.BALLOTS_CLUSTER]).agg(
-        {col: 'sum' for col in ballots_merged.columns if col not in [ElectionsConstants.TOWN_NAME,
-                                                                     ElectionsConstants.BALLOTS_CLUSTER,
-                                                                     ElectionsConstants.LOCATION]} |
-        {ElectionsConstants.LOCATION: 'first'}
-    ).reset_index()
+    ballot_towns, town_index = get_table_towns(ballots)
+    location_towns = get_town_codes(ballots_location_df[ElectionsConstants.TOWN_NAME], town_index,
+                                    'ballots location names')
+    matched = known_keys(location_towns, ballots_location_df[ElectionsConstants.BALLOT_ID])
+    # The locations are joined by their category codes, the names are only looked up for the merged clusters
+    location_names = ballots_location_df[ElectionsConstants.LOCATION].astype('category')
+    locations = pd.Series(location_names.cat.codes.to_numpy()[matched],
+                          index=join_keys(location_towns[matched],
+                                          ballots_location_df.loc[matched, ElectionsConstants.BALLOT_ID]))
+    locations = locations[~locations.index.duplicated()]
+    known = known_keys(ballot_towns, ballots[ElectionsConstants.BALLOT_ID]) & \
+        known_keys(ballot_towns, ballots[ElectionsConstants.BALLOTS_CLUSTER])
+    if not known.all():
+        print(f'{(~known).sum()} ballots have no town code, ballot id or cluster and are dropped')
+    ballots_locations = np.full(len(ballots), np.nan)
+    ballots_locations[known] = locations.reindex(join_keys(ballot_towns[known],
+                                                           ballots.loc[known, ElectionsConstants.BALLOT_ID])).to_numpy()
+    missing = known & np.isnan(ballots_locations)
+    if missing.any():
+        print(f'{missing.sum()} ballots of {ballots.loc[missing, ElectionsConstants.TOWN_NAME].nunique()} towns have '
+              f'no extracted location and are dropped')
+    merged = ~np.isnan(ballots_locations)
+    ballots_merged = ballots[merged]
+    ballot_towns = ballot_towns[merged]
+    ballots_locations = ballots_locations[merged].astype(np.int64)
+
+    # The vote counts of the ballots of a cluster are summed, the cluster keeps the other columns (the town, the
+    # ballot id...) and the location of its first ballot
+    cluster_keys = join_keys(ballot_towns, ballots_merged[ElectionsConstants.BALLOTS_CLUSTER])
+    _, first_rows = np.unique(cluster_keys, return_index=True)
+    vote_columns = get_vote_columns(ballots_merged)
+    clusters = ballots_merged[vote_columns].groupby(cluster_keys).sum()
+    first = ballots_merged.drop(columns=vote_columns).iloc[first_rows].set_index(clusters.index)
+    clusters[ElectionsConstants.LOCATION] = location_names.cat.categories[ballots_locations[first_rows]]
+    keys = [ElectionsConstants.TOWN_NAME, ElectionsConstants.BALLOTS_CLUSTER]
+    ballots_merged = pd.concat([first, clusters], axis=1)[
+        keys + [col for col in ballots.columns if col not in keys] + [ElectionsConstants.LOCATION]]
+    ballots_merged = ballots_merged.sort_values(by=keys, kind='stable').reset_index(drop=True)
     ballots_merged = ballots_merged[ballots_merged[ElectionsConstants.TOWN_NAME] != ElectionsConstants.LATE_VOTES]
-    ballots_merged.to_csv(ElectionsConstants.MERGED_BALLOTS_PATH, index=False)
+    write_table(ballots_merged, ElectionsConstants.MERGED_BALLOTS_PATH)
 
 
 def load_ballots_with_addresses() -> pd.DataFrame:
@@ -212,98 +139,143 @@ def pre_process_ballots_with_addresses(ballots_addresses: pd.DataFrame) -> pd.Da
     ballots_addresses = ballots_addresses.rename(columns={'שם ישוב בחירות': ElectionsConstants.TOWN_NAME, 'סמל רכוז': ElectionsConstants.BALLOTS_CLUSTER})
     ballots_addresses = ballots_addresses.drop_duplicates(subset=[ElectionsConstants.TOWN_NAME,
                                                                   ElectionsConstants.BALLOTS_CLUSTER])
-    ballots_addresses[ElectionsConstants.TOWN_NAME] = ballots_addresses[ElectionsConstants.TOWN_NAME].str\
-        .replace('(', '').str.replace(')', '').str.replace("'", "").str.replace('"', '').str.replace('-', '').str\
-        .replace("  ", " ")
+    ballots_addresses[ElectionsConstants.TOWN_NAME] = \
+        normalize_town_names(ballots_addresses[ElectionsConstants.TOWN_NAME])
     ballots_addresses[ElectionsConstants.BALLOT_ADDRESS] = ballots_addresses[ElectionsConstants.BALLOT_ADDRESS].str\
-        .replace('(', '').str.replace(')', '')
+        .replace(r'[()]', '', regex=True)
     return ballots_addresses
 
 
 def merge_ballots_with_addresses(ballots: pd.DataFrame, ballots_addresses: pd.DataFrame) -> pd.DataFrame:
     """
     Merge the ballots with the addresses DataFrames.
-    :param ballots: a DataFrame containing the ballots
+    The towns of the addresses are matched to the town codes (ElectionsConstants.TOWN_CODE) of the ballots by their
+    normalized names, and the ballots are joined on integer (town code, ballots cluster) keys. Ballots without the town
+    code column are matched by their normalized town names, see town_index.get_table_towns. The address towns that
+    are not in the ballots and the ballots without an address, or without a town or a cluster, are reported.
+    :param ballots: a DataFrame containing the ballots, with the town name and ballots cluster columns
     :param ballots_addresses: a DataFrame containing the ballots with the addresses
     :return: a DataFrame containing the merged data
     """
-    return pd.merge(ballots, ballots_addresses[[ElectionsConstants.TOWN_NAME, ElectionsConstants.BALLOTS_CLUSTER,
-                                                ElectionsConstants.BALLOT_ADDRESS]],
-                    on=[ElectionsConstants.TOWN_NAME, ElectionsConstants.BALLOTS_CLUSTER],
-                    how='left')
+    ballot_towns, town_index = get_table_towns(ballots)
+    address_towns = get_town_codes(ballots_addresses[ElectionsConstants.TOWN_NAME], town_index, 'ballots addresses')
+    matched = known_keys(address_towns, ballots_addresses[ElectionsConstants.BALLOTS_CLUSTER])
+    addresses = pd.Series(ballots_addresses.loc[matched, ElectionsConstants.BALLOT_ADDRESS].to_numpy(dtype=object),
+                          index=join_keys(address_towns[matched],
+                                          ballots_addresses.loc[matched, ElectionsConstants.BALLOTS_CLUSTER]))
+    addresses = addresses[~addresses.index.duplicated()]
+    ballots = ballots.copy()
+    known = known_keys(ballot_towns, ballots[ElectionsConstants.BALLOTS_CLUSTER])
+    keys = join_keys(ballot_towns[known], ballots.loc[known, ElectionsConstants.BALLOTS_CLUSTER])
+    ballot_addresses = np.full(len(ballots), np.nan, dtype=object)
+    ballot_addresses[known] = addresses.reindex(keys).to_numpy()
+    ballots[ElectionsConstants.BALLOT_ADDRESS] = ballot_addresses
+    missing = ~known
+    missing[known] = ~np.isin(keys, addresses.index)
+    if missing.any():
+        print(f'{missing.sum()} ballots of {ballots.loc[missing, ElectionsConstants.TOWN_NAME].nunique()} towns have '
+              f'no address')
+    return ballots.reset_index(drop=True)
+
+
+def save_ballots_with_addresses():
+    """
+    Merge the merged ballots with the addresses of the ballots meta file.
+    The merged DataFrame is saved in the ElectionsConstants.BALLOTS_WITH_ADDRESSES_PATH table.
+    :return:
+    """
+    ballots_merged = read_table(ElectionsConstants.MERGED_BALLOTS_PATH)
+    ballots_addresses = load_ballots_with_addresses()
+    ballots_addresses = pre_process_ballots_with_addresses(ballots_addresses)
+    ballots_merged = merge_ballots_with_addresses(ballots_merged, ballots_addresses)
+    write_table(ballots_merged, ElectionsConstants.BALLOTS_WITH_ADDRESSES_PATH)
+
+
+def download_ballots_coordinates():
+    """
+    Download the coordinates of the ballots of the ElectionsConstants.BALLOTS_WITH_ADDRESSES_PATH table.
+    :return:
+    """
+    download_coordination_with_googlemap(read_table(ElectionsConstants.BALLOTS_WITH_ADDRESSES_PATH))
+
+
+def get_ballots_addresses(ballots: pd.DataFrame) -> pd.Series:
+    """
+    Build the address to geocode for every ballot: the ballot address if known, the ballot location name otherwise.
+    :param ballots: a DataFrame containing the ballots
+    :return: the address of every ballot
+    """
+    town = ballots[ElectionsConstants.TOWN_NAME].astype(object)
+    address = ballots[ElectionsConstants.BALLOT_ADDRESS].astype(object)
+    location = ballots[ElectionsConstants.LOCATION].astype(object)
+    addresses = (town + ', ' + address).where(address.notnull(), town + ', ' + location)
+    return addresses.where(address != town, town)
+
+
+def get_locality(geocode_result: dict) -> str | None:
+    localities = [x['long_name'] for x in geocode_result['address_components']
+                  if ElectionsConstants.LOCALITY in x['types']]
+    return localities[0] if len(localities) > 0 else None
+
+
+def geocode_table(addresses) -> pd.DataFrame:
+    """
+    Geocode distinct addresses and parse the first result of every address.
+    :param addresses: the addresses to geocode, every distinct address is geocoded once, see geocoding.geocode_many
+    :return: a DataFrame with a row per geocoded address: the address, its coordinates, its locality and whether
+    the result is a locality (and not a street address or a place)
+    """
+    geocode_results = geocode_many(pd.unique(pd.Series(addresses, dtype=object).dropna()))
+    rows = []
+    for address, geocode_result in geocode_results.items():
+        try:
+            rows.append({GEOCODED_ADDRESS: address,
+                         ElectionsConstants.LAT:
+                             geocode_result[0]['geometry'][ElectionsConstants.LOCATION][ElectionsConstants.LAT],
+                         ElectionsConstants.LNG:
+                             geocode_result[0]['geometry'][ElectionsConstants.LOCATION][ElectionsConstants.LNG],
+                         ElectionsConstants.LOCALITY: get_locality(geocode_result[0]),
+                         IS_LOCALITY: ElectionsConstants.LOCALITY in geocode_result[0]['types']})
+        except Exception as e:
+            print(f'Failed to extract coordinates for {address}: {e}'
+                  f'\nSkipping to the next address...')
+    return pd.DataFrame(rows, columns=[GEOCODED_ADDRESS, ElectionsConstants.LAT, ElectionsConstants.LNG,
+                                       ElectionsConstants.LOCALITY, IS_LOCALITY])
 
 
 def download_coordination_with_googlemap(ballots: pd.DataFrame):
     """
     Download the coordinates of the towns using Google Maps API.
+    Every distinct town and address is geocoded once, and the results are joined back to the ballots.
     The coordinates are saved in the ElectionsConstants.BALLOTS_WITH_COORDINATES_PATH file.
     :param ballots: a DataFrame containing the towns
     :return:
     """
-    # Load the Google Maps API key from the environment variable
-    api_key = os.getenv('GCP_KEY')
-    if api_key is None:
-        raise Exception("Google Maps API key not found. Set the GCP_KEY environment variable.")
-    gmaps = googlemaps.Client(key=api_key)
-    lat = []
-    lng = []
-    localties = []
-    town_localities = []
-    current_town = ''
-    for idx, row in ballots.iterrows():
-        try:
-            if row[ElectionsConstants.TOWN_NAME] != current_town:
-                current_town = row[ElectionsConstants.TOWN_NAME]
-                geocode_result = gmaps.geocode(current_town)
-                town_locality = [x['long_name'] for x in geocode_result[0]['address_components']
-                                 if ElectionsConstants.LOCALITY in x['types']]
-                town_locality = town_locality[0] if len(town_locality) > 0 else None
-            town_localities.append(town_locality)
-        except Exception as e:
-            print(f'Failed to extract coordinates for the town {current_town}: {e}'
-                  f'\nSkipping to the next ballots...')
-            town_localities.append(None)
-        try:
-            if not pd.isna(row[ElectionsConstants.BALLOT_ADDRESS]):
-                if row[ElectionsConstants.BALLOT_ADDRESS] == row[ElectionsConstants.TOWN_NAME]:
-                    addres = row[ElectionsConstants.TOWN_NAME]
-                else:
-                    addres = row[ElectionsConstants.TOWN_NAME] + ', ' + row[ElectionsConstants.BALLOT_ADDRESS]
-            else:
-                addres = row[ElectionsConstants.TOWN_NAME] + ', ' + row[ElectionsConstants.LOCATION]
-            geocode_result = gmaps.geocode(addres)
-            lat.append(geocode_result[0]['geometry'][ElectionsConstants.LOCATION][ElectionsConstants.LAT])
-            lng.append(geocode_result[0]['geometry'][ElectionsConstants.LOCATION][ElectionsConstants.LNG])
-            locality = [x['long_name'] for x in geocode_result[0]['address_components']
-                        if ElectionsConstants.LOCALITY in x['types']]
-            locality = locality[0] if len(locality) > 0 else None
-            localties.append(locality)
-        except Exception as e:
-            print(f'Failed to extract coordinates for {addres}: {e}'
-                  f'\nSkipping to the next ballots...')
-            lat.append(None)
-            lng.append(None)
-            localties.append(None)
-            continue
-    ballots[ElectionsConstants.LAT] = lat
-    ballots[ElectionsConstants.LNG] = lng
-    ballots[ElectionsConstants.LOCALITY] = localties
-    ballots[ElectionsConstants.TOWN_LOCALITY] = town_localities
-    ballots.to_csv(ElectionsConstants.BALLOTS_WITH_COORDINATES_PATH, index=False)
+    ballots = ballots.copy()
+    ballots[GEOCODED_ADDRESS] = get_ballots_addresses(ballots)
+    geocoded = geocode_table(pd.concat([ballots[ElectionsConstants.TOWN_NAME].astype(object),
+                                        ballots[GEOCODED_ADDRESS]]))
+    towns = geocoded[[GEOCODED_ADDRESS, ElectionsConstants.LOCALITY]].rename(
+        columns={GEOCODED_ADDRESS: ElectionsConstants.TOWN_NAME,
+                 ElectionsConstants.LOCALITY: ElectionsConstants.TOWN_LOCALITY})
+    ballots = ballots.drop(columns=[ElectionsConstants.LAT, ElectionsConstants.LNG, ElectionsConstants.LOCALITY,
+                                    ElectionsConstants.TOWN_LOCALITY], errors='ignore')
+    ballots[ElectionsConstants.TOWN_NAME] = ballots[ElectionsConstants.TOWN_NAME].astype(object)
+    ballots = ballots.merge(geocoded.drop(columns=IS_LOCALITY), on=GEOCODED_ADDRESS, how='left')
+    ballots = ballots.merge(towns, on=ElectionsConstants.TOWN_NAME, how='left')
+    write_table(ballots.drop(columns=GEOCODED_ADDRESS), ElectionsConstants.BALLOTS_WITH_COORDINATES_PATH)
 
 
 def fill_small_town_location():
     """
     Fill the missing locations of the small towns.
     We use the Google Maps API to extract the coordinates of the towns and not the location.
-    The filled DataFrame is saved in the 'data/ballots_with_coordinates_filled.csv' file.
+    Every distinct town is geocoded once, and the results are joined back to the ballots missing a location.
+    The filled DataFrame is saved in the ElectionsConstants.BALLOTS_WITH_COORDINATES_FILLED_PATH file.
     :return:
     """
-    api_key = os.getenv('GCP_KEY')
-    if api_key is None:
-        raise Exception("Google Maps API key not found. Set the GCP_KEY environment variable.")
-    gmaps = googlemaps.Client(key=api_key)
-    ballots = pd.read_csv(ElectionsConstants.BALLOTS_WITH_COORDINATES_PATH)
+    ballots = read_table(ElectionsConstants.BALLOTS_WITH_COORDINATES_PATH)
+    ballots[ElectionsConstants.LOCALITY] = ballots[ElectionsConstants.LOCALITY].astype(object)
     replace_dict = {'אשדוד': 'Ashdod', 'אשקלון': 'Ashkelon', 'בית שמש': 'Bet Shemesh', 'בני ברק': 'Bnei Brak',
                     'גבעתיים': "Giv'atayim", 'הרצליה': 'Herzliya', 'חדרה': 'Hadera',
                     'חולון': 'Holon', 'טבריה': 'Tiberias', 'טייבה': 'Tayibe', 'ירושלים': 'Jerusalem',
@@ -326,39 +298,23 @@ def fill_small_town_location():
         (ballots[ElectionsConstants.LOCALITY] != ballots[ElectionsConstants.TOWN_LOCALITY])
         & (ballots[ElectionsConstants.TOWN_LOCALITY].notnull()),
         [ElectionsConstants.LAT, ElectionsConstants.LNG, ElectionsConstants.LOCALITY]] = None
-    for idx, row in ballots.iterrows():
-        if np.isnan(row[ElectionsConstants.LAT]):
-            try:
-                address = row[ElectionsConstants.TOWN_NAME]
-                neighborhood_dict = {'תל אביב יפו': 'תל אביב', 'כרם יבנה ישיבה': 'כרם ביבנה',
-                                     'מודיעיןמכביםרעות': 'מכבים רעות'}
-                if address in neighborhood_dict:
-                    address = neighborhood_dict[address]
-                geocode_result = gmaps.geocode(address)
-                if 'locality' not in geocode_result[0]['types']:
-                    print(f'Failed to extract coordinates for {address}:'
-                          f'\nSkipping to the next ballots...')
-                    continue
-                ballots.loc[idx, ElectionsConstants.LAT] = \
-                    geocode_result[0]['geometry'][ElectionsConstants.LOCATION][ElectionsConstants.LAT]
-                ballots.loc[idx, ElectionsConstants.LNG] = \
-                    geocode_result[0]['geometry'][ElectionsConstants.LOCATION][ElectionsConstants.LNG]
-                ballots.loc[idx, ElectionsConstants.LOCALITY] = \
-                    [x['long_name'] for x in geocode_result[0]['address_components']
-                     if ElectionsConstants.LOCALITY in x['types']][0]
-            except Exception as e:
-                print(f'Failed to extract coordinates for {address}: {e}'
-                      f'\nSkipping to the next ballots...')
-                continue
-    ballots.to_csv('data/ballots_with_coordinates_filled.csv', index=False)
+    neighborhood_dict = {'תל אביב יפו': 'תל אביב', 'כרם יבנה ישיבה': 'כרם ביבנה',
+                         'מודיעיןמכביםרעות': 'מכבים רעות'}
+    missing = ballots[ElectionsConstants.LAT].isnull()
+    missing_towns = ballots.loc[missing, [ElectionsConstants.TOWN_NAME]].astype(object)
+    missing_towns[GEOCODED_ADDRESS] = missing_towns[ElectionsConstants.TOWN_NAME].replace(neighborhood_dict)
+    geocoded = geocode_table(missing_towns[GEOCODED_ADDRESS])
+    for address in geocoded.loc[~geocoded[IS_LOCALITY].astype(bool), GEOCODED_ADDRESS]:
+        print(f'Failed to extract coordinates for {address}:'
+              f'\nSkipping to the next ballots...')
+    geocoded = geocoded[geocoded[IS_LOCALITY].astype(bool)]
+    filled = missing_towns.merge(geocoded, on=GEOCODED_ADDRESS, how='left')
+    ballots.loc[missing, [ElectionsConstants.LAT, ElectionsConstants.LNG, ElectionsConstants.LOCALITY]] = \
+        filled[[ElectionsConstants.LAT, ElectionsConstants.LNG, ElectionsConstants.LOCALITY]].to_numpy()
+    write_table(ballots, ElectionsConstants.BALLOTS_WITH_COORDINATES_FILLED_PATH)
 
 
 if __name__ == '__main__':
-    # extract_towns_ballots()
-    # merge_ballots_location()
-    # ballots_merged = pd.read_csv(ElectionsConstants.MERGED_BALLOTS_PATH)
-    # ballots_addresses = load_ballots_with_addresses()
-    # ballots_addresses = pre_process_ballots_with_addresses(ballots_addresses)
-    # ballots_merged = merge_ballots_with_addresses(ballots_merged, ballots_addresses)
-    # download_coordination_with_googlemap(ballots=ballots_merged)
-    fill_small_town_location()
+    from pipeline import run_pipeline
+
+    run_pipeline()
@@ -5,26 +5,60 @@ from dataclasses import dataclass
 class ElectionsConstants:
     BALLOT_ADDRESS: str = 'כתובת קלפי'
     BALLOT_ID: str = 'ברזל'
+    BALLOT_RESULTS_FIXTURE_PATH: str = "data/fixtures/ballotresults.html"
+    BALLOT_RESULTS_URL: str = 'https://votes25.bechirot.gov.il/ballotresults'
     BALLOTS: str = 'ballots'
     BALLOTS_CLUSTER: str = 'ריכוז'
     BALLOTS_LOCATION_NAMES_PATH: str = "data/ballots_location_names"
     BALLOTS_META_PATH: str = "data/ballots_meta.csv"
+    BALLOTS_WITH_ADDRESSES_PATH: str = "data/ballots_with_addresses.csv"
     BALLOTS_WITH_COORDINATES_PATH: str = "data/ballots_with_coordinates.csv"
     BALLOTS_WITH_COORDINATES_FILLED_PATH: str = "data/ballots_with_coordinates_filled.csv"
     BALLOTS_WITH_DISTRICTS_PATH: str = "data/ballots_with_districts.csv"
+    BENCHMARKS_PATH: str = "data/benchmarks"
+    CHROMEDRIVER_PATH: str = '/usr/local/bin/chromedriver'
     DISTRICT: str = 'district'
+    DISTRICT_METRICS_PATH: str = "data/district_metrics.csv"
+    DISTRICT_RESULTS_PATH: str = "data/district_results.csv"
     DISTRICT_VOTE_VARIANCE: float = 0.02
+    DISTRICTING_CHECKPOINT_PATH: str = "data/districting_checkpoint.npz"
+    DISTRICTING_CHECKPOINT_SECONDS: float = 60
+    DISTRICTING_MODE: str = 'greedy'
+    DISTRICTING_TELEMETRY_PATH: str = "data/districting_telemetry.jsonl"
+    GEOCODE_CACHE_EXPIRY_DAYS: float = 180
+    GEOCODE_CACHE_PATH: str = "data/geocode_cache.sqlite"
+    GEOCODE_CALLS_PER_SECOND: float = 40
+    GEOCODE_RETRIES: int = 3
+    GEOCODE_RETRY_BACKOFF_SECONDS: float = 1
+    GEOCODE_STUB_CACHE_PATH: str = "data/geocode_stub_cache.sqlite"
+    GEOCODE_WORKERS: int = 8
     LAT: str = 'lat'
     LATE_VOTES: str = 'מעטפות חיצוניות'
     LOCALITY: str = 'locality'
     LOCATION: str = 'location'
     LNG: str = 'lng'
+    LOOKUP_HOST: str = '127.0.0.1'
+    LOOKUP_PORT: int = 8765
+    LOOKUP_RELOAD_SECONDS: float = 1
+    MARGIN: str = 'margin'
+    MARGIN_SHARE: str = 'margin_share'
     MERGED_BALLOTS_PATH: str = "data/ballots_merged.csv"
     NUMBER_OF_SEATS: int = 120
+    OPTIMIZER_TIME_BUDGET_SECONDS: float = 60
+    PIPELINE_STATE_PATH: str = "data/pipeline_state.json"
+    POLLING_STATION_HTML_ELEMENT: str = 'PollingStation'
     RAW_BALLOTS_PATH: str = "data/ballots.csv"
     REGISTRED_VOTERS: str = 'בזב'
-    POLLING_STATION_HTML_ELEMENT: str = 'PollingStation'
+    SCENARIOS_PATH: str = "data/scenarios"
+    SCENARIOS_SUMMARY_PATH: str = "data/scenarios/summary.csv"
+    SCRAPER_TIMEOUT_SECONDS: float = 10
+    SCRAPER_WORKERS: int = 4
+    STARTING_DIRECTIONS: tuple = ('east', 'west', 'north', 'south')
+    TABLE_FORMAT: str = 'parquet'
     TOWN: str = 'town'
+    TOWN_CODE: str = "סמל ישוב"
     TOWN_HTML_ELEMENT: str = 'TOWN'
     TOWN_LOCALITY: str = 'town_locality'
-    TOWN_NAME: str = "שם ישוב"
\ No newline at end of file
+    TOWN_NAME: str = "שם ישוב"
+    VALID_VOTES: str = 'כשרים'
+    WINNER: str = 'winner'
\ No newline at end of file
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from districting_engine import UNASSIGNED
+from elecetions_constatns import ElectionsConstants
+from table_store import get_party_columns, read_table, write_table
+
+
+def get_votes_matrix(ballots: pd.DataFrame, parties: list[str] = None) -> tuple[np.ndarray, list[str]]:
+    """
+    Convert the party vote columns to a stations x parties matrix.
+    :param ballots: a DataFrame containing the ballots
+    :param parties: the party columns, default is get_party_columns(ballots)
+    :return: the int32 votes matrix and the parties of its columns
+    """
+    parties = parties or get_party_columns(ballots)
+    return np.ascontiguousarray(ballots[parties].to_numpy(dtype=np.int32)), parties
+
+
+def get_district_codes(ballots: pd.DataFrame) -> np.ndarray:
+    """
+    :return: the district of every ballot as an int64 array, UNASSIGNED for ballots without a district
+    """
+    district = pd.to_numeric(ballots[ElectionsConstants.DISTRICT].astype(object), errors='coerce')
+    return district.fillna(UNASSIGNED).to_numpy(dtype=np.int64)
+
+
+def districts_matrix(districts: np.ndarray, number_of_districts: int = None) -> sparse.csc_matrix:
+    """
+    Build the sparse (plans x districts) x stations matrix that sums the stations of every district.
+    Every station has a single entry per plan, so the matrix is built column by column without sorting.
+    :param districts: the district of every station, for a single plan (n,) or for several plans (plans, n),
+    UNASSIGNED stations are not counted
+    :param number_of_districts: number of districts of every plan, default is the largest district + 1
+    :return: a matrix whose row plan * number_of_districts + district selects the stations of the district
+    """
+    districts = np.atleast_2d(districts)
+    number_of_districts = number_of_districts or int(districts.max()) + 1
+    plans, stations = districts.shape
+    assigned = districts != UNASSIGNED
+    rows = np.where(assigned, np.arange(plans)[:, None] * number_of_districts + districts, 0)
+    return sparse.csc_matrix((assigned.T.ravel().astype(np.int32), rows.T.ravel(),
+                              np.arange(0, plans * stations + 1, plans)),
+                             shape=(plans * number_of_districts, stations))
+
+
+def district_votes(votes: np.ndarray, districts: np.ndarray, number_of_districts: int = None) -> np.ndarray:
+    """
+    Sum the votes of the stations of every district with a single sparse matrix product.
+    :param votes: the stations x parties votes matrix
+    :param districts: the district of every station, for a single plan (n,) or for several plans (plans, n)
+    :param number_of_districts: number of districts of every plan, default is the largest district + 1
+    :return: the (plans x districts) x parties votes matrix
+    """
+    return np.asarray(districts_matrix(districts, number_of_districts) @ votes)
+
+
+def district_winners(votes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the winner of every district and its margin over the runner-up.
+    Ties are won by the first party in the columns order.
+    :param votes: the districts x parties votes matrix
+    :return: the winning party column of every district and the winner margin in votes
+    """
+    winners = np.argmax(votes, axis=1)
+    if votes.shape[1] < 2:
+        return winners, votes[:, 0].copy()
+    top_two = -np.partition(-votes, 1, axis=1)[:, :2]
+    return winners, top_two[:, 0] - top_two[:, 1]
+
+
+def national_seats(winners: np.ndarray, number_of_parties: int, plans: int = 1,
+                   valid: np.ndarray = None) -> np.ndarray:
+    """
+    Count the seats every party wins.
+    :param winners: the winning party of every district, plan after plan
+    :param number_of_parties: number of parties
+    :param plans: number of plans in winners
+    :param valid: a mask of the districts that count (districts with votes), default is all the districts
+    :return: the plans x parties seats matrix
+    """
+    plan = np.repeat(np.arange(plans), len(winners) // plans)
+    valid = np.ones(len(winners), dtype=bool) if valid is None else valid
+    return np.bincount(plan[valid] * number_of_parties + winners[valid],
+                       minlength=plans * number_of_parties).reshape(plans, number_of_parties)
+
+
+def score_districtings(votes: np.ndarray, districts: np.ndarray, number_of_districts: int = None,
+                       chunk_size: int = 256) -> np.ndarray:
+    """
+    Score many districting plans at once: the national seats every party wins in every plan.
+    The plans are scored in chunks, every chunk with a single sparse matrix product.
+    :param votes: the stations x parties votes matrix
+    :param districts: the (plans, n) district of every station in every plan
+    :param number_of_districts: number of districts of every plan, default is the largest district + 1
+    :param chunk_size: number of plans per sparse product
+    :return: the plans x parties seats matrix
+    """
+    districts = np.atleast_2d(districts)
+    number_of_districts = number_of_districts or int(districts.max()) + 1
+    seats = []
+    for start in range(0, len(districts), chunk_size):
+        chunk = districts[start:start + chunk_size]
+        chunk_votes = district_votes(votes, chunk, number_of_districts)
+        # Only the winners count here, the margins are not computed
+        winners = np.argmax(chunk_votes, axis=1)
+        seats.append(national_seats(winners, votes.shape[1], len(chunk), valid=chunk_votes.any(axis=1)))
+    return np.concatenate(seats)
+
+
+def get_district_results(ballots: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]:
+    """
+    Compute the results of a districting: the votes of every party in every district, the winner and its margin,
+    and the national seats of every party.
+    :param ballots: a DataFrame containing the ballots with their party votes and district column
+    :return: the districts results DataFrame and the seats of every party
+    """
+    votes, parties = get_votes_matrix(ballots)
+    districts = get_district_codes(ballots)
+    results_votes = district_votes(votes, districts)
+    winners, margins = district_winners(results_votes)
+    total = results_votes.sum(axis=1)
+    results = pd.DataFrame(results_votes, columns=parties)
+    results.insert(0, ElectionsConstants.DISTRICT, np.arange(len(results)))
+    results.insert(1, ElectionsConstants.WINNER, np.array(parties)[winners])
+    results.insert(2, ElectionsConstants.MARGIN, margins)
+    results.insert(3, ElectionsConstants.MARGIN_SHARE, margins / np.maximum(total, 1))
+    results = results[total > 0]
+    seats = pd.Series(national_seats(winners, len(parties), valid=total > 0)[0], index=parties, name='seats')
+    return results, seats[seats > 0].sort_values(ascending=False, kind='stable')
+
+
+if __name__ == '__main__':
+    ballots = read_table(ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH)
+    results, seats = get_district_results(ballots)
+    write_table(results, ElectionsConstants.DISTRICT_RESULTS_PATH)
+    print(seats)
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from elecetions_constatns import ElectionsConstants
+
+
+def normalize_address(address: str) -> str:
+    """
+    Normalize an address so the same address written differently gets the same cache key.
+    :param address: the address to normalize
+    :return: the address without repeated or surrounding spaces, case folded
+    """
+    return ' '.join(str(address).split()).casefold()
+
+
+def address_key(address: str) -> str:
+    return hashlib.sha256(normalize_address(address).encode('utf-8')).hexdigest()
+
+
+class GeocodeCache:
+    """
+    Disk-backed cache of geocode results, keyed by the hash of the normalized address.
+    Results older than the expiry are treated as missing.
+    """
+
+    def __init__(self, path: str = ElectionsConstants.GEOCODE_CACHE_PATH,
+                 expiry_days: float = ElectionsConstants.GEOCODE_CACHE_EXPIRY_DAYS):
+        """
+        :param path: the sqlite file of the cache
+        :param expiry_days: number of days a result stays valid, None to never expire
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS geocode '
+                                '(key TEXT PRIMARY KEY, address TEXT, result TEXT, created REAL)')
+        self.expiry_seconds = None if expiry_days is None else expiry_days * 24 * 60 * 60
+
+    def get(self, address: str) -> list | None:
+        """
+        :param address: the address to look up
+        :return: the cached geocode result, None if the address is not cached or expired
+        """
+        row = self.connection.execute('SELECT result, created FROM geocode WHERE key = ?',
+                                      (address_key(address),)).fetchone()
+        if row is None or (self.expiry_seconds is not None and time.time() - row[1] > self.expiry_seconds):
+            return None
+        return json.loads(row[0])
+
+    def set(self, address: str, result: list):
+        self.connection.execute('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?)',
+                                (address_key(address), address, json.dumps(result, ensure_ascii=False),
+                                 time.time()))
+        self.connection.commit()
+
+
+class StubGeocoder:
+    """
+    Offline geocoder with the same geocode interface as googlemaps.Client, answering from a JSON file that maps
+    an address to its geocode result. Unknown addresses get an empty result, like a ZERO_RESULTS response.
+    The stub results are cached in their own file, see get_cache_path.
+    """
+
+    def __init__(self, path: str = None, results: dict = None):
+        """
+        :param path: a JSON file mapping addresses to geocode results
+        :param results: a dict mapping addresses to geocode results, used when no path is given
+        """
+        if path is None and results is None:
+            raise Exception('A stub geocoder needs a results file, set the GEOCODE_STUB_PATH environment variable.')
+        if path is not None:
+            with open(path, 'r', encoding='utf-8') as f:
+                results = json.load(f)
+        self.results = {normalize_address(address): result for address, result in (results or {}).items()}
+        self.calls = 0
+
+    def geocode(self, address: str) -> list:
+        self.calls += 1
+        return self.results.get(normalize_address(address), [])
+
+
+def get_geocoder():
+    """
+    Create the geocoder: a StubGeocoder over the GEOCODE_STUB_PATH file when GEOCODER=stub,
+    a Google Maps client over the GCP_KEY API key otherwise.
+    """
+    if os.getenv('GEOCODER') == 'stub':
+        stub_path = os.getenv('GEOCODE_STUB_PATH')
+        if stub_path is None:
+            raise Exception("Geocode stub results not found. Set the GEOCODE_STUB_PATH environment variable.")
+        return StubGeocoder(stub_path)
+    import googlemaps
+
+    api_key = os.getenv('GCP_KEY')
+    if api_key is None:
+        raise Exception("Google Maps API key not found. Set the GCP_KEY environment variable.")
+    return googlemaps.Client(key=api_key)
+
+
+def get_cache_path(geocoder=None) -> str:
+    """
+    Find the default cache file of a geocoder: the stub geocoder has its own cache, so offline runs never fill the
+    cache of the real geocoder.
+    :param geocoder: the geocoder, None for the default geocoder of get_geocoder
+    :return: ElectionsConstants.GEOCODE_STUB_CACHE_PATH for a StubGeocoder, ElectionsConstants.GEOCODE_CACHE_PATH
+    otherwise
+    """
+    if isinstance(geocoder, StubGeocoder) or (geocoder is None and os.getenv('GEOCODER') == 'stub'):
+        return ElectionsConstants.GEOCODE_STUB_CACHE_PATH
+    return ElectionsConstants.GEOCODE_CACHE_PATH
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces calls at least 1 / calls_per_second seconds apart.
+    """
+
+    def __init__(self, calls_per_second: float):
+        self.interval = 1 / calls_per_second
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def geocode_with_retries(geocoder, address: str, rate_limiter: RateLimiter, retries: int) -> list | None:
+    """
+    Geocode an address, retrying with an exponential backoff on failures.
+    :return: the geocode result, None if all the attempts failed
+    """
+    for attempt in range(retries):
+        rate_limiter.wait()
+        try:
+            return geocoder.geocode(address)
+        except Exception as e:
+            print(f'Failed to geocode {address}: {e}, attempt {attempt + 1}/{retries}')
+            if attempt < retries - 1:
+                time.sleep(2 ** attempt * ElectionsConstants.GEOCODE_RETRY_BACKOFF_SECONDS)
+    return None
+
+
+def geocode_many(addresses, geocoder=None, cache: GeocodeCache = None,
+                 max_workers: int = ElectionsConstants.GEOCODE_WORKERS,
+                 calls_per_second: float = ElectionsConstants.GEOCODE_CALLS_PER_SECOND,
+                 retries: int = ElectionsConstants.GEOCODE_RETRIES) -> dict[str, list | None]:
+    """
+    Geocode a batch of addresses.
+    Every distinct address is looked up once: cached results are returned without calling the geocoder,
+    and the rest are geocoded by a bounded pool of workers, rate limited and retried, and saved in the cache.
+    :param addresses: the addresses to geocode
+    :param geocoder: an object with a geocode(address) method, default is get_geocoder()
+    :param cache: the geocode cache, default is a GeocodeCache in the cache file of the geocoder, see get_cache_path
+    :param max_workers: maximal number of concurrent geocoder calls
+    :param calls_per_second: maximal rate of geocoder calls
+    :param retries: number of attempts per address
+    :return: a dict from every address to its geocode result, None for addresses that failed
+    """
+    cache = cache or GeocodeCache(get_cache_path(geocoder))
+    results = {}
+    missing = {}
+    for address in addresses:
+        if address in results or address in missing:
+            continue
+        result = cache.get(address)
+        if result is None:
+            missing[address] = address_key(address)
+        else:
+            results[address] = result
+    if not missing:
+        return results
+
+    # Addresses that differ only in the normalization are geocoded once
+    unique_missing = {key: address for address, key in missing.items()}
+    print(f'Geocoding {len(unique_missing)} addresses, {len(results)} found in the cache')
+    geocoder = geocoder or get_geocoder()
+    rate_limiter = RateLimiter(calls_per_second)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        geocoded = dict(zip(unique_missing.keys(),
+                            executor.map(lambda address: geocode_with_retries(geocoder, address, rate_limiter,
+                                                                              retries),
+                                         unique_missing.values())))
+    for key, address in unique_missing.items():
+        if geocoded[key] is not None:
+            cache.set(address, geocoded[key])
+    for address, key in missing.items():
+        results[address] = geocoded[key]
+    return results
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Callable
+
+import districing
+import download_locations
+from elecetions_constatns import ElectionsConstants
+from table_store import existing_table_path, table_path
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[], None]
+    inputs: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+
+
+def run_districting():
+    ballots = districing.load_data()
+    ballots = districing.pre_process_data(ballots)
+    districing.get_districts(ballots)
+
+
+# The extract stage scrapes the website and has no input files, so once its directory exists it runs again only when
+# it is forced: run_pipeline(force=['extract_towns_ballots']), which extracts the towns that are not saved yet
+PIPELINE_STAGES = [
+    Stage('extract_towns_ballots', download_locations.extract_towns_ballots,
+          outputs=[ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH]),
+    Stage('merge_ballots_location', download_locations.merge_ballots_location,
+          inputs=[ElectionsConstants.RAW_BALLOTS_PATH, ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH],
+          outputs=[ElectionsConstants.MERGED_BALLOTS_PATH]),
+    Stage('merge_ballots_with_addresses', download_locations.save_ballots_with_addresses,
+          inputs=[ElectionsConstants.MERGED_BALLOTS_PATH, ElectionsConstants.BALLOTS_META_PATH],
+          outputs=[ElectionsConstants.BALLOTS_WITH_ADDRESSES_PATH]),
+    Stage('download_coordination_with_googlemap', download_locations.download_ballots_coordinates,
+          inputs=[ElectionsConstants.BALLOTS_WITH_ADDRESSES_PATH],
+          outputs=[ElectionsConstants.BALLOTS_WITH_COORDINATES_PATH]),
+    Stage('fill_small_town_location', download_locations.fill_small_town_location,
+          inputs=[ElectionsConstants.BALLOTS_WITH_COORDINATES_PATH],
+          outputs=[ElectionsConstants.BALLOTS_WITH_COORDINATES_FILLED_PATH]),
+    Stage('districting', run_districting,
+          inputs=[ElectionsConstants.BALLOTS_WITH_COORDINATES_FILLED_PATH],
+          outputs=[ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH]),
+]
+
+
+def is_table(path: str) -> bool:
+    return os.path.splitext(path)[1] == '.csv'
+
+
+def resolve_input(path: str) -> str | None:
+    """
+    Find the file behind a stage input: the file read_table loads for a table, or the path itself for a directory.
+    :return: the existing path, None if it does not exist
+    """
+    resolved = existing_table_path(path) if is_table(path) else path
+    return resolved if os.path.exists(resolved) else None
+
+
+def resolve_output(path: str) -> str | None:
+    """
+    Find the file behind a stage output: the file write_table saves for a table, so a CSV file left from a run in
+    another table format does not count as the output, or the path itself for a directory.
+    :return: the existing path, None if it does not exist
+    """
+    resolved = table_path(path) if is_table(path) else path
+    return resolved if os.path.exists(resolved) else None
+
+
+def file_fingerprint(path: str, known: dict) -> str:
+    """
+    Hash the content of a file.
+    The hash is reused from the known fingerprints when the size and the modification time did not change.
+    :param path: the file path
+    :param known: the fingerprints of the previous run, by path, updated in place
+    :return: the sha256 of the file content
+    """
+    stat = os.stat(path)
+    if path in known and known[path]['size'] == stat.st_size and known[path]['mtime'] == stat.st_mtime_ns:
+        return known[path]['sha256']
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    known[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': sha256.hexdigest()}
+    return known[path]['sha256']
+
+
+def directory_fingerprint(path: str, known: dict) -> str:
+    """
+    Hash the names and contents of the files of a directory, and of its subdirectories.
+    :param path: the directory path
+    :param known: the fingerprints of the previous run, by path, updated in place
+    :return: the sha256 of the directory
+    """
+    sha256 = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        child = os.path.join(path, name)
+        sha256.update(name.encode('utf-8'))
+        if os.path.isdir(child):
+            sha256.update(b'/' + directory_fingerprint(child, known).encode('utf-8'))
+        else:
+            sha256.update(file_fingerprint(child, known).encode('utf-8'))
+    return sha256.hexdigest()
+
+
+def fingerprint(path: str, known: dict) -> str | None:
+    """
+    Hash a stage input: the content of a file, or the names and contents of the files of a directory.
+    :return: the fingerprint, None if the input does not exist
+    """
+    resolved = resolve_input(path)
+    if resolved is None:
+        return None
+    if os.path.isdir(resolved):
+        return directory_fingerprint(resolved, known)
+    return file_fingerprint(resolved, known)
+
+
+def sort_stages(stages: list[Stage]) -> list[Stage]:
+    """
+    Order the stages so every stage runs after the stages that produce its inputs.
+    """
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    by_name = {stage.name: stage for stage in stages}
+    ordered = []
+    visited = set()
+    visiting = set()
+
+    def visit(stage: Stage):
+        if stage.name in visited:
+            return
+        if stage.name in visiting:
+            raise Exception(f'The pipeline has a cycle through the stage {stage.name}')
+        visiting.add(stage.name)
+        for path in stage.inputs:
+            if path in producers:
+                visit(by_name[producers[path]])
+        visited.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+def load_state() -> dict:
+    if not os.path.exists(ElectionsConstants.PIPELINE_STATE_PATH):
+        return {'stages': {}, 'files': {}}
+    with open(ElectionsConstants.PIPELINE_STATE_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state: dict):
+    with open(ElectionsConstants.PIPELINE_STATE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=4)
+
+
+def run_pipeline(stages: list[Stage] = None, force: list[str] = (), until: str = None):
+    """
+    Run the pipeline stages, skipping every stage whose inputs did not change since its last run.
+    A stage runs when one of its outputs is missing, when the fingerprint of one of its inputs changed,
+    or when it is forced. A stage without inputs, like the extract stage, runs only when one of its outputs is missing
+    or when it is forced. The fingerprints of the last successful run of every stage are saved in the
+    ElectionsConstants.PIPELINE_STATE_PATH file.
+    :param stages: the pipeline stages, default is PIPELINE_STAGES
+    :param force: names of stages to run even if their inputs did not change
+    :param until: name of the last stage to run, None to run all the stages
+    :return:
+    """
+    state = load_state()
+    for stage in sort_stages(stages or PIPELINE_STAGES):
+        inputs = {path: fingerprint(path, state['files']) for path in stage.inputs}
+        missing_inputs = [path for path, value in inputs.items() if value is None]
+        if missing_inputs:
+            raise Exception(f'Missing inputs for the stage {stage.name}: {missing_inputs}')
+        outputs_exist = all(resolve_output(path) is not None for path in stage.outputs)
+        if stage.name not in force and outputs_exist and state['stages'].get(stage.name) == inputs:
+            print(f'{stage.name} inputs did not change, skipping...')
+        else:
+            print(f'Running {stage.name}')
+            stage.run()
+            state['stages'][stage.name] = inputs
+            save_state(state)
+        if stage.name == until:
+            break
+
+
+if __name__ == '__main__':
+    run_pipeline()
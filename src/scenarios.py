@@ -0,0 +1,172 @@
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.util import Finalize
+
+import numpy as np
+import pandas as pd
+
+from districing import DISTRICTING_COLUMNS, get_districting_arrays, load_data, pre_process_data
+from districting_engine import DistrictingEngine, UNASSIGNED
+from elecetions_constatns import ElectionsConstants
+from table_store import write_table
+
+# Arrays shared by the parent process, attached once in every worker
+_shared_memory = []
+_shared_arrays = {}
+
+
+@dataclass(frozen=True)
+class Scenario:
+    seats: int = ElectionsConstants.NUMBER_OF_SEATS
+    variance: float = ElectionsConstants.DISTRICT_VOTE_VARIANCE
+    directions: tuple = ElectionsConstants.STARTING_DIRECTIONS
+
+    def __post_init__(self):
+        unknown = [direction for direction in self.directions
+                   if direction not in ElectionsConstants.STARTING_DIRECTIONS]
+        if not self.directions or unknown:
+            raise ValueError(f'Unknown starting directions {unknown} in {self.directions}, expected an order of '
+                             f'{ElectionsConstants.STARTING_DIRECTIONS}')
+
+    @property
+    def name(self) -> str:
+        return f'seats_{self.seats}_variance_{self.variance}_{"_".join(self.directions)}'
+
+
+def scenarios_grid(seats: list[int], variances: list[float], directions: list[tuple]) -> list[Scenario]:
+    """
+    Build every combination of seats number, variance and starting directions order.
+    :param seats: numbers of seats
+    :param variances: allowed relative deviations below the single seat quota
+    :param directions: orders of the starting directions
+    :return: the list of scenarios
+    """
+    return [Scenario(*scenario) for scenario in itertools.product(seats, variances, directions)]
+
+
+def share_arrays(arrays: dict[str, np.ndarray]) -> tuple[list[SharedMemory], dict[str, tuple]]:
+    """
+    Copy the arrays to shared memory blocks, so the workers can read them without a copy per worker.
+    :param arrays: the arrays to share
+    :return: the shared memory blocks (to be released by the caller) and the specs to attach to them
+    """
+    blocks = []
+    specs = {}
+    for key, array in arrays.items():
+        block = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        specs[key] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def attach_arrays(specs: dict[str, tuple]):
+    """
+    Worker initializer: attach to the shared memory blocks and expose them as read-only arrays.
+    The blocks are closed by detach_arrays when the worker exits.
+    :param specs: the specs returned by share_arrays
+    """
+    for key, (name, shape, dtype) in specs.items():
+        block = SharedMemory(name=name)
+        _shared_memory.append(block)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        _shared_arrays[key] = array
+    # The worker processes exit without running the atexit functions, only the multiprocessing finalizers
+    Finalize(None, detach_arrays, exitpriority=0)
+
+
+def detach_arrays():
+    """
+    Release the arrays of attach_arrays and close their shared memory blocks, the parent process unlinks them.
+    """
+    # A block can not be closed while an array still exports its buffer
+    _shared_arrays.clear()
+    while _shared_memory:
+        _shared_memory.pop().close()
+
+
+def run_scenario(scenario: Scenario) -> tuple[Scenario, np.ndarray, float]:
+    """
+    Run the districting of a single scenario on the shared arrays.
+    :param scenario: the scenario to run
+    :return: the scenario, the district of every ballot and the run time in seconds
+    """
+    start = time.perf_counter()
+    engine = DistrictingEngine(**_shared_arrays, number_of_seats=scenario.seats, variance=scenario.variance,
+                               directions=scenario.directions)
+    district = engine.run()
+    return scenario, district, time.perf_counter() - start
+
+
+def summarize_scenario(scenario: Scenario, district: np.ndarray, voters: np.ndarray, seconds: float) -> dict:
+    """
+    Summarize the districts of a scenario.
+    :param scenario: the scenario
+    :param district: the district of every ballot
+    :param voters: the registered voters of every ballot
+    :param seconds: the run time of the scenario
+    :return: a summary row
+    """
+    quota = voters.sum() / scenario.seats
+    assigned = district != UNASSIGNED
+    districts_voters = np.bincount(district[assigned], weights=voters[assigned])
+    districts_voters = districts_voters[districts_voters > 0]
+    return {'scenario': scenario.name,
+            'seats': scenario.seats,
+            'variance': scenario.variance,
+            'directions': '_'.join(scenario.directions),
+            'districts': len(districts_voters),
+            'min_district_voters': districts_voters.min(),
+            'max_district_voters': districts_voters.max(),
+            'max_quota_deviation': np.abs(districts_voters / quota - 1).max(),
+            'unassigned_ballots': (~assigned).sum(),
+            'seconds': seconds}
+
+
+def run_scenarios(ballots: pd.DataFrame, scenarios: list[Scenario], max_workers: int = None) -> pd.DataFrame:
+    """
+    Run the districting of several scenarios in parallel.
+    The ballots are converted to arrays once and shared with the worker processes through shared memory.
+    Every scenario is saved in its own table in the ElectionsConstants.SCENARIOS_PATH directory,
+    and the summary of all the scenarios is saved in the ElectionsConstants.SCENARIOS_SUMMARY_PATH file.
+    :param ballots: a DataFrame containing the pre-processed ballots with their coordinates
+    :param scenarios: the scenarios to run
+    :param max_workers: number of worker processes, default is the number of cores
+    :return: the summary DataFrame
+    """
+    os.makedirs(ElectionsConstants.SCENARIOS_PATH, exist_ok=True)
+    arrays = get_districting_arrays(ballots)
+    blocks, specs = share_arrays(arrays)
+    summary = []
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=attach_arrays,
+                                 initargs=(specs,)) as executor:
+            futures = [executor.submit(run_scenario, scenario) for scenario in scenarios]
+            for future in as_completed(futures):
+                scenario, district, seconds = future.result()
+                print(f'Finished scenario {scenario.name} in {seconds:.1f} seconds')
+                ballots[ElectionsConstants.DISTRICT] = np.where(district == UNASSIGNED, None,
+                                                                district.astype(object))
+                write_table(ballots, f'{ElectionsConstants.SCENARIOS_PATH}/{scenario.name}.csv')
+                summary.append(summarize_scenario(scenario, district, arrays['voters'], seconds))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    summary = pd.DataFrame(summary).sort_values(by=['seats', 'variance', 'directions'])
+    summary.to_csv(ElectionsConstants.SCENARIOS_SUMMARY_PATH, index=False)
+    return summary
+
+
+if __name__ == '__main__':
+    ballots = load_data(columns=DISTRICTING_COLUMNS)
+    ballots = pre_process_data(ballots)
+    scenarios = scenarios_grid(seats=[60, 90, 120],
+                               variances=[0.01, 0.02, 0.05],
+                               directions=[ElectionsConstants.STARTING_DIRECTIONS, ('north', 'south', 'east', 'west')])
+    print(run_scenarios(ballots, scenarios))
@@ -0,0 +1,232 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import selenium
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from elecetions_constatns import ElectionsConstants
+
+# The options of the awesomplete list of an input, the list is the next sibling of the input. A closed list is hidden
+# and keeps its options, so the options of the other lists of the page are not looked at
+OPTIONS_XPATH = "//input[@id='{element_id}']/following-sibling::ul[contains(@id, 'awesomplete_list_') and " \
+                "@aria-label='undefined']/li[@role='option']"
+# The dropdown lists are re-rendered while they are read
+STALE_EXCEPTIONS = (selenium.common.exceptions.StaleElementReferenceException,)
+
+
+def create_driver() -> webdriver.Chrome:
+    """
+    Start a headless Chrome WebDriver.
+    :return: the WebDriver
+    """
+    chrome_options = Options()
+    chrome_options.add_argument('--headless')
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    chrome_options.add_argument('--enable-logging')
+    chrome_options.add_argument('--v=1')
+    chrome_service = Service(ElectionsConstants.CHROMEDRIVER_PATH)
+    return webdriver.Chrome(service=chrome_service, options=chrome_options)
+
+
+def safely_interact_with_element(callback, *args, max_attempts=3):
+    """
+    Safely interact with an element by handling StaleElementReferenceException.
+    :param callback: selenium function to interact with the element
+    :param args: arguments to pass to the callback function
+    :param max_attempts: maximum number of attempts to interact with the element
+    :return: callback result
+    """
+    attempts = 0
+    while attempts < max_attempts:
+        try:
+            return callback(*args)
+        except selenium.common.exceptions.StaleElementReferenceException:
+            print(f"Encountered StaleElementReferenceException, retrying... Attempt {attempts+1}/{max_attempts}")
+        attempts += 1
+    raise Exception("Failed to interact with the element after several attempts.")
+
+
+class BallotResultsScraper:
+    """
+    Scraper of the towns and ballots dropdown lists of the ballot results page, over a single WebDriver.
+    The WebDriver is created on the first use, and every wait is for a condition on the page instead of a fixed sleep.
+    For an offline run, point the url to the ElectionsConstants.BALLOT_RESULTS_FIXTURE_PATH copy of the page:
+    f'file://{os.path.abspath(ElectionsConstants.BALLOT_RESULTS_FIXTURE_PATH)}'.
+    """
+
+    def __init__(self, url: str = ElectionsConstants.BALLOT_RESULTS_URL, driver_factory=create_driver,
+                 timeout: float = ElectionsConstants.SCRAPER_TIMEOUT_SECONDS):
+        """
+        :param url: the ballot results page, can be a file:// URL of a local copy of the page
+        :param driver_factory: a function that creates the WebDriver
+        :param timeout: maximal number of seconds to wait for a condition on the page
+        """
+        self.url = url
+        self.driver_factory = driver_factory
+        self.timeout = timeout
+        self._driver = None
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            self._driver = self.driver_factory()
+            self.load_page()
+        return self._driver
+
+    def load_page(self):
+        self.driver.get(self.url)
+        WebDriverWait(self.driver, self.timeout).until(
+            EC.element_to_be_clickable((By.ID, ElectionsConstants.TOWN_HTML_ELEMENT)))
+
+    def quit(self):
+        if self._driver is not None:
+            self._driver.quit()
+            self._driver = None
+
+    def find_options(self, element_id: str) -> list:
+        """
+        :param element_id: the ID of the dropdown list element
+        :return: the options of the list of the element
+        """
+        return self.driver.find_elements(By.XPATH, OPTIONS_XPATH.format(element_id=element_id))
+
+    def extract_options(self, element_id: str) -> list[str]:
+        """
+        Extract the options from a dropdown list element.
+        The element is clicked until its list is populated, the list can be loaded after the element is clickable.
+        :param element_id: the ID of the dropdown list element
+        :return: a list of options extracted from the dropdown list, empty if the list was not populated in time
+        """
+        WebDriverWait(self.driver, self.timeout).until(EC.element_to_be_clickable((By.ID, element_id)))
+
+        def populated_options(driver):
+            options = self.find_options(element_id)
+            if not options:
+                driver.find_element(By.ID, element_id).click()
+                options = self.find_options(element_id)
+            return options
+
+        try:
+            options = WebDriverWait(self.driver, self.timeout, poll_frequency=0.1,
+                                    ignored_exceptions=STALE_EXCEPTIONS).until(populated_options)
+        except selenium.common.exceptions.TimeoutException:
+            return []
+        return [option.text for option in options]
+
+    def select_town(self, town: str):
+        town_input = WebDriverWait(self.driver, self.timeout).until(
+            EC.element_to_be_clickable((By.ID, ElectionsConstants.TOWN_HTML_ELEMENT)))
+        town_input.clear()
+        town_input.send_keys(town)
+
+        # Wait for the autocomplete suggestion that matches the town exactly
+        def exact_suggestion(driver):
+            for suggestion in self.find_options(ElectionsConstants.TOWN_HTML_ELEMENT):
+                if suggestion.is_displayed() and suggestion.text == town:
+                    return suggestion
+            return False
+
+        try:
+            suggestion = WebDriverWait(self.driver, self.timeout, poll_frequency=0.1,
+                                       ignored_exceptions=STALE_EXCEPTIONS).until(exact_suggestion)
+        except selenium.common.exceptions.TimeoutException:
+            raise Exception(f"No exact match found for {town}")
+        suggestion.click()
+
+    def extract_towns(self) -> list[str]:
+        return [town for town in self.extract_options(ElectionsConstants.TOWN_HTML_ELEMENT)
+                if town != '- בחר ישוב -']
+
+    def extract_town_ballots(self, town: str, max_attempts: int = 3) -> list[str]:
+        """
+        Extract the ballots of a town from the 'PollingStation' dropdown list.
+        :param town: the town to select
+        :param max_attempts: maximum number of attempts to get a non-empty ballots list
+        :return: the list of ballots
+        """
+        for attempt in range(max_attempts):
+            safely_interact_with_element(self.select_town, town)
+            ballots = self.extract_options(ElectionsConstants.POLLING_STATION_HTML_ELEMENT)
+            if ballots:
+                return ballots
+            print(f'No ballots found for {town}, retrying... Attempt {attempt + 1}/{max_attempts}')
+            self.load_page()
+        raise Exception(f'No ballots found for {town}')
+
+
+def save_town_ballots(town: str, ballots: list[str], output_path: str):
+    with open(f'{output_path}/{town}.json', 'w', encoding='utf-8') as f:
+        json.dump({ElectionsConstants.TOWN: town, ElectionsConstants.BALLOTS: ballots}, f, ensure_ascii=False,
+                  indent=4)
+
+
+def scrape_towns(scraper: BallotResultsScraper, towns: list[str], output_path: str) -> int:
+    """
+    Extract the ballots of a list of towns with a single scraper, saving every town in its own JSON file.
+    :param scraper: the scraper of the worker
+    :param towns: the towns to extract
+    :param output_path: the directory of the towns JSON files
+    :return: the number of towns extracted
+    """
+    extracted = 0
+    try:
+        for town in towns:
+            print(f'Extracting ballots for {town}')
+            try:
+                ballots = scraper.extract_town_ballots(town)
+            except Exception as e:
+                print(f'Failed to extract ballots for {town}: {e}'
+                      f'\nSkipping to the next town...')
+                scraper.load_page()
+                continue
+            print(f'Extracted {len(ballots)} ballots')
+            save_town_ballots(town, ballots, output_path)
+            extracted += 1
+            # Reset the page state before the next town
+            scraper.load_page()
+    finally:
+        scraper.quit()
+    return extracted
+
+
+def scrape_towns_ballots(workers: int = ElectionsConstants.SCRAPER_WORKERS,
+                         url: str = ElectionsConstants.BALLOT_RESULTS_URL,
+                         output_path: str = ElectionsConstants.BALLOTS_LOCATION_NAMES_PATH,
+                         driver_factory=create_driver) -> int:
+    """
+    Extract the towns and the ballots of every town with a pool of scrapers, each with its own WebDriver.
+    Towns already saved in output_path are skipped, and every town is saved as soon as it is extracted,
+    so an interrupted run continues from where it stopped.
+    :param workers: number of concurrent scrapers
+    :param url: the ballot results page
+    :param output_path: the directory of the towns JSON files
+    :param driver_factory: a function that creates a WebDriver
+    :return: the number of towns extracted
+    """
+    os.makedirs(output_path, exist_ok=True)
+    extracted_towns = os.listdir(output_path)
+    scrapers = [BallotResultsScraper(url, driver_factory) for _ in range(workers)]
+    try:
+        # The first scraper lists the towns and then extracts its share of them
+        towns = scrapers[0].extract_towns()
+        scrapers[0].load_page()
+        towns = [town for town in towns if f'{town}.json' not in extracted_towns]
+        print(f'{len(towns)} towns to extract with {workers} scrapers')
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            extracted = sum(executor.map(lambda worker: scrape_towns(scrapers[worker], towns[worker::workers],
+                                                                     output_path),
+                                         range(workers)))
+    finally:
+        for scraper in scrapers:
+            scraper.quit()
+    print(f'Extracted {extracted} towns in {time.perf_counter() - start:.1f} seconds')
+    return extracted
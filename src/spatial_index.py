@@ -0,0 +1,178 @@
+import numpy as np
+
+NOT_FOUND = -1
+
+
+class DeletableKDTree:
+    """
+    KD-tree over 2D points that supports deleting points, for nearest-neighbour queries while ballots are assigned.
+    Every node keeps its bounding box and the number of its points that were not deleted yet, so a query skips
+    subtrees that are empty or further than the best point found so far, and never scans the deleted areas.
+    Ties between points at the same distance are broken by the smallest rank.
+    """
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray, ids: np.ndarray, rank: np.ndarray, leaf_size: int = 128):
+        """
+        :param lat: latitude per point
+        :param lng: longitude per point
+        :param ids: the id returned for every point
+        :param rank: tie-break order per point, the smallest rank wins between points at the same distance
+        :param leaf_size: maximal number of points in a leaf, a leaf is scanned with one vectorized computation
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        self.leaf_size = leaf_size
+        self.order = np.arange(len(lat))
+        self.parent = []
+        self.left = []
+        self.right = []
+        self.start = []
+        self.end = []
+        self.count = []
+        self.box = []
+        if len(lat):
+            self._build(lat, lng, 0, len(lat), -1)
+        # The points are stored in the tree order, so the points of a leaf are a contiguous slice
+        self.lat = lat[self.order]
+        self.lng = lng[self.order]
+        self.ids = np.asarray(ids, dtype=np.int64)[self.order]
+        self.rank = np.asarray(rank, dtype=np.int64)[self.order]
+        self.alive = np.ones(len(lat), dtype=bool)
+        self.slot = np.empty(len(lat), dtype=np.int64)
+        self.slot[self.order] = np.arange(len(lat))
+        self.slot_leaf = np.zeros(len(lat), dtype=np.int64)
+        for node, left in enumerate(self.left):
+            if left == -1:
+                self.slot_leaf[self.start[node]:self.end[node]] = node
+
+    def _build(self, lat: np.ndarray, lng: np.ndarray, start: int, end: int, parent: int) -> int:
+        node = len(self.parent)
+        points = self.order[start:end]
+        node_lat, node_lng = lat[points], lng[points]
+        self.parent.append(parent)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.start.append(start)
+        self.end.append(end)
+        self.count.append(end - start)
+        self.box.append((float(node_lat.min()), float(node_lat.max()), float(node_lng.min()), float(node_lng.max())))
+        if end - start <= self.leaf_size:
+            return node
+        coordinate = node_lat if np.ptp(node_lat) >= np.ptp(node_lng) else node_lng
+        middle = (end - start) // 2
+        self.order[start:end] = points[np.argpartition(coordinate, middle)]
+        self.left[node] = self._build(lat, lng, start, start + middle, node)
+        self.right[node] = self._build(lat, lng, start + middle, end, node)
+        return node
+
+    def __len__(self) -> int:
+        return self.count[0] if self.count else 0
+
+    def remove(self, point: int):
+        """
+        Delete a point from the tree.
+        :param point: the position of the point in the arrays the tree was built from
+        """
+        slot = self.slot[point]
+        if not self.alive[slot]:
+            return
+        self.alive[slot] = False
+        count, parent = self.count, self.parent
+        node = self.slot_leaf[slot]
+        while node != -1:
+            count[node] -= 1
+            node = parent[node]
+
+    def nearest(self, lat: float, lng: float) -> int:
+        """
+        Find the closest point that was not deleted.
+        :return: the id of the closest point, NOT_FOUND if all the points were deleted
+        """
+        if len(self) == 0:
+            return NOT_FOUND
+        lat, lng = float(lat), float(lng)
+        count, left, right, box = self.count, self.left, self.right, self.box
+        best_distance, best_rank, best_slot = np.inf, 0, NOT_FOUND
+        stack = [(0.0, 0)]
+        while stack:
+            node_distance, node = stack.pop()
+            if node_distance > best_distance:
+                continue
+            if left[node] == -1:
+                start, end = self.start[node], self.end[node]
+                distance = (self.lat[start:end] - lat) ** 2 + (self.lng[start:end] - lng) ** 2
+                distance[~self.alive[start:end]] = np.inf
+                closest = distance.min()
+                if closest > best_distance:
+                    continue
+                tied = start + np.flatnonzero(distance == closest)
+                slot = tied[np.argmin(self.rank[tied])] if len(tied) > 1 else tied[0]
+                if closest < best_distance or self.rank[slot] < best_rank:
+                    best_distance, best_rank, best_slot = closest, self.rank[slot], slot
+                continue
+            children = []
+            for child in (left[node], right[node]):
+                if count[child] == 0:
+                    continue
+                min_lat, max_lat, min_lng, max_lng = box[child]
+                d_lat = min_lat - lat if lat < min_lat else (lat - max_lat if lat > max_lat else 0.0)
+                d_lng = min_lng - lng if lng < min_lng else (lng - max_lng if lng > max_lng else 0.0)
+                child_distance = d_lat * d_lat + d_lng * d_lng
+                if child_distance <= best_distance:
+                    children.append((child_distance, child))
+            # The closer child is pushed last so it is visited first
+            children.sort(reverse=True)
+            stack.extend(children)
+        return self.ids[best_slot]
+
+
+class BallotsSpatialIndex:
+    """
+    Nearest unassigned ballot lookup, either in the whole country or in a single town.
+    Holds a KD-tree over all the ballots and one KD-tree per town, assigned ballots are deleted from both.
+    """
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray, town_codes: np.ndarray,
+                 country_rank: np.ndarray = None, town_rank: np.ndarray = None):
+        """
+        :param lat: latitude per ballot
+        :param lng: longitude per ballot
+        :param town_codes: integer town code per ballot
+        :param country_rank: tie-break order of the ballots in the country search, default is the table order
+        :param town_rank: tie-break order of the ballots in the town search, default is the table order
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        positions = np.arange(len(lat))
+        country_rank = positions if country_rank is None else country_rank
+        town_rank = positions if town_rank is None else np.asarray(town_rank)
+        self.country = DeletableKDTree(lat, lng, positions, country_rank)
+        self.town_codes = np.asarray(town_codes)
+        town_members = np.argsort(self.town_codes, kind='stable')
+        towns, starts = np.unique(self.town_codes[town_members], return_index=True)
+        self.towns = {}
+        self.town_position = np.zeros(len(lat), dtype=np.int64)
+        for town, members in zip(towns, np.split(town_members, starts[1:])):
+            self.towns[town] = DeletableKDTree(lat[members], lng[members], members, town_rank[members])
+            self.town_position[members] = np.arange(len(members))
+
+    def remove(self, ballot: int):
+        """
+        Delete an assigned ballot from the index.
+        """
+        self.country.remove(ballot)
+        self.towns[self.town_codes[ballot]].remove(self.town_position[ballot])
+
+    def nearest(self, lat: float, lng: float, town: int = None) -> int:
+        """
+        Find the unassigned ballot closest to a point.
+        :param lat: latitude of the point
+        :param lng: longitude of the point
+        :param town: restrict the search to this town code, None to search the whole country
+        :return: the ballot position, NOT_FOUND if there are no unassigned ballots
+        """
+        if town is None:
+            return self.country.nearest(lat, lng)
+        if town not in self.towns:
+            return NOT_FOUND
+        return self.towns[town].nearest(lat, lng)
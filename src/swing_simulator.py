@@ -0,0 +1,196 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from election_results import district_votes, district_winners, get_district_codes, get_votes_matrix
+from districting_engine import UNASSIGNED
+from elecetions_constatns import ElectionsConstants
+from table_store import read_table
+
+# Memory budget of the trials simulated at once, by every process
+MEMORY_BUDGET_BYTES = 256 << 20
+
+# Cells of the worker processes, set once by the pool initializer
+_cells = {}
+
+
+@dataclass(frozen=True)
+class SwingModel:
+    """
+    Log-normal perturbations of the votes of every trial, as standard deviations of the log of the multipliers.
+    A model with regional_swing and turnout of 0 is a uniform national swing.
+    """
+    party_swing: float = 0.05
+    regional_swing: float = 0.03
+    turnout: float = 0.05
+
+
+def get_cells(votes: np.ndarray, districts: np.ndarray, regions: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Aggregate the stations votes into cells of a district and a region.
+    The perturbations of a trial are the same for all the stations of a cell, so the trials are simulated on the
+    cells instead of the stations.
+    :param votes: the stations x parties votes matrix
+    :param districts: the district of every station, UNASSIGNED stations are not counted
+    :param regions: the region code of every station
+    :return: the cells votes, the districts x cells matrix, the region of every cell and the number of regions
+    """
+    assigned = districts != UNASSIGNED
+    cells, cell_keys = pd.factorize(pd.MultiIndex.from_arrays([districts[assigned], regions[assigned]]))
+    cell_districts = cell_keys.get_level_values(0).to_numpy(dtype=np.int64)
+    # Dense districts x cells matrix that sums the cells of every district
+    districts_matrix = np.zeros((districts.max() + 1, len(cell_keys)), dtype=np.float32)
+    districts_matrix[cell_districts, np.arange(len(cell_keys))] = 1
+    return {'votes': district_votes(votes[assigned], cells, len(cell_keys)).astype(np.float32),
+            'districts_matrix': districts_matrix,
+            'regions': cell_keys.get_level_values(1).to_numpy(dtype=np.int64),
+            'number_of_regions': np.int64(regions.max() + 1)}
+
+
+def trials_per_chunk(cells: dict[str, np.ndarray], memory_budget: int = MEMORY_BUDGET_BYTES) -> int:
+    """
+    :return: the number of trials whose perturbed cells votes fit in the memory budget
+    """
+    cells_count, parties = cells['votes'].shape
+    # The perturbed votes, the regional multipliers and the districts votes of a trial, in float32
+    trial_bytes = 4 * (2 * cells_count * parties + cells['number_of_regions'] * (parties + 1)
+                       + len(cells['districts_matrix']) * parties)
+    return max(int(memory_budget // trial_bytes), 1)
+
+
+def simulate_chunk(cells: dict[str, np.ndarray], model: SwingModel, first_trial: int, trials: int,
+                   seed: int) -> np.ndarray:
+    """
+    Simulate a chunk of trials as a single batched computation.
+    Every trial draws its perturbations from its own generator, seeded by the seed and the trial number, so a trial
+    gets the same perturbations in any chunk.
+    :param cells: the cells returned by get_cells
+    :param model: the perturbations model
+    :param first_trial: the number of the first trial of the chunk
+    :param trials: number of trials
+    :param seed: the random seed of the simulation
+    :return: the trials x parties seats matrix
+    """
+    generators = [np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(trial,)))
+                  for trial in range(first_trial, first_trial + trials)]
+    cells_count, parties = cells['votes'].shape
+    regions = cells['number_of_regions']
+    log_multipliers = np.zeros((trials, cells_count, parties), dtype=np.float32)
+
+    def draw(shape: tuple) -> np.ndarray:
+        # The normal draws of every trial, from the generator of the trial
+        draws = np.empty((trials, *shape), dtype=np.float32)
+        for rng, trial_draws in zip(generators, draws):
+            rng.standard_normal(dtype=np.float32, out=trial_draws)
+        return draws
+
+    if model.party_swing:
+        log_multipliers += model.party_swing * draw((1, parties))
+    if model.regional_swing:
+        log_multipliers += model.regional_swing * draw((regions, parties))[:, cells['regions'], :]
+    if model.turnout:
+        log_multipliers += model.turnout * draw((regions,))[:, cells['regions'], None]
+    perturbed = np.exp(log_multipliers, out=log_multipliers)
+    perturbed *= cells['votes'][None]
+
+    # Sum the cells of every district, for all the trials at once
+    districts_votes = np.matmul(cells['districts_matrix'][None], perturbed)
+    winners = np.argmax(districts_votes, axis=2)
+    has_votes = districts_votes.any(axis=2)
+    trial = np.broadcast_to(np.arange(trials)[:, None], winners.shape)
+    return np.bincount((trial * parties + winners)[has_votes], minlength=trials * parties).reshape(trials, parties)
+
+
+def init_worker(cells: dict[str, np.ndarray]):
+    _cells.update(cells)
+
+
+def simulate_worker_chunk(model: SwingModel, first_trial: int, trials: int, seed: int) -> np.ndarray:
+    return simulate_chunk(_cells, model, first_trial, trials, seed)
+
+
+def simulate_swings(votes: np.ndarray, districts: np.ndarray, regions: np.ndarray, model: SwingModel = SwingModel(),
+                    trials: int = 10_000, seed: int = 0, max_workers: int = 1,
+                    memory_budget: int = MEMORY_BUDGET_BYTES) -> np.ndarray:
+    """
+    Simulate the seats of every party under random swings of the votes.
+    Every trial multiplies the votes by a national swing per party, a regional swing per region and party and a
+    turnout change per region (see SwingModel), and the seats are the district winners.
+    The trials are simulated in chunks that fit the memory budget, every trial with its own generator derived from the
+    seed, so the results only depend on the seed, and not on the memory budget or the number of workers.
+    :param votes: the stations x parties votes matrix
+    :param districts: the district of every station
+    :param regions: the region code of every station (for example the town code)
+    :param model: the perturbations model
+    :param trials: number of trials
+    :param seed: the random seed
+    :param max_workers: number of worker processes, 1 to simulate in this process
+    :param memory_budget: memory budget of the trials simulated at once, by every process
+    :return: the trials x parties seats matrix
+    """
+    cells = get_cells(votes, districts, regions)
+    chunk = trials_per_chunk(cells, memory_budget)
+    starts = list(range(0, trials, chunk))
+    chunks = [min(chunk, trials - start) for start in starts]
+    if max_workers == 1:
+        seats = [simulate_chunk(cells, model, start, chunk_trials, seed) for start, chunk_trials in zip(starts, chunks)]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=init_worker,
+                                 initargs=(cells,)) as executor:
+            seats = list(executor.map(simulate_worker_chunk, [model] * len(chunks), starts, chunks,
+                                      [seed] * len(chunks)))
+    return np.concatenate(seats)
+
+
+def summarize_seats(seats: np.ndarray, parties: list[str], baseline: np.ndarray) -> pd.DataFrame:
+    """
+    Summarize the seats distribution of every party.
+    :param seats: the trials x parties seats matrix
+    :param parties: the parties of the seats columns
+    :param baseline: the seats of every party without perturbations
+    :return: a DataFrame with a row per party that won a seat in the baseline or in a trial
+    """
+    summary = pd.DataFrame({'party': parties,
+                            'baseline_seats': baseline,
+                            'mean_seats': seats.mean(axis=0),
+                            'std_seats': seats.std(axis=0),
+                            'min_seats': seats.min(axis=0),
+                            'p5_seats': np.percentile(seats, 5, axis=0),
+                            'median_seats': np.median(seats, axis=0),
+                            'p95_seats': np.percentile(seats, 95, axis=0),
+                            'max_seats': seats.max(axis=0),
+                            'probability_changed': (seats != baseline).mean(axis=0)})
+    summary = summary[(summary['baseline_seats'] > 0) | (summary['max_seats'] > 0)]
+    return summary.sort_values(by='mean_seats', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def simulate_districting_swings(ballots: pd.DataFrame, model: SwingModel = SwingModel(), trials: int = 10_000,
+                                seed: int = 0, max_workers: int = 1) -> pd.DataFrame:
+    """
+    Simulate the seats distribution of a districting under random swings, with the towns as the swing regions.
+    :param ballots: a DataFrame containing the ballots with their party votes and district column,
+    as saved by get_cities_districts
+    :param model: the perturbations model
+    :param trials: number of trials
+    :param seed: the random seed
+    :param max_workers: number of worker processes, 1 to simulate in this process
+    :return: the seats summary of every party, see summarize_seats
+    """
+    votes, parties = get_votes_matrix(ballots)
+    districts = get_district_codes(ballots)
+    regions = pd.factorize(ballots[ElectionsConstants.TOWN_NAME])[0]
+    assigned = districts != UNASSIGNED
+    baseline_votes = district_votes(votes, districts)
+    winners, _ = district_winners(baseline_votes)
+    baseline = np.bincount(winners[baseline_votes.any(axis=1)], minlength=len(parties))
+    print(f'Simulating {trials} trials on {assigned.sum()} ballots')
+    seats = simulate_swings(votes, districts, regions, model, trials, seed, max_workers)
+    return summarize_seats(seats, parties, baseline)
+
+
+if __name__ == '__main__':
+    ballots = read_table(ElectionsConstants.BALLOTS_WITH_DISTRICTS_PATH)
+    print(simulate_districting_swings(ballots, max_workers=None))
@@ -0,0 +1,156 @@
+import os
+
+import pandas as pd
+
+from elecetions_constatns import ElectionsConstants
+
+# The text columns with few distinct values, repeated over many rows, stored as categoricals
+CATEGORY_COLUMNS = [ElectionsConstants.TOWN_NAME, ElectionsConstants.LOCATION, ElectionsConstants.BALLOT_ADDRESS,
+                    ElectionsConstants.LOCALITY, ElectionsConstants.TOWN_LOCALITY]
+# The object columns of numbers with missing values, like the district column of the unassigned ballots
+NUMERIC_COLUMNS = [ElectionsConstants.DISTRICT]
+
+
+def table_path(path: str, table_format: str = ElectionsConstants.TABLE_FORMAT) -> str:
+    """
+    Map a table path from ElectionsConstants to the file of the given format.
+    :param path: the table path, as defined in ElectionsConstants
+    :param table_format: 'parquet' or 'csv'
+    :return: the path with the extension of the format
+    """
+    return f'{os.path.splitext(path)[0]}.{table_format}'
+
+
+def existing_table_path(path: str, table_format: str = ElectionsConstants.TABLE_FORMAT) -> str:
+    """
+    :param path: the table path, as defined in ElectionsConstants
+    :param table_format: 'parquet' or 'csv'
+    :return: the file read_table loads the table from: the file of the format, or the CSV file if it does not exist
+    """
+    if table_format == 'parquet' and os.path.exists(table_path(path, table_format)):
+        return table_path(path, table_format)
+    return table_path(path, 'csv')
+
+
+def get_party_columns(table: pd.DataFrame) -> list[str]:
+    """
+    Find the party vote columns: the integer columns that follow the valid votes column
+    (ElectionsConstants.VALID_VOTES), as in ElectionsConstants.RAW_BALLOTS_PATH. The columns the pipeline adds after
+    them are not integers.
+    :param table: a ballots table
+    :return: the party columns, in the table order
+    """
+    columns = list(table.columns)
+    if ElectionsConstants.VALID_VOTES not in columns:
+        return []
+    parties = []
+    for column in columns[columns.index(ElectionsConstants.VALID_VOTES) + 1:]:
+        if not pd.api.types.is_integer_dtype(table[column]):
+            break
+        parties.append(column)
+    return parties
+
+
+def get_vote_columns(table: pd.DataFrame) -> list[str]:
+    """
+    Find the vote count columns: the registered voters column (ElectionsConstants.REGISTRED_VOTERS) and the integer
+    columns that follow it, the voters, invalid and valid votes and the party votes, as in
+    ElectionsConstants.RAW_BALLOTS_PATH.
+    :param table: a ballots table
+    :return: the vote count columns, in the table order
+    """
+    columns = list(table.columns)
+    if ElectionsConstants.REGISTRED_VOTERS not in columns:
+        return []
+    votes = []
+    for column in columns[columns.index(ElectionsConstants.REGISTRED_VOTERS):]:
+        if not pd.api.types.is_integer_dtype(table[column]):
+            break
+        votes.append(column)
+    return votes
+
+
+def compact_table(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert a table to compact column types: integer columns to the narrowest integer type, the CATEGORY_COLUMNS to
+    categoricals and the NUMERIC_COLUMNS to numbers. The other columns, and the coordinates, keep their types.
+    :param table: the table to convert
+    :return: the converted table
+    """
+    table = table.copy()
+    for column in table.columns:
+        if pd.api.types.is_integer_dtype(table[column]) or column in NUMERIC_COLUMNS:
+            table[column] = pd.to_numeric(table[column], downcast='integer')
+        elif column in CATEGORY_COLUMNS:
+            table[column] = table[column].astype('category')
+    return table
+
+
+def read_csv_compact(path: str, columns: list[str] = None) -> pd.DataFrame:
+    """
+    Load a CSV table with compact column types, see compact_table.
+    :param path: the CSV file
+    :param columns: the columns to load, None to load all the columns
+    :return: the table
+    """
+    return compact_table(pd.read_csv(path, usecols=columns))
+
+
+def memory_report(path: str) -> dict:
+    """
+    Compare the memory of a CSV table loaded with the default column types and with compact column types.
+    :param path: the CSV file
+    :return: the memory in MB of both tables and the saved share
+    """
+    table = pd.read_csv(path)
+    default_mb = table.memory_usage(deep=True).sum() / (1 << 20)
+    compact_mb = compact_table(table).memory_usage(deep=True).sum() / (1 << 20)
+    report = {'path': path, 'rows': len(table), 'default_mb': round(default_mb, 2), 'compact_mb': round(compact_mb, 2),
+              'saved': round(1 - compact_mb / default_mb, 3)}
+    print(f"{path}: {report['default_mb']} MB with the default types, {report['compact_mb']} MB with compact types "
+          f"({report['saved']:.0%} saved)")
+    return report
+
+
+def write_table(table: pd.DataFrame, path: str, table_format: str = ElectionsConstants.TABLE_FORMAT):
+    """
+    Save a pipeline table, in the file of the table format, see table_path, and print the file it was saved in.
+    Parquet tables are saved with compact column types, see compact_table.
+    :param table: the table to save
+    :param path: the table path, as defined in ElectionsConstants
+    :param table_format: 'parquet' or 'csv'
+    """
+    output_path = table_path(path, table_format)
+    if table_format == 'parquet':
+        compact_table(table).to_parquet(output_path, index=False)
+    else:
+        table.to_csv(output_path, index=False)
+    print(f'Saved {len(table)} rows to {output_path}')
+
+
+def read_table(path: str, columns: list[str] = None, table_format: str = ElectionsConstants.TABLE_FORMAT) \
+        -> pd.DataFrame:
+    """
+    Load a pipeline table, falling back to the CSV file if the table was not saved in the given format.
+    CSV tables are loaded with compact column types, like the parquet tables, see compact_table.
+    :param path: the table path, as defined in ElectionsConstants
+    :param columns: the columns to load, None to load all the columns
+    :param table_format: 'parquet' or 'csv'
+    :return: the table
+    """
+    path = existing_table_path(path, table_format)
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+    return read_csv_compact(path, columns)
+
+
+def export_csv(path: str):
+    """
+    Export a parquet pipeline table to CSV, next to the parquet file.
+    :param path: the table path, as defined in ElectionsConstants
+    """
+    read_table(path).to_csv(table_path(path, 'csv'), index=False)
+
+
+if __name__ == '__main__':
+    memory_report(ElectionsConstants.RAW_BALLOTS_PATH)
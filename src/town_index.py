@@ -0,0 +1,110 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from elecetions_constatns import ElectionsConstants
+
+UNMATCHED = -1
+# The integer columns combined into a join key are smaller than this limit, see join_keys
+JOIN_VALUE_LIMIT = 1 << 32
+# Characters the town names are written with in some tables and without in others
+TOWN_NAME_PUNCTUATION = r'[()\'"\-]'
+
+
+def normalize_town_name(name: str) -> str:
+    """
+    Normalize a single town name, like normalize_distinct_names.
+    """
+    return re.sub(r'\s+', ' ', re.sub(TOWN_NAME_PUNCTUATION, '', name)).strip()
+
+
+def normalize_distinct_names(names: pd.Series) -> tuple[np.ndarray, pd.Index]:
+    """
+    Normalize the distinct names of a column: remove the punctuation, collapse the spaces and strip.
+    :param names: a names column
+    :return: the code of the distinct name of every row (-1 for missing names) and the normalized distinct names
+    """
+    codes, uniques = pd.factorize(names)
+    normalized = pd.Series(np.asarray(uniques, dtype=object), dtype=object)\
+        .str.replace(TOWN_NAME_PUNCTUATION, '', regex=True).str.replace(r'\s+', ' ', regex=True).str.strip()
+    return codes, pd.Index(normalized)
+
+
+def normalize_town_names(names: pd.Series) -> pd.Series:
+    """
+    Normalize the town names of a column, in a single pass over its distinct names, see normalize_distinct_names.
+    :param names: a town names column
+    :return: the normalized names, categorical like the compact tables
+    """
+    codes, normalized = normalize_distinct_names(names)
+    values = np.append(normalized.to_numpy(dtype=object), None)[codes]
+    return pd.Series(values, index=names.index, name=names.name).astype('category')
+
+
+def get_town_index(ballots: pd.DataFrame) -> pd.Series:
+    """
+    Build the index from the normalized town name to the town code (ElectionsConstants.TOWN_CODE).
+    :param ballots: a table with the town name and town code columns, like the ElectionsConstants.RAW_BALLOTS_PATH
+    table
+    :return: the town code of every normalized town name
+    """
+    towns = ballots[[ElectionsConstants.TOWN_NAME, ElectionsConstants.TOWN_CODE]].drop_duplicates().dropna()
+    codes, normalized = normalize_distinct_names(towns[ElectionsConstants.TOWN_NAME])
+    town_index = pd.Series(towns[ElectionsConstants.TOWN_CODE].to_numpy(dtype=np.int64), index=normalized[codes])
+    return town_index[~town_index.index.duplicated()]
+
+
+def get_table_towns(table: pd.DataFrame) -> tuple[np.ndarray, pd.Series]:
+    """
+    Find the town codes a table is joined on, and the index to match the towns of other tables to them. A table
+    without the town code column (ElectionsConstants.TOWN_CODE) gets a code per distinct normalized town name.
+    :param table: a table with the town name column, and optionally the town code column
+    :return: the town code of every row (NaN or UNMATCHED when it is missing), and the town code of every normalized
+    town name, see get_town_index
+    """
+    if ElectionsConstants.TOWN_CODE in table.columns:
+        return table[ElectionsConstants.TOWN_CODE].to_numpy(), get_town_index(table)
+    codes, normalized = normalize_distinct_names(table[ElectionsConstants.TOWN_NAME])
+    name_codes, names = pd.factorize(normalized)
+    return np.append(name_codes, UNMATCHED)[codes].astype(np.int64), pd.Series(np.arange(len(names)), index=names)
+
+
+def get_town_codes(names: pd.Series, town_index: pd.Series, table: str) -> np.ndarray:
+    """
+    Find the town code of every row by its normalized town name, and report the names that are not in the index.
+    :param names: a town names column
+    :param town_index: the town code of every normalized town name, see get_town_index
+    :param table: the name of the table, for the report
+    :return: the int64 town code of every row, UNMATCHED for the rows whose town is not in the index
+    """
+    codes, normalized = normalize_distinct_names(names)
+    positions = town_index.index.get_indexer(normalized)
+    town_codes = np.where(positions >= 0, town_index.to_numpy()[positions], UNMATCHED)
+    town_codes = np.append(town_codes, UNMATCHED)[codes]
+    unmatched = town_codes == UNMATCHED
+    if unmatched.any():
+        counts = pd.Series(names[unmatched].astype(object)).value_counts(dropna=False)
+        print(f'{table}: {unmatched.sum()} rows of {len(counts)} towns are not in the towns index: '
+              f'{", ".join(f"{name} ({count})" for name, count in counts.items())}')
+    return town_codes
+
+
+def known_keys(town_codes: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    :param town_codes: town code per row
+    :param values: integer value per row
+    :return: whether every row has both a town code and a value, the rows join_keys can combine
+    """
+    town_codes, values = np.asarray(town_codes), np.asarray(values)
+    return pd.notnull(town_codes) & (town_codes != UNMATCHED) & pd.notnull(values)
+
+
+def join_keys(town_codes: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Combine a town code and an integer column of the town (a ballot id or a ballots cluster) into a single int64 key.
+    :param town_codes: town code per row, without missing codes, see known_keys
+    :param values: non negative integer value per row, smaller than 2^32, without missing values
+    :return: the join key of every row
+    """
+    return (np.asarray(town_codes, dtype=np.int64) << 32) | np.asarray(values, dtype=np.int64)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of src import each other by their flat names, like when running them from the src directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
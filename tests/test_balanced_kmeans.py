@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from balanced_kmeans import balanced_kmeans, price_assignment, repair_assignment
+from benchmark_districting import synthetic_ballots
+from districing import get_cities_districts_kmeans, pre_process_data
+from elecetions_constatns import ElectionsConstants
+
+
+def test_repair_does_not_overfill_an_underloaded_center():
+    # Both points are on center 1, too heavy for center 0: moving one fills center 0 above the upper bound
+    candidates = np.array([[1, 0], [1, 0]])
+    distances = np.array([[0.0, 1.0], [0.0, 1.0]])
+    weights = np.array([8.0, 8.0])
+    labels = repair_assignment(candidates, distances, weights, np.zeros(2, dtype=np.int64), 2, lower=4, upper=6)
+    np.testing.assert_array_equal(labels, [1, 1])
+
+
+def test_repair_fills_an_underloaded_center():
+    candidates = np.array([[1, 0], [1, 0], [1, 0]])
+    distances = np.array([[0.0, 1.0], [0.0, 2.0], [0.0, 3.0]])
+    weights = np.ones(3)
+    labels = repair_assignment(candidates, distances, weights, np.zeros(3, dtype=np.int64), 2, lower=1, upper=2)
+    np.testing.assert_array_equal(labels, [0, 1, 1])
+
+
+def test_price_assignment_without_iterations_takes_the_closest_candidate():
+    candidates = np.array([[1, 0], [0, 1]])
+    distances = np.array([[0.0, 1.0], [0.0, 1.0]])
+    choice = price_assignment(candidates, distances, np.ones(2), 2, lower=1, upper=1, prices=np.zeros(2),
+                              max_iterations=0)
+    np.testing.assert_array_equal(choice, [0, 0])
+
+
+def test_balanced_kmeans_needs_an_iteration():
+    with pytest.raises(Exception, match='at least 1 iteration'):
+        balanced_kmeans(np.zeros(4), np.zeros(4), np.ones(4), number_of_seats=2, max_iterations=0)
+
+
+def test_balanced_kmeans_keeps_the_bounds():
+    ballots = pre_process_data(synthetic_ballots(3_000, seed=1))
+    variance = ElectionsConstants.DISTRICT_VOTE_VARIANCE
+    ballots = get_cities_districts_kmeans(ballots, number_of_seats=60, output_path=None)
+    voters = ballots.groupby(ElectionsConstants.DISTRICT)[ElectionsConstants.REGISTRED_VOTERS].sum()
+    quota = ballots[ElectionsConstants.REGISTRED_VOTERS].sum() / 60
+    assert len(voters) == 60
+    assert ((voters >= quota * (1 - variance)) & (voters <= quota * (1 + variance))).all()
+
+
+def test_balanced_kmeans_reports_the_bounds():
+    # A single ballot with most of the voters cannot be within the bounds of a district
+    voters = np.append(np.full(10, 10), 1000)
+    lat, lng = np.arange(11) * 0.01, np.zeros(11)
+    with pytest.raises(Exception, match='not within'):
+        balanced_kmeans(lat, lng, voters, number_of_seats=2)
+    labels = balanced_kmeans(lat, lng, voters, number_of_seats=2, allow_out_of_bounds=True)
+    assert len(labels) == 11
@@ -0,0 +1,133 @@
+import http.client
+import json
+import threading
+from urllib.parse import urlencode
+
+import pandas as pd
+import pytest
+
+from benchmark_lookup import synthetic_districting
+from district_lookup import DistrictLookup, DistrictLookupService, make_server
+from districting_engine import UNASSIGNED
+from elecetions_constatns import ElectionsConstants
+from table_store import write_table
+
+
+@pytest.fixture(scope='module')
+def ballots():
+    return synthetic_districting(2_000, seats=20)
+
+
+@pytest.fixture(scope='module')
+def lookup(ballots):
+    return DistrictLookup(ballots)
+
+
+@pytest.fixture
+def server(ballots, tmp_path):
+    path = str(tmp_path / 'ballots_with_districts.csv')
+    write_table(ballots, path)
+    server = make_server(DistrictLookupService(path), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method: str, url: str, body: dict = None) -> tuple[int, dict]:
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port)
+    connection.request(method, url, body=json.dumps(body) if body is not None else None)
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+def test_ballots_round_trip(ballots, lookup):
+    towns = ballots[ElectionsConstants.TOWN_NAME].astype(object).tolist()
+    ballot_ids = ballots[ElectionsConstants.BALLOT_ID].tolist()
+    districts = ballots[ElectionsConstants.DISTRICT].tolist()
+    assert [lookup.district_of_ballot(town, ballot_id) for town, ballot_id in zip(towns, ballot_ids)] == districts
+    assert lookup.districts_of_ballots(towns, ballot_ids).tolist() == districts
+
+
+def test_points_round_trip(ballots, lookup):
+    lat = ballots[ElectionsConstants.LAT].to_numpy()
+    lng = ballots[ElectionsConstants.LNG].to_numpy()
+    districts = ballots[ElectionsConstants.DISTRICT].to_numpy()
+    assert (lookup.districts_of_points(lat, lng) == districts).all()
+    assert lookup.district_of_point(lat[0], lng[0]) == districts[0]
+
+
+def test_points_nearest_on_the_ground():
+    # The station east of the point is closer on the ground, a degree of longitude is shorter than a degree of
+    # latitude, and the station north of it is closer in degrees
+    ballots = pd.DataFrame({ElectionsConstants.TOWN_NAME: ['east', 'north'],
+                            ElectionsConstants.BALLOT_ID: [1, 2],
+                            ElectionsConstants.LAT: [32.0, 32.0095],
+                            ElectionsConstants.LNG: [35.0105, 35.0],
+                            ElectionsConstants.DISTRICT: [0, 1]})
+    lookup = DistrictLookup(ballots)
+    assert lookup.district_of_point(32.0, 35.0) == 0
+    assert lookup.districts_of_points([32.0, 32.0095], [35.0, 35.0]).tolist() == [0, 1]
+
+
+def test_bad_ballot_ids(ballots, lookup):
+    town = ballots[ElectionsConstants.TOWN_NAME].astype(object).iloc[0]
+    ballot_id = int(ballots[ElectionsConstants.BALLOT_ID].iloc[0])
+    # A ballot id of another town, shifted by 2^32, must not be read as the key of that town
+    other_town = ballots[ElectionsConstants.TOWN_NAME].astype(object).iloc[-1]
+    other_ballot_id = int(ballots[ElectionsConstants.BALLOT_ID].iloc[-1])
+    shifted = ((lookup.towns[other_town] - lookup.towns[town]) << 32) + other_ballot_id
+    bad_ids = [shifted, 2 ** 32 + ballot_id, 10 ** 20, -1]
+    for bad_id in bad_ids:
+        assert lookup.district_of_ballot(town, bad_id) is None
+    assert lookup.district_of_ballot('unknown town', ballot_id) is None
+    districts = lookup.districts_of_ballots([town] * (len(bad_ids) + 1), bad_ids + [ballot_id])
+    assert districts.tolist() == [UNASSIGNED] * len(bad_ids) + [ballots[ElectionsConstants.DISTRICT].iloc[0]]
+
+
+def test_reload_swaps_lookup(ballots, tmp_path):
+    path = str(tmp_path / 'ballots_with_districts.csv')
+    write_table(ballots, path)
+    service = DistrictLookupService(path)
+    town = ballots[ElectionsConstants.TOWN_NAME].astype(object).iloc[0]
+    ballot_id = int(ballots[ElectionsConstants.BALLOT_ID].iloc[0])
+    district = int(ballots[ElectionsConstants.DISTRICT].iloc[0])
+    old_lookup = service.lookup
+    assert not service.reload()
+    write_table(ballots.assign(**{ElectionsConstants.DISTRICT: ballots[ElectionsConstants.DISTRICT] + 1}), path)
+    assert service.reload()
+    assert service.lookup is not old_lookup
+    assert old_lookup.district_of_ballot(town, ballot_id) == district
+    assert service.lookup.district_of_ballot(town, ballot_id) == district + 1
+
+
+def test_http_round_trip(ballots, server):
+    town = ballots[ElectionsConstants.TOWN_NAME].astype(object).iloc[0]
+    ballot_id = int(ballots[ElectionsConstants.BALLOT_ID].iloc[0])
+    district = int(ballots[ElectionsConstants.DISTRICT].iloc[0])
+    lat, lng = float(ballots[ElectionsConstants.LAT].iloc[0]), float(ballots[ElectionsConstants.LNG].iloc[0])
+    assert request(server, 'GET', f"/ballot?{urlencode({'town': town, 'ballot_id': ballot_id})}") == \
+        (200, {'district': district})
+    status, body = request(server, 'GET', f"/point?{urlencode({'lat': lat, 'lng': lng})}")
+    assert status == 200 and body['district'] == district and body['ballot_id'] == ballot_id
+    batch = {'ballots': {'town': [town, town], 'ballot_id': [ballot_id, 10 ** 20]},
+             'points': {'lat': [lat], 'lng': [lng]}}
+    status, body = request(server, 'POST', '/batch', batch)
+    assert status == 200 and body == {'ballots': [district, None], 'points': [district]}
+    status, body = request(server, 'GET', '/status')
+    assert status == 200 and body['ballots'] == len(ballots)
+
+
+@pytest.mark.parametrize('url', ['/ballot?town=x&ballot_id=100000000000000000000', '/ballot?town=x&ballot_id=-1',
+                                 '/ballot?town=x&ballot_id=abc', '/ballot?town=x', '/point?lat=1'])
+def test_http_bad_query(server, url):
+    status, body = request(server, 'GET', url)
+    assert status == 400 and 'error' in body
+
+
+def test_http_bad_batch(server):
+    status, body = request(server, 'POST', '/batch', {'ballots': {'town': ['x'], 'ballot_id': ['abc']}})
+    assert status == 400 and 'error' in body
+    assert request(server, 'GET', '/unknown')[0] == 404
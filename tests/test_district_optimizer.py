@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from benchmark_districting import synthetic_ballots
+from districing import get_cities_districts_fast, pre_process_data
+from district_optimizer import DistrictOptimizer
+from districting_engine import UNASSIGNED
+from districting_metrics import districts_metrics, get_districting_metrics, summarize_plans
+from elecetions_constatns import ElectionsConstants
+
+SEATS = 60
+
+
+def test_inertia_is_measured_on_the_ground():
+    # Two stations 1 km apart on a parallel at latitude 60, where a degree of longitude is half a degree of latitude
+    lng_step = 1 / (111 * np.cos(np.radians(60)))
+    optimizer = DistrictOptimizer(np.array([60.0, 60.0]), np.array([35.0, 35.0 + lng_step]), np.ones(2),
+                                  np.zeros(2, dtype=np.int64), number_of_seats=1)
+    # The inertia of two unit weights around their midpoint is 2 * (d / 2) ** 2, with d = 1 / 111 degrees of latitude
+    np.testing.assert_allclose(optimizer.seat_inertia[0], 2 * (0.5 / 111) ** 2, rtol=1e-9)
+
+
+def strips(widths: list[int], height: int = 20) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    A square grid of stations with a voter each, split into vertical strips of the given widths.
+    :return: the latitude, longitude and district of every station
+    """
+    rows, columns = np.divmod(np.arange(height * sum(widths)), sum(widths))
+    lat = 32 + rows * 0.01
+    lng = 35 + columns * 0.01 / np.cos(np.radians(32))
+    return lat, lng, np.repeat(np.arange(len(widths)), widths)[columns]
+
+
+def test_run_balances_strips():
+    lat, lng, district = strips([4, 6, 5, 5])
+    optimizer = DistrictOptimizer(lat, lng, np.ones(len(lat)), district, number_of_seats=4, variance=0.05)
+    violation, inertia = optimizer.total_violation(), sum(optimizer.seat_inertia)
+    district = optimizer.run(time_budget=30)
+    assert violation > 0 and optimizer.total_violation() == 0
+    assert sum(optimizer.seat_inertia) <= inertia
+    metrics = districts_metrics(lat, lng, np.ones(len(lat)), np.zeros(len(lat)), district, number_of_seats=4)
+    assert (metrics['components'] == 1).all()
+
+
+def test_run_keeps_towns_and_contiguity():
+    ballots = pre_process_data(synthetic_ballots(3_000, seed=2))
+    ballots = get_cities_districts_fast(ballots, number_of_seats=SEATS, output_path=None)
+    before = summarize_plans(get_districting_metrics(ballots, SEATS)).iloc[0]
+    district = pd.to_numeric(ballots[ElectionsConstants.DISTRICT].astype(object), errors='coerce')
+    optimizer = DistrictOptimizer(ballots[ElectionsConstants.LAT].values, ballots[ElectionsConstants.LNG].values,
+                                  ballots[ElectionsConstants.REGISTRED_VOTERS].values,
+                                  district.fillna(UNASSIGNED).to_numpy(dtype=np.int64),
+                                  town_codes=pd.factorize(ballots[ElectionsConstants.TOWN_NAME])[0],
+                                  number_of_seats=SEATS)
+    violation, inertia = optimizer.total_violation(), sum(optimizer.seat_inertia)
+    ballots[ElectionsConstants.DISTRICT] = optimizer.run(time_budget=30)
+    after = summarize_plans(get_districting_metrics(ballots, SEATS)).iloc[0]
+    assert optimizer.total_violation() < violation
+    assert sum(optimizer.seat_inertia) <= inertia
+    assert after['out_of_bounds_districts'] <= before['out_of_bounds_districts']
+    assert after['not_contiguous_districts'] <= before['not_contiguous_districts']
+    assert after['split_towns'] <= before['split_towns']
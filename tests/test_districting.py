@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark_districting import synthetic_ballots
+from districing import get_cities_districts, get_cities_districts_fast, pre_process_data
+from elecetions_constatns import ElectionsConstants
+
+
+@pytest.fixture
+def output_path(tmp_path, monkeypatch):
+    # get_cities_districts always saves its output
+    path = str(tmp_path / 'ballots_with_districts.csv')
+    monkeypatch.setattr(ElectionsConstants, 'BALLOTS_WITH_DISTRICTS_PATH', path)
+    return path
+
+
+def districts(ballots: pd.DataFrame) -> np.ndarray:
+    return ballots[ElectionsConstants.DISTRICT].astype(float).to_numpy()
+
+
+@pytest.mark.parametrize('stations, seats, seed', [(400, 7, 0), (600, 20, 1), (600, 45, 2)])
+def test_fast_districting_matches_reference(output_path, monkeypatch, stations, seats, seed):
+    monkeypatch.setattr(ElectionsConstants, 'NUMBER_OF_SEATS', seats)
+    ballots = pre_process_data(synthetic_ballots(stations, towns=stations // 40, seed=seed))
+    # A shuffled index, like the index of the ballots left after dropping the ones without coordinates
+    ballots.index = np.random.default_rng(seed).permutation(len(ballots)) * 3
+    expected = get_cities_districts(ballots.copy())
+    result = get_cities_districts_fast(ballots.copy(), output_path=None)
+    assert expected[ElectionsConstants.DISTRICT].notnull().any()
+    np.testing.assert_array_equal(districts(result), districts(expected))
+
+
+def test_reference_with_duplicate_index_labels(output_path, monkeypatch):
+    monkeypatch.setattr(ElectionsConstants, 'NUMBER_OF_SEATS', 20)
+    ballots = pre_process_data(synthetic_ballots(400, towns=10, seed=3))
+    expected = get_cities_districts(ballots.copy())
+    # Tables concatenated without resetting their index have the same labels on different ballots
+    ballots.index = np.arange(len(ballots)) % 50
+    result = get_cities_districts(ballots.copy())
+    np.testing.assert_array_equal(districts(result), districts(expected))
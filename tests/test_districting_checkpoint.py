@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from benchmark_districting import synthetic_ballots
+from districing import get_cities_districts_fast, get_districting_arrays, pre_process_data
+from districting_engine import DistrictingEngine
+from districting_telemetry import DistrictingTelemetry
+from elecetions_constatns import ElectionsConstants
+
+SEATS = 60
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_at(seat: int) -> DistrictingTelemetry:
+    """
+    :return: a telemetry that interrupts the run when the given seat is done
+    """
+    def callback(event: dict):
+        if event['event'] == 'seat_end' and event['seat'] == seat:
+            raise Interrupted()
+    return DistrictingTelemetry(callback=callback)
+
+
+@pytest.fixture(scope='module')
+def ballots():
+    return pre_process_data(synthetic_ballots(3_000, seed=1))
+
+
+@pytest.mark.parametrize('seat', [1, SEATS // 2, SEATS - 2])
+def test_resumed_engine_matches_uninterrupted(ballots, tmp_path, seat):
+    arrays = get_districting_arrays(ballots)
+    expected = DistrictingEngine(**arrays, number_of_seats=SEATS).run()
+    path = str(tmp_path / 'checkpoint.npz')
+    telemetry = interrupt_at(seat)
+    telemetry.start_run()
+    with pytest.raises(Interrupted):
+        DistrictingEngine(**arrays, number_of_seats=SEATS).run(telemetry, checkpoint_path=path, checkpoint_seconds=0)
+    assert os.path.exists(path)
+    resumed = DistrictingEngine(**arrays, number_of_seats=SEATS).run(checkpoint_path=path, resume=True)
+    assert (resumed == expected).all()
+    assert not os.path.exists(path)
+
+
+def test_resumed_districting_matches_uninterrupted(ballots, tmp_path):
+    expected = get_cities_districts_fast(ballots.copy(), number_of_seats=SEATS, output_path=None)
+    path = str(tmp_path / 'checkpoint.npz')
+    with pytest.raises(Interrupted):
+        get_cities_districts_fast(ballots.copy(), number_of_seats=SEATS, output_path=None,
+                                  telemetry=interrupt_at(SEATS // 2), checkpoint_path=path, checkpoint_seconds=0)
+    assert os.path.exists(path)
+    resumed = get_cities_districts_fast(ballots.copy(), number_of_seats=SEATS, output_path=None, checkpoint_path=path)
+    assert resumed[ElectionsConstants.DISTRICT].equals(expected[ElectionsConstants.DISTRICT])
+    assert not os.path.exists(path)
+
+
+def test_stale_checkpoint_is_ignored(ballots, tmp_path):
+    arrays = get_districting_arrays(ballots)
+    path = str(tmp_path / 'checkpoint.npz')
+    DistrictingEngine(**arrays, number_of_seats=SEATS).save_checkpoint(path, 3, 1)
+    expected = DistrictingEngine(**arrays, number_of_seats=SEATS + 1).run()
+    resumed = DistrictingEngine(**arrays, number_of_seats=SEATS + 1).run(checkpoint_path=path, resume=True)
+    assert (resumed == expected).all()
+
+
+def test_checkpoints_are_opt_in(ballots):
+    get_cities_districts_fast(ballots.copy(), number_of_seats=SEATS, output_path=None)
+    assert not os.path.exists(ElectionsConstants.DISTRICTING_CHECKPOINT_PATH)
@@ -0,0 +1,29 @@
+import numpy as np
+
+from districting_metrics import districts_metrics, local_frame
+
+
+def circle(center_lat: float, center_lng: float, radius_km: float, points: int = 64) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Points on a circle on the ground: a degree of latitude is about 111 km everywhere, a degree of longitude is
+    111 km times the cosine of the latitude.
+    """
+    angles = np.arange(points) * 2 * np.pi / points
+    lat = center_lat + radius_km / 111 * np.sin(angles)
+    lng = center_lng + radius_km / (111 * np.cos(np.radians(center_lat))) * np.cos(angles)
+    return lat, lng
+
+
+def test_local_frame_is_isotropic():
+    lat, lng = circle(32, 35, 5)
+    y, x = local_frame(lat, lng)
+    assert abs(y.mean()) < 1e-12 and abs(x.mean()) < 1e-12
+    np.testing.assert_allclose(np.hypot(y, x), 5 / 111, rtol=1e-3)
+
+
+def test_round_district_is_compact():
+    lat, lng = circle(32, 35, 5)
+    metrics = districts_metrics(lat, lng, np.ones(len(lat)), np.zeros(len(lat)), np.zeros(len(lat)),
+                                number_of_seats=1)
+    assert metrics['compactness'].iloc[0] > 0.995
+    np.testing.assert_allclose(metrics['spread'].iloc[0], 5 / 111, rtol=1e-3)
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from benchmark_districting import synthetic_ballots
+from districing import get_cities_districts_fast, pre_process_data
+from districting_telemetry import DistrictingTelemetry
+from elecetions_constatns import ElectionsConstants
+
+SEATS = 20
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture(scope='module')
+def ballots():
+    return pre_process_data(synthetic_ballots(1_000, seed=2))
+
+
+def read_log(path: str) -> list:
+    with open(path, encoding='utf-8') as log:
+        return [json.loads(line) for line in log]
+
+
+def test_telemetry_events_log_and_summary(ballots, tmp_path):
+    path = str(tmp_path / 'telemetry.jsonl')
+    events = []
+    telemetry = DistrictingTelemetry(callback=events.append, log_path=path)
+    districts = get_cities_districts_fast(ballots.copy(), number_of_seats=SEATS, output_path=None,
+                                          telemetry=telemetry)[ElectionsConstants.DISTRICT]
+    seats = districts.dropna().nunique()
+    assert telemetry.log is None
+    assert read_log(path) == events
+    names = [event['event'] for event in events]
+    assert names[0] == 'run_start' and names[-1] == 'run_end'
+    assert names.count('city_start') == names.count('city_end')
+    assert names.count('seat_end') == seats
+    assert events[0]['ballots'] == len(ballots) and events[0]['number_of_seats'] == SEATS
+    assert events[-1]['seats'] == seats and events[-1]['cities'] == names.count('city_end')
+    assert all(later['elapsed'] >= earlier['elapsed'] for earlier, later in zip(events, events[1:]))
+
+    summary = telemetry.summary(top=3)
+    seat_ends = [event for event in events if event['event'] == 'seat_end']
+    assert summary['seats'] == seats and summary['cities'] == names.count('city_end')
+    assert summary['iterations'] == sum(event['iterations'] + event['overflow_iterations'] for event in seat_ends)
+    assert summary['max_seat_iterations'] == max(event['iterations'] + event['overflow_iterations']
+                                                 for event in seat_ends)
+    assert summary['ballots'] == len(ballots)
+    assert {phase['phase'] for phase in summary['phases']} >= {'prepare'}
+    assert len(summary['slowest_cities']) == min(3, summary['cities'])
+
+
+def test_resumed_run_appends_to_the_log(ballots, tmp_path):
+    path = str(tmp_path / 'telemetry.jsonl')
+    checkpoint_path = str(tmp_path / 'checkpoint.npz')
+
+    def interrupt(event: dict):
+        if event['event'] == 'seat_end' and event['seat'] == SEATS // 2:
+            raise Interrupted()
+    interrupted = DistrictingTelemetry(callback=interrupt, log_path=path)
+    with pytest.raises(Interrupted):
+        get_cities_districts_fast(ballots.copy(), number_of_seats=SEATS, output_path=None, telemetry=interrupted,
+                                  checkpoint_path=checkpoint_path, checkpoint_seconds=0)
+    assert interrupted.log is None
+    first_run = read_log(path)
+    assert first_run[0]['event'] == 'run_start' and first_run[-1]['event'] == 'run_end'
+
+    resumed = DistrictingTelemetry(log_path=path)
+    get_cities_districts_fast(ballots.copy(), number_of_seats=SEATS, output_path=None, telemetry=resumed,
+                              checkpoint_path=checkpoint_path)
+    assert resumed.log is None
+    events = read_log(path)
+    assert events[:len(first_run)] == first_run
+    assert [event['event'] for event in events].count('run_start') == 2
+    assert events[-1]['event'] == 'run_end'
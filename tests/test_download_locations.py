@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import geocoding
+from download_locations import download_coordination_with_googlemap, fill_small_town_location, \
+    merge_ballots_with_addresses, pre_process_ballots_with_addresses
+from elecetions_constatns import ElectionsConstants
+from geocoding import StubGeocoder
+from table_store import get_vote_columns, read_table, write_table
+
+
+def geocode_result(lat: float, lng: float, locality: str, types: list[str]) -> list:
+    return [{'geometry': {'location': {'lat': lat, 'lng': lng}},
+             'address_components': [{'long_name': locality, 'types': ['locality', 'political']}],
+             'types': types}]
+
+
+GEOCODE_RESULTS = {'חיפה': geocode_result(32.79, 34.99, 'Haifa', ['locality', 'political']),
+                   'חיפה, הרצל 1': geocode_result(32.81, 35.0, 'Haifa', ['street_address']),
+                   'עומר': geocode_result(31.26, 34.84, 'Omer', ['locality', 'political']),
+                   'תל אביב': geocode_result(32.08, 34.78, 'Tel Aviv-Yafo', ['locality', 'political']),
+                   'חוות השקמים': geocode_result(31.6, 34.7, 'Sderot', ['establishment'])}
+
+
+@pytest.fixture
+def ballots():
+    return pd.DataFrame({ElectionsConstants.TOWN_NAME: ['תל אביב יפו', 'תל אביב יפו', 'באר שבע', 'באר שבע', 'אופקים'],
+                         ElectionsConstants.TOWN_CODE: [5000, 5000, 9000, 9000, 31],
+                         ElectionsConstants.BALLOTS_CLUSTER: [1, 2, 1, np.nan, 1],
+                         ElectionsConstants.REGISTRED_VOTERS: [500, 600, 700, 800, 900],
+                         ElectionsConstants.VALID_VOTES: [300, 400, 500, 600, 700],
+                         'אמת': [10, 20, 30, 40, 50]})
+
+
+@pytest.fixture
+def ballots_addresses():
+    return pre_process_ballots_with_addresses(pd.DataFrame({
+        'שם ישוב בחירות': ['תל אביב - יפו', 'תל אביב - יפו', 'באר שבע', 'עיר שאיננה', 'אופקים'],
+        'סמל רכוז': [1, 2, 1, 1, np.nan],
+        ElectionsConstants.BALLOT_ADDRESS: ['הרצל (1)', 'דיזנגוף 2', 'רגר 3', 'אין 4', 'אין 5']}))
+
+
+def test_merge_ballots_with_addresses(ballots, ballots_addresses, capsys):
+    merged = merge_ballots_with_addresses(ballots, ballots_addresses)
+    assert merged[ElectionsConstants.BALLOT_ADDRESS].tolist()[:3] == ['הרצל 1', 'דיזנגוף 2', 'רגר 3']
+    assert merged[ElectionsConstants.BALLOT_ADDRESS].isnull().tolist() == [False, False, False, True, True]
+    assert '2 ballots of 2 towns have no address' in capsys.readouterr().out
+
+
+def test_merge_ballots_with_addresses_without_town_codes(ballots, ballots_addresses):
+    expected = merge_ballots_with_addresses(ballots, ballots_addresses)
+    merged = merge_ballots_with_addresses(ballots.drop(columns=ElectionsConstants.TOWN_CODE), ballots_addresses)
+    assert merged[ElectionsConstants.BALLOT_ADDRESS].equals(expected[ElectionsConstants.BALLOT_ADDRESS])
+
+
+def test_get_vote_columns(ballots):
+    assert get_vote_columns(ballots) == [ElectionsConstants.REGISTRED_VOTERS, ElectionsConstants.VALID_VOTES, 'אמת']
+
+
+def values(column: pd.Series) -> list:
+    return [None if pd.isnull(value) else value for value in column]
+
+
+@pytest.fixture
+def geocoder(tmp_path, monkeypatch) -> StubGeocoder:
+    """
+    A counting stub geocoder over GEOCODE_RESULTS, with the geocode cache and the pipeline tables in tmp_path.
+    """
+    geocoder = StubGeocoder(results=GEOCODE_RESULTS)
+    monkeypatch.setattr(geocoding, 'get_geocoder', lambda: geocoder)
+    for path in ['GEOCODE_CACHE_PATH', 'GEOCODE_STUB_CACHE_PATH']:
+        monkeypatch.setattr(ElectionsConstants, path, str(tmp_path / f'{path.lower()}.sqlite'))
+    for path in ['BALLOTS_WITH_COORDINATES_PATH', 'BALLOTS_WITH_COORDINATES_FILLED_PATH']:
+        monkeypatch.setattr(ElectionsConstants, path, str(tmp_path / f'{path.lower()}.csv'))
+    return geocoder
+
+
+def test_download_coordinates_geocodes_every_key_once(geocoder):
+    ballots = pd.DataFrame({ElectionsConstants.TOWN_NAME: ['חיפה', 'חיפה', 'חיפה', 'עומר', 'עומר'],
+                            ElectionsConstants.BALLOT_ADDRESS: ['הרצל 1', 'הרצל 1', None, 'עומר', 'עומר'],
+                            ElectionsConstants.LOCATION: ['בית ספר', 'בית ספר', 'מתנ"ס', 'מועצה', 'מועצה'],
+                            ElectionsConstants.BALLOT_ID: [1, 2, 3, 4, 5]})
+    download_coordination_with_googlemap(ballots)
+    # The towns חיפה and עומר, and the addresses חיפה, הרצל 1 and חיפה, מתנ"ס: the address of עומר is its town
+    assert geocoder.calls == 4
+    result = read_table(ElectionsConstants.BALLOTS_WITH_COORDINATES_PATH)
+    assert result[ElectionsConstants.BALLOT_ID].tolist() == [1, 2, 3, 4, 5]
+    np.testing.assert_allclose(result[ElectionsConstants.LAT], [32.81, 32.81, np.nan, 31.26, 31.26])
+    np.testing.assert_allclose(result[ElectionsConstants.LNG], [35.0, 35.0, np.nan, 34.84, 34.84])
+    assert values(result[ElectionsConstants.LOCALITY]) == ['Haifa', 'Haifa', None, 'Omer', 'Omer']
+    assert values(result[ElectionsConstants.TOWN_LOCALITY]) == ['Haifa', 'Haifa', 'Haifa', 'Omer', 'Omer']
+
+
+def test_fill_small_town_location_geocodes_every_town_once(geocoder):
+    write_table(pd.DataFrame({
+        ElectionsConstants.TOWN_NAME: ['חיפה', 'חיפה', 'חיפה', 'תל אביב יפו', 'תל אביב יפו', 'חוות השקמים'],
+        ElectionsConstants.LAT: [32.7, 32.6, np.nan, np.nan, np.nan, np.nan],
+        ElectionsConstants.LNG: [35.1, 35.2, np.nan, np.nan, np.nan, np.nan],
+        ElectionsConstants.LOCALITY: ['Haifa', 'Tirat Carmel', None, None, None, None],
+        ElectionsConstants.TOWN_LOCALITY: ['Haifa', 'Haifa', 'Haifa', None, None, None]}),
+        ElectionsConstants.BALLOTS_WITH_COORDINATES_PATH)
+    fill_small_town_location()
+    # The towns חיפה, תל אביב (the town of תל אביב יפו) and חוות השקמים
+    assert geocoder.calls == 3
+    result = read_table(ElectionsConstants.BALLOTS_WITH_COORDINATES_FILLED_PATH)
+    # The ballot outside its town locality gets the town location, the result of חוות השקמים is not a locality
+    np.testing.assert_allclose(result[ElectionsConstants.LAT], [32.7, 32.79, 32.79, 32.08, 32.08, np.nan])
+    np.testing.assert_allclose(result[ElectionsConstants.LNG], [35.1, 34.99, 34.99, 34.78, 34.78, np.nan])
+    assert values(result[ElectionsConstants.LOCALITY]) == ['Haifa', 'Haifa', 'Haifa', 'Tel Aviv-Yafo', 'Tel Aviv-Yafo',
+                                                          None]
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from districting_engine import UNASSIGNED
+from elecetions_constatns import ElectionsConstants
+from election_results import district_votes, district_winners, get_district_results, national_seats, \
+    score_districtings
+
+DISTRICTS = 10
+
+
+@pytest.fixture(scope='module')
+def votes() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    # Mostly small parties, like the real party columns
+    return rng.poisson([200, 150, 80, 10, 2, 0.1], size=(500, 6)).astype(np.int32)
+
+
+def reference_votes(votes: np.ndarray, districts: np.ndarray) -> np.ndarray:
+    assigned = districts != UNASSIGNED
+    return pd.DataFrame(votes[assigned]).groupby(districts[assigned]).sum() \
+        .reindex(range(DISTRICTS), fill_value=0).to_numpy()
+
+
+def test_district_votes_match_groupby(votes):
+    rng = np.random.default_rng(1)
+    districts = rng.integers(DISTRICTS, size=len(votes))
+    districts[rng.random(len(votes)) < 0.1] = UNASSIGNED
+    np.testing.assert_array_equal(district_votes(votes, districts, DISTRICTS), reference_votes(votes, districts))
+
+
+def test_district_winners_and_ties():
+    votes = np.array([[5, 5, 1], [1, 3, 2], [0, 0, 0], [2, 7, 7]])
+    winners, margins = district_winners(votes)
+    # Ties are won by the first party in the columns order
+    assert winners.tolist() == [0, 1, 0, 1]
+    assert margins.tolist() == [0, 1, 0, 0]
+
+
+def test_district_results_skip_unassigned_and_empty_districts():
+    ballots = pd.DataFrame({ElectionsConstants.TOWN_NAME: ['א', 'א', 'ב', 'ב', 'ג'],
+                            ElectionsConstants.REGISTRED_VOTERS: [100, 100, 100, 100, 100],
+                            ElectionsConstants.VALID_VOTES: [90, 90, 90, 90, 90],
+                            'אמת': [50, 10, 40, 30, 90],
+                            'מחל': [40, 80, 50, 60, 0],
+                            # District 1 has no ballots, the last ballot has no district
+                            ElectionsConstants.DISTRICT: [0, 0, 2, 2, None]})
+    results, seats = get_district_results(ballots)
+    assert results[ElectionsConstants.DISTRICT].tolist() == [0, 2]
+    assert results[['אמת', 'מחל']].to_numpy().tolist() == [[60, 120], [70, 110]]
+    assert results[ElectionsConstants.WINNER].tolist() == ['מחל', 'מחל']
+    assert results[ElectionsConstants.MARGIN].tolist() == [60, 40]
+    assert seats.to_dict() == {'מחל': 2}
+
+
+def test_national_seats_count_valid_districts():
+    winners = np.array([0, 1, 1, 2, 0, 0])
+    valid = np.array([True, True, False, True, True, False])
+    seats = national_seats(winners, 3, plans=2, valid=valid)
+    assert seats.tolist() == [[1, 1, 0], [1, 0, 1]]
+
+
+def test_score_districtings_matches_single_plans(votes):
+    rng = np.random.default_rng(2)
+    plans = rng.integers(DISTRICTS, size=(7, len(votes)))
+    plans[rng.random(plans.shape) < 0.05] = UNASSIGNED
+    # A plan without district 9
+    plans[3][plans[3] == 9] = 8
+    expected = []
+    for districts in plans:
+        plan_votes = reference_votes(votes, districts)
+        winners, _ = district_winners(plan_votes)
+        expected.append(national_seats(winners, votes.shape[1], valid=plan_votes.any(axis=1))[0])
+    np.testing.assert_array_equal(score_districtings(votes, plans, DISTRICTS, chunk_size=3), expected)
+    np.testing.assert_array_equal(score_districtings(votes, plans, chunk_size=3), expected)
@@ -0,0 +1,75 @@
+import time
+
+from elecetions_constatns import ElectionsConstants
+from geocoding import GeocodeCache, StubGeocoder, address_key, geocode_many
+
+RESULTS = {'Tel Aviv': [{'geometry': {'location': {'lat': 32.08, 'lng': 34.78}}}],
+           'Haifa': [{'geometry': {'location': {'lat': 32.79, 'lng': 34.99}}}]}
+
+
+class FailingGeocoder(StubGeocoder):
+    """
+    A stub geocoder whose calls for the failing addresses raise.
+    """
+
+    def __init__(self, failing: set[str]):
+        super().__init__(results=RESULTS)
+        self.failing = failing
+
+    def geocode(self, address: str) -> list:
+        result = super().geocode(address)
+        if address in self.failing:
+            raise Exception('quota exceeded')
+        return result
+
+
+def test_rerun_makes_no_calls(tmp_path):
+    geocoder = StubGeocoder(results=RESULTS)
+    cache = GeocodeCache(str(tmp_path / 'cache.sqlite'))
+    first = geocode_many(['Tel Aviv', 'Haifa', 'Tel Aviv'], geocoder, cache)
+    assert geocoder.calls == 2
+    second = geocode_many(['Tel Aviv', 'Haifa'], geocoder, GeocodeCache(str(tmp_path / 'cache.sqlite')))
+    assert geocoder.calls == 2
+    assert second == {address: first[address] for address in ['Tel Aviv', 'Haifa']}
+
+
+def test_expired_rows_are_fetched_again(tmp_path):
+    geocoder = StubGeocoder(results=RESULTS)
+    cache = GeocodeCache(str(tmp_path / 'cache.sqlite'), expiry_days=1)
+    geocode_many(['Tel Aviv', 'Haifa'], geocoder, cache)
+    cache.connection.execute('UPDATE geocode SET created = ? WHERE key = ?',
+                             (time.time() - 2 * 24 * 60 * 60, address_key('Haifa')))
+    results = geocode_many(['Tel Aviv', 'Haifa'], geocoder, cache)
+    assert geocoder.calls == 3
+    assert results['Haifa'] == RESULTS['Haifa']
+
+
+def test_normalized_addresses_are_geocoded_once(tmp_path):
+    geocoder = StubGeocoder(results=RESULTS)
+    results = geocode_many(['Tel Aviv', ' tel  AVIV ', 'TEL AVIV'], geocoder,
+                           GeocodeCache(str(tmp_path / 'cache.sqlite')))
+    assert geocoder.calls == 1
+    assert list(results.values()) == [RESULTS['Tel Aviv']] * 3
+
+
+def test_failures_are_retried_and_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(ElectionsConstants, 'GEOCODE_RETRY_BACKOFF_SECONDS', 0)
+    geocoder = FailingGeocoder({'Haifa'})
+    cache = GeocodeCache(str(tmp_path / 'cache.sqlite'))
+    results = geocode_many(['Tel Aviv', 'Haifa'], geocoder, cache, retries=3)
+    assert geocoder.calls == 1 + 3
+    assert results == {'Tel Aviv': RESULTS['Tel Aviv'], 'Haifa': None}
+    assert cache.get('Haifa') is None
+    geocode_many(['Tel Aviv', 'Haifa'], geocoder, cache, retries=3)
+    assert geocoder.calls == 1 + 3 + 3
+
+
+def test_stub_runs_have_their_own_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ElectionsConstants, 'GEOCODE_CACHE_PATH', str(tmp_path / 'cache.sqlite'))
+    monkeypatch.setattr(ElectionsConstants, 'GEOCODE_STUB_CACHE_PATH', str(tmp_path / 'stub_cache.sqlite'))
+    geocoder = StubGeocoder(results=RESULTS)
+    geocode_many(['Tel Aviv'], geocoder)
+    geocode_many(['Tel Aviv'], geocoder)
+    assert geocoder.calls == 1
+    assert (tmp_path / 'stub_cache.sqlite').exists()
+    assert not (tmp_path / 'cache.sqlite').exists()
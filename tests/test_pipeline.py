@@ -0,0 +1,78 @@
+import os
+
+import pandas as pd
+import pytest
+
+from elecetions_constatns import ElectionsConstants
+from pipeline import Stage, fingerprint, resolve_output, run_pipeline
+from table_store import read_table, table_path, write_table
+
+
+@pytest.fixture
+def state_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'pipeline_state.json')
+    monkeypatch.setattr(ElectionsConstants, 'PIPELINE_STATE_PATH', path)
+    return path
+
+
+def test_directory_fingerprint_covers_subdirectories(tmp_path):
+    directory = tmp_path / 'towns'
+    (directory / 'nested').mkdir(parents=True)
+    (directory / 'a.json').write_text('a')
+    (directory / 'nested' / 'b.json').write_text('b')
+    known = {}
+    before = fingerprint(str(directory), known)
+    assert before == fingerprint(str(directory), known)
+    (directory / 'nested' / 'b.json').write_text('changed')
+    assert fingerprint(str(directory), known) != before
+
+
+@pytest.mark.skipif(ElectionsConstants.TABLE_FORMAT == 'csv', reason='The CSV file is the table file')
+def test_stale_csv_is_not_an_output(tmp_path):
+    path = str(tmp_path / 'table.csv')
+    pd.DataFrame({'a': [1]}).to_csv(path, index=False)
+    assert resolve_output(path) is None
+    write_table(pd.DataFrame({'a': [1]}), path)
+    assert resolve_output(path) == table_path(path)
+
+
+def test_run_pipeline_skips_unchanged_stages(tmp_path, state_path):
+    source, middle, result = (str(tmp_path / name) for name in ('source.csv', 'middle.csv', 'result.csv'))
+    runs = []
+
+    def extract():
+        runs.append('extract')
+        write_table(pd.DataFrame({'a': [1, 2]}), source)
+
+    def double():
+        runs.append('double')
+        write_table(read_table(source) * 2, middle)
+
+    def total():
+        runs.append('total')
+        write_table(read_table(middle).sum().to_frame().T, result)
+
+    stages = [Stage('total', total, inputs=[middle], outputs=[result]),
+              Stage('double', double, inputs=[source], outputs=[middle]),
+              Stage('extract', extract, outputs=[source])]
+    run_pipeline(stages)
+    assert runs == ['extract', 'double', 'total']
+    assert read_table(result)['a'].tolist() == [6]
+
+    run_pipeline(stages)
+    assert runs == ['extract', 'double', 'total']
+
+    # A stage without inputs runs again only when it is forced
+    run_pipeline(stages, force=['extract'])
+    assert runs == ['extract', 'double', 'total', 'extract']
+
+    write_table(pd.DataFrame({'a': [1, 2, 3]}), source)
+    run_pipeline(stages)
+    assert runs[4:] == ['double', 'total']
+    assert read_table(result)['a'].tolist() == [12]
+
+    os.remove(table_path(result))
+    run_pipeline(stages, until='double')
+    assert runs[6:] == []
+    run_pipeline(stages)
+    assert runs[6:] == ['total']
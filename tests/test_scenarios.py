@@ -0,0 +1,59 @@
+import multiprocessing.util
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+import scenarios
+from benchmark_districting import synthetic_ballots
+from districing import get_districting_arrays, pre_process_data
+from districting_engine import DistrictingEngine
+from elecetions_constatns import ElectionsConstants
+from scenarios import Scenario, attach_arrays, detach_arrays, run_scenarios, scenarios_grid, share_arrays
+
+
+def worker_state(_) -> tuple[int, bool]:
+    finalizers = [finalizer for finalizer in multiprocessing.util._finalizer_registry.values()
+                  if finalizer._callback is detach_arrays]
+    return len(scenarios._shared_memory), len(finalizers) == 1
+
+
+def test_scenario_directions_are_validated():
+    assert Scenario(directions=('north', 'south')).name.endswith('north_south')
+    with pytest.raises(ValueError):
+        Scenario(directions=('east', 'sout'))
+    with pytest.raises(ValueError):
+        Scenario(directions=())
+
+
+def test_workers_close_shared_memory():
+    blocks, specs = share_arrays({'values': np.arange(10)})
+    try:
+        with ProcessPoolExecutor(max_workers=1, initializer=attach_arrays, initargs=(specs,)) as executor:
+            assert list(executor.map(worker_state, [0])) == [(1, True)]
+        attach_arrays(specs)
+        block = scenarios._shared_memory[0]
+        detach_arrays()
+        assert block.buf is None and not scenarios._shared_arrays
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def test_run_scenarios(tmp_path, monkeypatch):
+    monkeypatch.setattr(ElectionsConstants, 'SCENARIOS_PATH', str(tmp_path))
+    monkeypatch.setattr(ElectionsConstants, 'SCENARIOS_SUMMARY_PATH', str(tmp_path / 'summary.csv'))
+    ballots = pre_process_data(synthetic_ballots(500, seed=2))
+    grid = scenarios_grid(seats=[5, 10], variances=[0.02], directions=[('east', 'west', 'north', 'south'),
+                                                                        ('north', 'south', 'east', 'west')])
+    summary = run_scenarios(ballots, grid, max_workers=2)
+    assert len(summary) == len(grid)
+    assert os.path.exists(ElectionsConstants.SCENARIOS_SUMMARY_PATH)
+    arrays = get_districting_arrays(ballots)
+    for scenario in grid:
+        expected = DistrictingEngine(**arrays, number_of_seats=scenario.seats, variance=scenario.variance,
+                                     directions=scenario.directions).run()
+        row = summary[summary['scenario'] == scenario.name].iloc[0]
+        assert row['districts'] == len(np.unique(expected[expected >= 0]))
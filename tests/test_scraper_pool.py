@@ -0,0 +1,77 @@
+import json
+import os
+
+import pytest
+
+from elecetions_constatns import ElectionsConstants
+from scraper_pool import BallotResultsScraper, scrape_towns_ballots
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'fixtures')
+# The fixture of the page, and a variant whose closed lists keep their options
+FIXTURES = ['ballotresults.html', 'ballotresults_hidden_lists.html']
+TOWNS = ['אבו גוש', 'אופקים', 'באר שבע', 'תל אביב יפו']
+
+needs_chrome = pytest.mark.skipif(not os.path.exists(ElectionsConstants.CHROMEDRIVER_PATH),
+                                  reason=f'No chromedriver at {ElectionsConstants.CHROMEDRIVER_PATH}')
+
+
+def fixture_url(fixture: str) -> str:
+    return f'file://{os.path.join(FIXTURES_PATH, fixture)}'
+
+
+@pytest.fixture(params=FIXTURES)
+def scraper(request):
+    scraper = BallotResultsScraper(fixture_url(request.param), timeout=5)
+    yield scraper
+    scraper.quit()
+
+
+@needs_chrome
+def test_extract_towns(scraper):
+    assert scraper.extract_towns() == TOWNS
+
+
+@needs_chrome
+def test_extract_town_ballots(scraper):
+    scraper.extract_towns()
+    scraper.load_page()
+    assert scraper.extract_town_ballots('אופקים') == ['- בחר קלפי -', 'בית ספר אופקים קלפי 2001',
+                                                      'בית ספר אופקים קלפי 2002', 'מתנס אופקים קלפי 2003']
+    scraper.load_page()
+    assert scraper.extract_town_ballots('באר שבע') == ['- בחר קלפי -', 'בית ספר רגר קלפי 3001',
+                                                       'אולם ספורט קלפי 3002']
+
+
+@needs_chrome
+@pytest.mark.parametrize('fixture', FIXTURES)
+def test_scrape_towns_ballots(tmp_path, fixture):
+    assert scrape_towns_ballots(workers=2, url=fixture_url(fixture), output_path=str(tmp_path)) == len(TOWNS)
+    with open(tmp_path / 'אבו גוש.json', encoding='utf-8') as f:
+        assert json.load(f)[ElectionsConstants.BALLOTS] == ['- בחר קלפי -', 'בית ספר אבו גוש קלפי 1001',
+                                                            'מתנס אבו גוש קלפי 1002']
+
+
+class UnreachableDriver:
+    """
+    A WebDriver of a page that can not be loaded, that records whether it was quit.
+    """
+    drivers = []
+
+    def __init__(self):
+        self.quitted = False
+        UnreachableDriver.drivers.append(self)
+
+    def get(self, url: str):
+        raise Exception(f'Can not load {url}')
+
+    def quit(self):
+        self.quitted = True
+
+
+def test_scrape_towns_ballots_quits_drivers_on_failure(tmp_path):
+    UnreachableDriver.drivers = []
+    with pytest.raises(Exception, match='Can not load'):
+        scrape_towns_ballots(workers=2, url='file:///unreachable', output_path=str(tmp_path),
+                             driver_factory=UnreachableDriver)
+    assert UnreachableDriver.drivers and all(driver.quitted for driver in UnreachableDriver.drivers)
+
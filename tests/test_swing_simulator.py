@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from districting_engine import UNASSIGNED
+from election_results import district_votes, district_winners, national_seats
+from swing_simulator import SwingModel, simulate_swings
+
+
+@pytest.fixture(scope='module')
+def stations() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    :return: the votes, district and region of 400 stations, with unassigned stations and an empty district 7
+    """
+    rng = np.random.default_rng(0)
+    votes = rng.poisson([200, 180, 60, 5, 1], size=(400, 5)).astype(np.int32)
+    districts = rng.integers(7, size=400)
+    districts[rng.random(400) < 0.05] = UNASSIGNED
+    districts[-1] = 8
+    return votes, districts, rng.integers(20, size=400)
+
+
+def test_zero_swing_gives_the_baseline_seats(stations):
+    votes, districts, regions = stations
+    baseline_votes = district_votes(votes, districts)
+    winners, _ = district_winners(baseline_votes)
+    baseline = national_seats(winners, votes.shape[1], valid=baseline_votes.any(axis=1))[0]
+    seats = simulate_swings(votes, districts, regions, SwingModel(0, 0, 0), trials=50)
+    np.testing.assert_array_equal(seats, np.tile(baseline, (50, 1)))
+
+
+def test_seats_are_the_districts_with_votes(stations):
+    votes, districts, regions = stations
+    seats = simulate_swings(votes, districts, regions, SwingModel(0.3, 0.2, 0.2), trials=200)
+    assert (seats.sum(axis=1) == 8).all()
+    # The swings change the winners of some trials
+    assert len(np.unique(seats, axis=0)) > 1
+
+
+def test_results_do_not_depend_on_workers_or_chunks(stations):
+    votes, districts, regions = stations
+    expected = simulate_swings(votes, districts, regions, trials=300, seed=3)
+    np.testing.assert_array_equal(simulate_swings(votes, districts, regions, trials=300, seed=3, max_workers=2),
+                                  expected)
+    # A budget too small for a single trial simulates a trial per chunk
+    np.testing.assert_array_equal(simulate_swings(votes, districts, regions, trials=300, seed=3, memory_budget=1),
+                                  expected)
+    np.testing.assert_array_equal(simulate_swings(votes, districts, regions, trials=300, seed=3, max_workers=2,
+                                                  memory_budget=40_000), expected)
+    assert not np.array_equal(simulate_swings(votes, districts, regions, trials=300, seed=4), expected)
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from elecetions_constatns import ElectionsConstants
+from table_store import compact_table, read_table, table_path, write_table
+
+
+@pytest.fixture
+def ballots():
+    return pd.DataFrame({ElectionsConstants.TOWN_NAME: ['אופקים', 'אופקים', 'באר שבע'],
+                         ElectionsConstants.BALLOT_ID: [1, 2, 1],
+                         ElectionsConstants.LAT: [31.3141592653, 31.3141592654, 31.2518],
+                         ElectionsConstants.LNG: [34.6206, 34.6207, 34.7913],
+                         ElectionsConstants.DISTRICT: [0, None, 1],
+                         'notes': ['12', '007', 'a']})
+
+
+def test_compact_table(ballots):
+    compact = compact_table(ballots)
+    assert isinstance(compact[ElectionsConstants.TOWN_NAME].dtype, pd.CategoricalDtype)
+    assert compact[ElectionsConstants.BALLOT_ID].dtype == np.int8
+    assert compact[ElectionsConstants.LAT].dtype == np.float64
+    assert compact[ElectionsConstants.LAT].equals(ballots[ElectionsConstants.LAT])
+    assert compact[ElectionsConstants.DISTRICT].isnull().tolist() == [False, True, False]
+    # The columns that are not listed keep their values, even when they look like numbers
+    assert compact['notes'].tolist() == ['12', '007', 'a']
+
+
+@pytest.mark.parametrize('table_format', ['parquet', 'csv'])
+def test_write_table_round_trip(ballots, tmp_path, capsys, table_format):
+    path = str(tmp_path / 'ballots.csv')
+    write_table(ballots, path, table_format=table_format)
+    assert table_path(path, table_format) in capsys.readouterr().out
+    table = read_table(path, table_format=table_format)
+    assert table[ElectionsConstants.LAT].tolist() == ballots[ElectionsConstants.LAT].tolist()
+    assert table[ElectionsConstants.TOWN_NAME].astype(object).tolist() == \
+        ballots[ElectionsConstants.TOWN_NAME].tolist()
+    columns = [ElectionsConstants.BALLOT_ID, ElectionsConstants.LNG]
+    assert list(read_table(path, columns=columns, table_format=table_format).columns) == columns